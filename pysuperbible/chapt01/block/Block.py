@@ -18,6 +18,8 @@ from OpenGL.GLUT import *
 
 sys.path.append('../../lib')
 from math3d import *
+from atlas import TextureAtlas
+from matrixstack import MatrixStack
 
 
 def gl_vec(typ, *args):
@@ -60,19 +62,23 @@ class Window(pyglet.window.Window):
         [10.0, -25.0, 0.0],
         [10.0, -25.0, -10.0],
     ]
-    textures = []
-    mCubeTransform = [0.0] * 16
+    # One atlas texture holds the floor and the three cube faces
+    texture = None
+    regions = []
+    mShadow = M3DMatrix44f()
     pPlane = M3DVector4f()
 
     def __init__(self):
+        # The modelview is kept on the CPU so the shadow pass needs no
+        # readback from GL
+        self.modelview = MatrixStack()
         super(Window, self).__init__()
-        self.images = [
-            pyglet.image.load('floor.tga'),
-            pyglet.image.load('Block4.tga'),
-            pyglet.image.load('Block5.tga'),
-            pyglet.image.load('Block6.tga'),
-        ]
-        self.textures[:] = [im.get_texture().id for im in self.images]
+        names = ('floor.tga', 'Block4.tga', 'Block5.tga', 'Block6.tga')
+        atlas = TextureAtlas(padding=2)
+        for name in names:
+            atlas.add_file(name)
+        self.texture = atlas.upload(mipmap=False)
+        self.regions[:] = [atlas[name] for name in names]
 
     def on_key_press(self, symbol, modifiers):
         if symbol == key.SPACE:
@@ -85,7 +91,9 @@ class Window(pyglet.window.Window):
         glShadeModel(GL_SMOOTH)
         glEnable(GL_NORMALIZE)
         
-        glPushMatrix()
+        modelview = self.modelview
+        modelview.push()
+        modelview.flush()
         
         # Draw plane that the cube rests on
         glDisable(GL_LIGHTING)
@@ -102,7 +110,8 @@ class Window(pyglet.window.Window):
             self._enable_lighting()
 
         # Move the cube slightly forward and to the left
-        glTranslatef(-10.0, 0.0, 10.0)
+        modelview.translate(-10.0, 0.0, 10.0)
+        modelview.flush()
 
         # Draw image depending on nStep
         if self.nStep == 0:
@@ -125,7 +134,7 @@ class Window(pyglet.window.Window):
             # With textures applied
             self._draw_cube_textured()
             
-        glPopMatrix()
+        modelview.pop()
 
     def _enable_lighting(self):
         glEnable(GL_DEPTH_TEST)
@@ -191,26 +200,27 @@ class Window(pyglet.window.Window):
         glEnd()
 
     def _draw_cube_colored_with_shadow(self):
-        mCubeTransform = gl_vec(GLfloat, self.mCubeTransform)
+        mShadow = self.mShadow
         pPlane = self.pPlane
+        modelview = self.modelview
         
         # Draw a shadow with some lighting
-        glGetFloatv(GL_MODELVIEW_MATRIX, mCubeTransform)
         glutSolidCube(50.0)
-        glPopMatrix()
+        modelview.pop()
 
         # Disable lighting, we'll just draw the shadow as black
         glDisable(GL_LIGHTING)
         
-        glPushMatrix()
+        modelview.push()
 
         ground = self.ground
         m3dGetPlaneEquation(pPlane, ground[0], ground[1], ground[2])
-        m3dMakePlanarShadowMatrix(mCubeTransform, pPlane, self.vLightPos)
+        m3dMakePlanarShadowMatrix(mShadow, pPlane, self.vLightPos)
         #MakeShadowMatrix(ground, lightpos, cubeXform);
-        glMultMatrixf(mCubeTransform)
+        modelview.mult(mShadow)
         
-        glTranslatef(-10.0, 0.0, 10.0)
+        modelview.translate(-10.0, 0.0, 10.0)
+        modelview.flush()
         
         # Set drawing color to Black
         glColor3f(0.0, 0.0, 0.0)
@@ -220,80 +230,79 @@ class Window(pyglet.window.Window):
     def _draw_tabletop_textured(self):
         glColor3ub(255,255,255)
         glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, self.textures[0])
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        floor = self.regions[0]
         glBegin(GL_QUADS)
-        glTexCoord2f(0.0, 0.0)
+        glTexCoord2f(*floor.remap(0.0, 0.0))
         glVertex3f(-100.0, -25.3, -100.0)
-        glTexCoord2f(0.0, 1.0)
+        glTexCoord2f(*floor.remap(0.0, 1.0))
         glVertex3f(-100.0, -25.3, 100.0)		
-        glTexCoord2f(1.0, 1.0)
+        glTexCoord2f(*floor.remap(1.0, 1.0))
         glVertex3f(100.0,  -25.3, 100.0)
-        glTexCoord2f(1.0, 0.0)
+        glTexCoord2f(*floor.remap(1.0, 0.0))
         glVertex3f(100.0,  -25.3, -100.0)
         glEnd()
 
     def _draw_cube_textured(self):
-        mCubeTransform = gl_vec(GLfloat, self.mCubeTransform)
+        mShadow = self.mShadow
         pPlane = self.pPlane
-        textures = self.textures
+        regions = self.regions
         ground = self.ground
+        modelview = self.modelview
         
         glColor3ub(255,255,255)
-        glGetFloatv(GL_MODELVIEW_MATRIX, mCubeTransform)
 
-        # Front Face (before rotation)
-        glBindTexture(GL_TEXTURE_2D, textures[1])
+        # All three faces come from the atlas, so they go in one batch
+        glBindTexture(GL_TEXTURE_2D, self.texture)
         glBegin(GL_QUADS)
-        glTexCoord2f(1.0, 1.0)
+        # Front Face (before rotation)
+        face = regions[1]
+        glTexCoord2f(*face.remap(1.0, 1.0))
         glVertex3f(25.0, 25.0, 25.0)
-        glTexCoord2f(1.0, 0.0)
+        glTexCoord2f(*face.remap(1.0, 0.0))
         glVertex3f(25.0, -25.0, 25.0)
-        glTexCoord2f(0.0, 0.0)
+        glTexCoord2f(*face.remap(0.0, 0.0))
         glVertex3f(-25.0, -25.0, 25.0)
-        glTexCoord2f(0.0, 1.0)
+        glTexCoord2f(*face.remap(0.0, 1.0))
         glVertex3f(-25.0, 25.0, 25.0)
-        glEnd()
 
         # Top of cube
-        glBindTexture(GL_TEXTURE_2D, textures[2])
-        glBegin(GL_QUADS)
-        # Front Face
-        glTexCoord2f(0.0, 0.0)
+        face = regions[2]
+        glTexCoord2f(*face.remap(0.0, 0.0))
         glVertex3f(25.0, 25.0, 25.0)
-        glTexCoord2f(1.0, 0.0)
+        glTexCoord2f(*face.remap(1.0, 0.0))
         glVertex3f(25.0, 25.0, -25.0)
-        glTexCoord2f(1.0, 1.0)
+        glTexCoord2f(*face.remap(1.0, 1.0))
         glVertex3f(-25.0, 25.0, -25.0)
-        glTexCoord2f(0.0, 1.0)
+        glTexCoord2f(*face.remap(0.0, 1.0))
         glVertex3f(-25.0, 25.0, 25.0)
-        glEnd()
 
         # Last two segments for effect
-        glBindTexture(GL_TEXTURE_2D, textures[3])
-        glBegin(GL_QUADS)
-        glTexCoord2f(1.0, 1.0)
+        face = regions[3]
+        glTexCoord2f(*face.remap(1.0, 1.0))
         glVertex3f(25.0, 25.0, -25.0)
-        glTexCoord2f(1.0, 0.0)
+        glTexCoord2f(*face.remap(1.0, 0.0))
         glVertex3f(25.0, -25.0, -25.0)
-        glTexCoord2f(0.0, 0.0)
+        glTexCoord2f(*face.remap(0.0, 0.0))
         glVertex3f(25.0, -25.0, 25.0)
-        glTexCoord2f(0.0, 1.0)
+        glTexCoord2f(*face.remap(0.0, 1.0))
         glVertex3f(25.0, 25.0, 25.0)
         glEnd()
 
-        glPopMatrix()
+        modelview.pop()
 
         # Disable lighting, we'll just draw the shadow as black
         glDisable(GL_LIGHTING)
         glDisable(GL_TEXTURE_2D)
         
-        glPushMatrix()
+        modelview.push()
 
         m3dGetPlaneEquation(pPlane, ground[0], ground[1], ground[2])
-        m3dMakePlanarShadowMatrix(mCubeTransform, pPlane, self.vLightPos)
-        glMultMatrixf(mCubeTransform)
+        m3dMakePlanarShadowMatrix(mShadow, pPlane, self.vLightPos)
+        modelview.mult(mShadow)
         
-        glTranslatef(-10.0, 0.0, 10.0)
+        modelview.translate(-10.0, 0.0, 10.0)
+        modelview.flush()
         
         # Set drawing color to Black
         glColor3f(0.0, 0.0, 0.0)
@@ -318,10 +327,13 @@ class Window(pyglet.window.Window):
         # Set the clipping volume
         glOrtho(-100.0, windowWidth, -100.0, windowHeight, -200.0, 200.0)
         glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        modelview = self.modelview
+        modelview.load_identity()
+        modelview.flush()
         glLightfv(GL_LIGHT0, GL_POSITION, self.vLightPos)
-        glRotatef(30.0, 1.0, 0.0, 0.0)
-        glRotatef(330.0, 0.0, 1.0, 0.0)
+        modelview.rotate(30.0, 1.0, 0.0, 0.0)
+        modelview.rotate(330.0, 0.0, 1.0, 0.0)
+        modelview.flush()
 
 if __name__ == '__main__':
     window = Window()
@@ -10,6 +10,7 @@
 
 import sys
 
+import numpy
 import pyglet
 from pyglet.gl import *
 from pyglet.window import key
@@ -27,9 +28,32 @@ class Window(pyglet.window.Window):
     # Angle of revolution around the nucleus
     fElect1 = 0.0
 
+    # Each electron orbit as (tilt of the orbit about z in degrees, offset
+    # from the nucleus)
+    orbits = [
+        (0.0, (90.0, 0.0, 0.0)),
+        (45.0, (-70.0, 0.0, 0.0)),
+        (360.0-45.0, (0.0, 0.0, 60.0)),
+    ]
+
     def __init__(self, w, h, title='Pyglet App'):
         super(Window, self).__init__(w, h, title)
 
+        # Atom.py builds each electron's transformation with a chain of
+        # glRotatef and glTranslatef calls. Here the parts that never
+        # change are composed once, viewing transformation and tilt on one
+        # side of the spin and the offset on the other, and each frame all
+        # electrons are finished with two batched multiplies.
+        self.mTilts = numpy.empty((len(self.orbits), 16), numpy.float32)
+        self.mOffsets = numpy.empty((len(self.orbits), 16), numpy.float32)
+        for i, (tilt, offset) in enumerate(self.orbits):
+            m3dComposeMatrix44(self.mTilts[i], [
+                ('translate', 0.0, 0.0, -300.0),
+                ('rotate', m3dDegToRad(tilt), 0.0, 0.0, 1.0)])
+            m3dComposeMatrix44(self.mOffsets[i], [('translate',) + offset])
+        self.mSpin = M3DMatrix44f()
+        self.mElectrons = numpy.empty((len(self.orbits), 16), numpy.float32)
+
         glEnable(GL_DEPTH_TEST)	    # Hidden surface removal
         glFrontFace(GL_CCW)		    # Counter clock-wise polygons face out
         glEnable(GL_CULL_FACE)		# Do not calculate inside of jet
@@ -62,37 +86,16 @@ class Window(pyglet.window.Window):
         # Yellow Electrons
         glColor3ub(255,255,0)
 
-        # First Electron Orbit
-        # Save viewing transformation
-        glPushMatrix()
-
-        # Rotate by angle of revolution
-        glRotatef(fElect1, 0.0, 1.0, 0.0)
-
-        # Translate out from origin to orbit distance
-        glTranslatef(90.0, 0.0, 0.0)
-
-        # Draw the electron
-        glutSolidSphere(6.0, 15, 15)
-
-        # Restore the viewing transformation
-        glPopMatrix()
-
-        # Second Electron Orbit
-        glPushMatrix()
-        glRotatef(45.0, 0.0, 0.0, 1.0)
-        glRotatef(fElect1, 0.0, 1.0, 0.0)
-        glTranslatef(-70.0, 0.0, 0.0)
-        glutSolidSphere(6.0, 15, 15)
-        glPopMatrix()
-
-        # Third Electron Orbit
-        glPushMatrix()
-        glRotatef(360.0-45.0,0.0, 0.0, 1.0)
-        glRotatef(fElect1, 0.0, 1.0, 0.0)
-        glTranslatef(0.0, 0.0, 60.0)
-        glutSolidSphere(6.0, 15, 15)
-        glPopMatrix()
+        # Rotate by angle of revolution, between the tilt of each orbit
+        # and the translation out to orbit distance
+        m3dComposeMatrix44(self.mSpin, [('rotate', m3dDegToRad(fElect1), 0.0, 1.0, 0.0)])
+        m3dMatrixMultiply44Array(self.mElectrons, self.mTilts, self.mSpin)
+        m3dMatrixMultiply44Array(self.mElectrons, self.mElectrons, self.mOffsets)
+
+        # Draw the electrons, one matrix load each
+        for m in self.mElectrons:
+            glLoadMatrixf((GLfloat * 16)(*m))
+            glutSolidSphere(6.0, 15, 15)
 
     def _update(self, dt):
         # Increment the angle of revolution
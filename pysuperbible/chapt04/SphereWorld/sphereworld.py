@@ -30,6 +30,8 @@ class Window(pyglet.window.Window):
 
     # GL frame objects
     NUM_SPHERES = 50
+    # Reused for every sphere's actor transform
+    mActor = M3DMatrix44f()
     spheres = [None] * NUM_SPHERES
     frameCamera = GLFrame()
     # Rotation angle for animation
@@ -97,7 +99,7 @@ class Window(pyglet.window.Window):
         # Draw the randomly located spheres
         for i in range(self.NUM_SPHERES):
             glPushMatrix()
-            self.rot_mat = self.spheres[i].ApplyActorTransform()
+            self.rot_mat = self.spheres[i].ApplyActorTransform(out=self.mActor)
 #            glutSolidSphere(0.1, 13, 4)
             glCallList(self.dlists['sphere'])
             glPopMatrix()
@@ -7,7 +7,6 @@
 """
 
 
-from math import cos, sin
 import sys
 
 import pyglet
@@ -20,6 +19,8 @@ from OpenGL.GLUT import *
 sys.path.append('../../lib')
 from gltools import *
 from math3d import *
+from mesh import torus_mesh
+from vertexpipe import VertexPipeline
 
 
 def gl_vec(typ, *args):
@@ -106,46 +107,24 @@ class Window(pyglet.window.Window):
         glLoadIdentity()
 
 
+# The torus is built once; each frame the pipeline transforms all of its
+# vertices in one batch.
+torusPipeline = None
+
 def DrawTorus(mTransform):
-    """Draw a torus (doughnut), using the current 1D texture for light shading"""
-    majorRadius = 0.35
-    minorRadius = 0.15
-    numMajor = 40
-    numMinor = 20
-    objectVertex = M3DVector3f()         # Vertex in object/eye space
-    transformedVertex = M3DVector3f()    # New Transformed vertex   
-    majorStep = 2.0*M3D_PI / numMajor
-    minorStep = 2.0*M3D_PI / numMinor
-    
-    for i in range(numMajor):
-        a0 = i * majorStep;
-        a1 = a0 + majorStep;
-        x0 = cos(a0)
-        y0 = sin(a0)
-        x1 = cos(a1)
-        y1 = sin(a1)
-
-        glBegin(GL_TRIANGLE_STRIP);
-        for j in range(numMinor+1):
-            b = j * minorStep
-            c = cos(b)
-            r = minorRadius * c + majorRadius
-            z = minorRadius * sin(b)
-
-            # First point
-            objectVertex.x = x0*r
-            objectVertex.y = y0*r
-            objectVertex.z = z
-            m3dTransformVector3(transformedVertex, objectVertex, mTransform)
-            glVertex3fv(gl_vec(GLfloat, transformedVertex[:]))
-
-            # Second point
-            objectVertex.x = x1*r
-            objectVertex.y = y1*r
-            objectVertex.z = z
-            m3dTransformVector3(transformedVertex, objectVertex, mTransform)
-            glVertex3fv(gl_vec(GLfloat, transformedVertex[:]))
-        glEnd()
+    """Draw a torus (doughnut), transforming its vertices by mTransform on
+    the CPU"""
+    global torusPipeline
+    if torusPipeline is None:
+        majorRadius = 0.35
+        minorRadius = 0.15
+        numMajor = 40
+        numMinor = 20
+        torusPipeline = VertexPipeline(
+            torus_mesh(majorRadius, minorRadius, numMajor, numMinor))
+
+    torusPipeline.process(mTransform)
+    torusPipeline.draw()
 
 
 if __name__ == '__main__':
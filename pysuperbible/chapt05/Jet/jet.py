@@ -20,6 +20,11 @@ from OpenGL.GLUT import *
 sys.path.append('../../lib')
 from gltools import *
 from math3d import *
+from immediate import ImmediateBatch
+
+# Batch the glBegin/glEnd drawing below into vertex arrays
+immediate = ImmediateBatch()
+immediate.install(globals())
 
 
 class Window(pyglet.window.Window):
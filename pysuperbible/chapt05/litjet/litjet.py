@@ -20,6 +20,11 @@ sys.path.append('../../lib')
 from gltools import *
 from math3d import *
 from glframe import GLFrame
+from immediate import ImmediateBatch
+
+# Batch the glBegin/glEnd drawing below into vertex arrays
+immediate = ImmediateBatch()
+immediate.install(globals())
 
 
 def gl_vec(typ, *args):
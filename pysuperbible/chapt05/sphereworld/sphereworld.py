@@ -58,6 +58,8 @@ class Window(pyglet.window.Window):
 
     # GL frame objects
     NUM_SPHERES = 30
+    # Reused for every sphere's actor transform
+    mActor = M3DMatrix44f()
     spheres = [None] * NUM_SPHERES
     frameCamera = GLFrame()
     
@@ -201,7 +203,7 @@ class Window(pyglet.window.Window):
         
         for i in range(self.NUM_SPHERES):
             glPushMatrix()
-            self.spheres[i].ApplyActorTransform()
+            self.spheres[i].ApplyActorTransform(out=self.mActor)
 #            glutSolidSphere(0.3, 17, 9)
             glCallList(self.dlists['big sphere'])
             glPopMatrix()
@@ -6,12 +6,16 @@
 // and shadows.
 // Program by Richard S. Wright Jr.
 ## Pythonated for Pyglet by Gummbum
+
+Press F to switch the ground to fog computed per vertex on the CPU, with
+spheres and ground chunks beyond the fog end left out entirely.
 """
 
 
 from random import random as rand
 import sys
 
+import numpy
 import pyglet
 from pyglet.gl import *
 from pyglet.window import key
@@ -23,6 +27,11 @@ sys.path.append('../../lib')
 from gltools import *
 from math3d import *
 from glframe import GLFrame
+from ground import Ground
+from fog import Fog, eye_depth
+from vertexpipe import VertexPipeline, DirectionalLight, as_matrix
+from streambuffer import StreamBuffer
+from matrixstack import MatrixStack
 
 
 def gl_vec(typ, *args):
@@ -56,6 +65,8 @@ class Window(pyglet.window.Window):
 
     # GL frame objects
     NUM_SPHERES = 30
+    # Reused for every sphere's actor transform
+    mActor = M3DMatrix44f()
     spheres = [None] * NUM_SPHERES
     frameCamera = GLFrame()
     
@@ -78,8 +89,13 @@ class Window(pyglet.window.Window):
     
     # Shadow
     mShadowMatrix = [0.0] * 16
+    mCamera = M3DMatrix44f()
+
+    groundColor = numpy.array((0.60, 0.40, 0.10, 1.0), numpy.float32)
 
     def __init__(self, w, h, title='Pyglet App'):
+        # The modelview is kept on the CPU; the CPU fog path needs it
+        self.modelview = MatrixStack()
         super(Window, self).__init__(w, h, title)
         
         # Grayish background
@@ -141,7 +157,22 @@ class Window(pyglet.window.Window):
         self._make_display_list('big sphere', self._draw_big_sphere)
         self._make_display_list('small sphere', self._draw_small_sphere)
         self._make_display_list('torus', self._draw_torus)
-        self._make_display_list('ground', self._draw_ground)
+        self.ground = Ground(20.0, 1.0, y=-0.4, chunk_cells=10)
+        self.ground.upload()
+
+        # CPU fog path, using the fog set up above
+        self.fog = Fog.from_gl()
+        self.cpuFog = False
+        # One stream for every chunk's per-frame vertices
+        self.groundStream = StreamBuffer()
+        self.groundPipes = [VertexPipeline(chunk.mesh, stream=self.groundStream)
+                            for chunk in self.ground.chunks]
+        self.groundCenters = numpy.array([chunk.center for chunk in self.ground.chunks])
+        self.groundRadii = numpy.array([
+            numpy.sqrt(((chunk.mesh.positions - chunk.center) ** 2).sum(1)).max()
+            for chunk in self.ground.chunks])
+        self.spherePositions = numpy.array([s.origin[:] for s in self.spheres], numpy.float32)
+        self.sphereVisible = [True] * self.NUM_SPHERES
 
     def fps(self, *args):
         print 'fps',pyglet.clock.get_fps()
@@ -159,31 +190,66 @@ class Window(pyglet.window.Window):
     def on_draw(self):
         self.clear()
 
-        glPushMatrix()
-        self.frameCamera.ApplyCameraTransform()
+        modelview = self.modelview
+        modelview.push()
+        self.frameCamera.GetCameraOrientation(self.mCamera)
+        modelview.mult(self.mCamera)
+        modelview.translate(*-self.frameCamera.origin)
+        modelview.flush()
         
         # Position light before any other transformations
         glLightfv(GL_LIGHT0, GL_POSITION, self.fLightPos)
         
         # Draw the ground
-        glColor3f(0.60, .40, .10)
-#        self._draw_ground()
-        self._call_display_list('ground')
+        if self.cpuFog:
+            self._draw_ground_cpu_fog()
+        else:
+            glColor3f(0.60, .40, .10)
+            self.ground.draw()
         
         # Draw shadows first
         glDisable(GL_DEPTH_TEST)
         glDisable(GL_LIGHTING)
-        glPushMatrix()
-        glMultMatrixf(self.mShadowMatrix)
-        self._draw_inhabitants(1)
-        glPopMatrix()
+        with modelview:
+            modelview.mult(self.mShadowMatrix)
+            modelview.flush()
+            self._draw_inhabitants(1)
+        modelview.flush()
         glEnable(GL_LIGHTING)
         glEnable(GL_DEPTH_TEST)
         
         # Draw inhabitants normally
         self._draw_inhabitants(0)
 
-        glPopMatrix()
+        modelview.pop()
+
+    def _draw_ground_cpu_fog(self):
+        # Light and fog the ground per vertex on the CPU and draw it with
+        # GL lighting and fog off. Chunks, and spheres, that are entirely
+        # past the fog are skipped.
+        camera = self.modelview.matrix
+        visible = self.fog.visible(eye_depth(self.groundCenters, camera), self.groundRadii)
+        self.sphereVisible = self.fog.visible(
+            eye_depth(self.spherePositions, camera), 0.3).tolist()
+
+        # The light is far enough away to treat as directional
+        lightDir = numpy.dot(numpy.asarray(self.fLightPos[:3]), as_matrix(camera)[:3, :3])
+        light = DirectionalLight(lightDir,
+            ambient=self.groundColor * self.fLowLight[0], diffuse=self.groundColor)
+
+        glDisable(GL_FOG)
+        glDisable(GL_LIGHTING)
+        with self.modelview:
+            self.modelview.load_identity()
+            self.modelview.flush()
+            for pipe, show in zip(self.groundPipes, visible):
+                if show:
+                    pipe.process(camera, light=light, fog=self.fog)
+                    pipe.draw()
+        self.groundStream.end_frame()
+        self.modelview.flush()
+        glEnable(GL_LIGHTING)
+        glEnable(GL_FOG)
 
     def _draw_inhabitants(self, nShadow):
         # Draw random inhabitants and the rotating torus/sphere duo
@@ -195,8 +261,10 @@ class Window(pyglet.window.Window):
             glColor3f(0.0, 0.0, 0.0)
 
         for i in range(self.NUM_SPHERES):
+            if self.cpuFog and not self.sphereVisible[i]:
+                continue
             glPushMatrix()
-            self.spheres[i].ApplyActorTransform()
+            self.spheres[i].ApplyActorTransform(out=self.mActor)
 #            glutSolidSphere(0.3, 17, 9)
             self._call_display_list('big sphere')
             glPopMatrix()
@@ -234,24 +302,6 @@ class Window(pyglet.window.Window):
     def _draw_torus(self):
         gltDrawTorus(0.35, 0.15, 61, 37)
 
-    def _draw_ground(self):
-        # Draw the ground as a series of triangle strips
-        fExtent = 20.0
-        fStep = 1.0
-        y = -0.4
-        
-        iStrip = -fExtent
-        while iStrip <= fExtent:
-            glBegin(GL_TRIANGLE_STRIP)
-            glNormal3f(0.0, 1.0, 0.0)   # All Point up
-            iRun = fExtent
-            while iRun >= -fExtent:
-                glVertex3f(iStrip, y, iRun)
-                glVertex3f(iStrip + fStep, y, iRun)
-                iRun -= fStep
-            glEnd()
-            iStrip += fStep
-
     def _update(self, dt):
         self.yRot = (self.yRot + 2.0) % 360.0
         if self.forward != 0.0:
@@ -279,7 +329,8 @@ class Window(pyglet.window.Window):
         gluPerspective(35.0, fAspect, 1.0, 50.0)
             
         glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        self.modelview.load_identity()
+        self.modelview.flush()
     
     def on_key_press(self, sym, mods):
         if sym in (key.UP,key.W):
@@ -294,6 +345,8 @@ class Window(pyglet.window.Window):
             self.right = 0.1
         elif sym == key.E:
             self.right = -0.1
+        elif sym == key.F:
+            self.cpuFog = not self.cpuFog
         else:
             super(Window, self).on_key_press(sym, mods)
     
@@ -313,6 +366,10 @@ class Window(pyglet.window.Window):
     
     def on_close(self):
         pyglet.clock.unschedule(self._update)
+        for pipe in self.groundPipes:
+            pipe.delete()
+        self.groundStream.delete()
+        self.ground.delete()
         pyglet.clock.unschedule(self.fps)
         super(Window, self).on_close()
 
@@ -4,6 +4,10 @@
 // Demonstrates Motion Blur with the Accumulation buffer
 // Program by Richard S. Wright Jr.
 ## Pythonated for Pyglet by Gummbum
+
+Press space to switch between the accumulation buffer, which draws the
+scene fPasses times per frame, and a ring of the last frames in textures,
+which draws it once and blends the ring together.
 """
 
 
@@ -20,6 +24,8 @@ sys.path.append('../../lib')
 from gltools import *
 from math3d import *
 from glframe import GLFrame
+from ground import checkerboard
+from motionblur import MotionBlur
 
 
 def gl_vec(typ, *args):
@@ -52,6 +58,15 @@ def gl_vec(typ, *args):
 class Window(pyglet.window.Window):
 
     yRot = 45.0
+
+    # Number of frames blended together
+    fPasses = 10
+    # Angle the sphere orbit turns each frame when blurring across frames
+    yStep = 1.5
+
+    # Made once there is a context; on_resize runs before that, from
+    # inside Window.__init__
+    blur = None
     
     # Light and material Data
     fLightPos = gl_vec(GLfloat, -100.0, 100.0, 50.0, 1.0)   # Point source
@@ -87,12 +102,32 @@ class Window(pyglet.window.Window):
         glColorMaterial(GL_FRONT, GL_AMBIENT_AND_DIFFUSE)
         glMateriali(GL_FRONT, GL_SHININESS, 128)
 
+        # Same weights as the accumulation passes: half for the newest
+        # frame, the rest shared by the older ones.
+        weights = [0.5] + [0.5 / (self.fPasses - 1)] * (self.fPasses - 1)
+        self.blur = MotionBlur(w, h, self.fPasses, weights)
+        self.useAccum = False
+
+        # Black and white checkerboard ground, half transparent
+        self.ground = checkerboard(20.0, 0.5,
+            colors=((1.0, 1.0, 1.0, 0.5), (0.0, 0.0, 0.0, 0.5)))
+        self.ground.upload()
+
         pyglet.clock.schedule_interval(self._update, 1.0/60.0)
 
     def on_draw(self):
+        if self.useAccum:
+            self._draw_accum()
+        else:
+            # Draw the scene once into the ring and blend the ring together
+            self.blur.begin()
+            self._draw_geometry()
+            self.blur.end()
+
+    def _draw_accum(self):
         self.clear()
         
-        fPasses = 10
+        fPasses = self.fPasses
         
         # Set the current rotation back a few degrees
         self.yRot = 35.0
@@ -117,7 +152,7 @@ class Window(pyglet.window.Window):
         self.clear()
         
         glPushMatrix()
-        self._draw_ground()
+        self.ground.draw()
         
         # Place the moving sphere
         glColor3f(1.0, 0.0, 0.0)
@@ -127,36 +162,9 @@ class Window(pyglet.window.Window):
         glutSolidSphere(0.1, 17, 9)
         glPopMatrix()
 
-    def _draw_ground(self):
-        # Draw the ground as a series of triangle strips. The 
-        # shading model and colors are set such that we end up 
-        # with a black and white checkerboard pattern.
-        fExtent = 20.0
-        fStep = 0.5
-        y = 0.0
-        iBounce = 0
-        
-        glShadeModel(GL_FLAT)
-        iStrip = -fExtent
-        while iStrip <= fExtent:
-            glBegin(GL_TRIANGLE_STRIP)
-            iRun = fExtent
-            while iRun >= -fExtent:
-                if iBounce % 2 == 0:
-                    fColor = 1.0
-                else:
-                    fColor = 0.0
-                glColor4f(fColor, fColor, fColor, 0.5)
-                glVertex3f(iStrip, y, iRun)
-                glVertex3f(iStrip + fStep, y, iRun)
-                iBounce += 1
-                iRun -= fStep
-            glEnd()
-            iStrip += fStep
-        glShadeModel(GL_SMOOTH)
-
     def _update(self, dt):
-        pass
+        if not self.useAccum:
+            self.yRot = (self.yRot + self.yStep) % 360.0
 
     def on_resize(self, w, h):
         # Prevent a divide by zero, when window is too short
@@ -165,6 +173,8 @@ class Window(pyglet.window.Window):
             h = 1
 
         glViewport(0, 0, w, h)
+        if self.blur is not None:
+            self.blur.resize(w, h)
             
         fAspect = w / h
 
@@ -181,9 +191,14 @@ class Window(pyglet.window.Window):
     
     def on_key_press(self, sym, mods):
         super(Window, self).on_key_press(sym, mods)
+        if sym == key.SPACE:
+            self.useAccum = not self.useAccum
+            self.blur.reset()
     
     def on_close(self):
         pyglet.clock.unschedule(self._update)
+        self.blur.delete()
+        self.ground.delete()
         super(Window, self).on_close()
 
 if __name__ == '__main__':
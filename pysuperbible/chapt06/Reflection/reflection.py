@@ -21,6 +21,8 @@ sys.path.append('../../lib')
 from gltools import *
 from math3d import *
 from glframe import GLFrame
+from ground import checkerboard
+from reflection import PlanarReflection
 
 
 def gl_vec(typ, *args):
@@ -64,6 +66,15 @@ class Window(pyglet.window.Window):
 
     yRot = 0.0
 
+    # The mirror is drawn at this fraction of the window resolution, every
+    # mirrorInterval frames
+    mirrorScale = 0.5
+    mirrorInterval = 1
+
+    # Made once there is a context; on_resize runs before that, from
+    # inside Window.__init__
+    mirror = None
+
     def __init__(self, w, h, title='Pyglet App'):
         super(Window, self).__init__(w, h, title)
 
@@ -91,7 +102,12 @@ class Window(pyglet.window.Window):
         
         self._make_display_list('sphere', self._draw_sphere)
         self._make_display_list('torus', self._draw_torus)
-        self._make_display_list('ground', self._draw_ground)
+        # Black and white checkerboard ground, half transparent
+        self.ground = checkerboard(20.0, 0.5,
+            colors=((1.0, 1.0, 1.0, 0.5), (0.0, 0.0, 0.0, 0.5)))
+        self.ground.upload()
+
+        self.mirror = PlanarReflection(w, h, self.mirrorScale, self.mirrorInterval)
 
         pyglet.clock.schedule_interval(self._update, 1.0/60.0)
 
@@ -109,22 +125,16 @@ class Window(pyglet.window.Window):
         self.clear()
 
         glPushMatrix()
-        # Move light under floor to light the "reflected" world
+        # Move light under floor to light the "reflected" world, and render
+        # the mirrored world into the reflection texture when it is due
         glLightfv(GL_LIGHT0, GL_POSITION, self.fLightPosMirror)
-        glPushMatrix()
-        glFrontFace(GL_CW)             # geometry is mirrored, swap orientation
-        glScalef(1.0, -1.0, 1.0)
-        self._draw_world()
-        glFrontFace(GL_CCW)
-        glPopMatrix()
+        self.mirror.update(self._draw_world)
     
-        # Draw the ground transparently over the reflection
+        # Draw the ground with the reflection showing through it
         glDisable(GL_LIGHTING)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-#        self._draw_ground()
-        self._call_display_list('ground')
-        glDisable(GL_BLEND)
+        self.mirror.begin_surface()
+        self.ground.draw()
+        self.mirror.end_surface()
         glEnable(GL_LIGHTING)
         
         # Restore correct lighting and draw the world correctly
@@ -138,31 +148,6 @@ class Window(pyglet.window.Window):
     def _draw_torus(self):
         gltDrawTorus(0.35, 0.15, 61, 37)
     
-    def _draw_ground(self):
-        fExtent = 20.0
-        fStep = 0.5
-        y = 0.0
-        iBounce = 0
-        
-        glShadeModel(GL_FLAT)
-        iStrip = -fExtent
-        while iStrip <= fExtent:
-            glBegin(GL_TRIANGLE_STRIP)
-            iRun = fExtent
-            while iRun >= -fExtent:
-                if iBounce % 2 == 0:
-                    fColor = 1.0
-                else:
-                    fColor = 0.0
-                glColor4f(fColor, fColor, fColor, 0.5)
-                glVertex3f(iStrip, y, iRun)
-                glVertex3f(iStrip+fStep, y, iRun)
-                iBounce += 1
-                iRun -= fStep
-            glEnd()
-            iStrip += fStep
-        glShadeModel(GL_SMOOTH)
-
     def _draw_world(self):
         glColor3f(1.0, 0.0, 0.0)
         glPushMatrix()
@@ -191,6 +176,8 @@ class Window(pyglet.window.Window):
             h = 1
 
         glViewport(0, 0, w, h)
+        if self.mirror is not None:
+            self.mirror.resize(w, h)
             
         fAspect = w / h
 
@@ -210,6 +197,8 @@ class Window(pyglet.window.Window):
     
     def on_close(self):
         pyglet.clock.unschedule(self._update)
+        self.ground.delete()
+        self.mirror.delete()
         super(Window, self).on_close()
 
 if __name__ == '__main__':
@@ -7,7 +7,6 @@
 """
 
 
-from math import cos, sin
 from random import random as rand
 import sys
 
@@ -22,6 +21,8 @@ sys.path.append('../../lib')
 from gltools import *
 from math3d import *
 from glframe import GLFrame
+from particles import ParticleSystem
+from geometry2d import GeometryCache, disc, polyline
 
 
 class Window(pyglet.window.Window):
@@ -41,6 +42,17 @@ class Window(pyglet.window.Window):
 
     mode = 1
 
+    # All the stars, drawn a point size at a time
+    stars = None
+
+    # Moon and horizon are built once into vertex arrays
+    geometry = GeometryCache()
+    horizon = (
+        (0.0, 25.0), (50.0, 100.0), (100.0, 25.0), (225.0, 125.0),
+        (300.0, 50.0), (375.0, 100.0), (460.0, 25.0), (525.0, 100.0),
+        (600.0, 20.0), (675.0, 70.0), (750.0, 25.0), (800.0, 90.0),
+    )
+
     def __init__(self, title='Pyglet App'):
         super(Window, self).__init__(self.SCREEN_X, self.SCREEN_Y, title)
 
@@ -64,6 +76,12 @@ class Window(pyglet.window.Window):
             s.x = rand() * self.SCREEN_X * 10 / 10.0
             s.y = rand() * (self.SCREEN_Y - 100) * 10.0 / 10.0 + 100.0
             self.vLargeStars[i] = s
+
+        self.stars = ParticleSystem(dims=2, capacity=self.SMALL_STARS +
+            self.MEDIUM_STARS + self.LARGE_STARS)
+        self.stars.emit([list(s) for s in self.vSmallStars], sizes=1.0)
+        self.stars.emit([list(s) for s in self.vMediumStars], sizes=3.05)
+        self.stars.emit([list(s) for s in self.vLargeStars], sizes=5.5)
                 
                 
         # Black background
@@ -78,58 +96,19 @@ class Window(pyglet.window.Window):
         x = 700.0     # Location and radius of moon
         y = 500.0
         r = 50.0
-        angle = 0.0   # Another looping variable
              
         # Everything is white
         glColor3f(1.0, 1.0, 1.0)
         
-        # Draw small stars
-        glPointSize(1.0)
-        glBegin(GL_POINTS)
-        for i in range(self.SMALL_STARS):
-            glVertex2f(*self.vSmallStars[i])
-        glEnd()
-            
-        # Draw medium sized stars
-        glPointSize(3.05)
-        glBegin(GL_POINTS)
-        for i in range(self.MEDIUM_STARS):
-            glVertex2f(*self.vMediumStars[i])
-        glEnd()
-        
-        # Draw largest stars
-        glPointSize(5.5)
-        glBegin(GL_POINTS)
-        for i in range(self.LARGE_STARS):
-            glVertex2f(*self.vLargeStars[i])
-        glEnd()
+        # Draw small, medium and large stars
+        self.stars.draw()
         
-        # Draw the "moon"
-        glBegin(GL_TRIANGLE_FAN)
-        glVertex2f(x, y)
-        angle = 0.0
-        while angle < 2.0 * 3.141592:
-            glVertex2f(x+cos(angle)*r, y+sin(angle)*r)
-            glVertex2f(x+r, y)
-            angle += 0.1
-        glEnd()
+        # Draw the "moon", a fan stepping 0.1 radians around the rim
+        self.geometry.get('moon', disc, x, y, r, 63).draw()
 
         # Draw distant horizon
         glLineWidth(3.5)
-        glBegin(GL_LINE_STRIP)
-        glVertex2f(0.0, 25.0)
-        glVertex2f(50.0, 100.0)
-        glVertex2f(100.0, 25.0)
-        glVertex2f(225.0, 125.0)
-        glVertex2f(300.0, 50.0)
-        glVertex2f(375.0, 100.0)
-        glVertex2f(460.0, 25.0)
-        glVertex2f(525.0, 100.0)
-        glVertex2f(600.0, 20.0)
-        glVertex2f(675.0, 70.0)
-        glVertex2f(750.0, 25.0)
-        glVertex2f(800.0, 90.0)    
-        glEnd()
+        self.geometry.get('horizon', polyline, self.horizon).draw()
 
     def _update_mode(self):
         if self.mode == 0:
@@ -23,6 +23,7 @@ sys.path.append('../../lib')
 from gltools import *
 from math3d import *
 from glframe import GLFrame
+from ground import Ground
 
 
 def gl_vec(typ, *args):
@@ -56,6 +57,8 @@ class Window(pyglet.window.Window):
 
     # GL frame objects
     NUM_SPHERES = 50
+    # Reused for every sphere's actor transform
+    mActor = M3DMatrix44f()
     spheres = [None] * NUM_SPHERES
     frameCamera = GLFrame()
 
@@ -147,7 +150,8 @@ class Window(pyglet.window.Window):
         self._make_display_list('small sphere', self._draw_small_sphere)
         self._make_display_list('big sphere', self._draw_big_sphere)
         self._make_display_list('torus', self._draw_torus)
-        self._make_display_list('ground', self._draw_ground)
+        self.ground = Ground(20.0, 1.0, y=-0.4)
+        self.ground.upload()
 
         pyglet.clock.schedule_interval(self._update, 1.0/60.0)
         pyglet.clock.schedule_interval(self.fps, 2.0)
@@ -180,8 +184,7 @@ class Window(pyglet.window.Window):
         
         # Draw the ground
         glColor3f(0.60, .40, .10)
-#        self._draw_ground()
-        self._call_display_list('ground')
+        self.ground.draw()
         
         # Draw shadows first
         glDisable(GL_DEPTH_TEST)
@@ -214,7 +217,7 @@ class Window(pyglet.window.Window):
 
         for i in range(self.NUM_SPHERES):
             glPushMatrix()
-            self.spheres[i].ApplyActorTransform()
+            self.spheres[i].ApplyActorTransform(out=self.mActor)
 #            glutSolidSphere(0.3, 21, 11)
             self._call_display_list('big sphere')
             glPopMatrix()
@@ -252,24 +255,6 @@ class Window(pyglet.window.Window):
     def _draw_torus(self):
         gltDrawTorus(0.35, 0.15, 61, 37)
 
-    def _draw_ground(self):
-        # Draw the ground as a series of triangle strips
-        fExtent = 20.0
-        fStep = 1.0
-        y = -0.4
-        
-        iStrip = -fExtent
-        while iStrip <= fExtent:
-            glBegin(GL_TRIANGLE_STRIP)
-            glNormal3f(0.0, 1.0, 0.0)   # All Point up
-            iRun = fExtent
-            while iRun >= -fExtent:
-                glVertex3f(iStrip, y, iRun)
-                glVertex3f(iStrip + fStep, y, iRun)
-                iRun -= fStep
-            glEnd()
-            iStrip += fStep
-
     def _update(self, dt):
         self.yRot = (self.yRot + 2.0) % 360.0
         if self.forward != 0.0:
@@ -331,6 +316,7 @@ class Window(pyglet.window.Window):
     
     def on_close(self):
         pyglet.clock.unschedule(self._update)
+        self.ground.delete()
         pyglet.clock.unschedule(self.fps)
         super(Window, self).on_close()
 
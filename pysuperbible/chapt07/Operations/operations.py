@@ -5,9 +5,9 @@
 // Program by Richard S. Wright Jr.
 ## Pythonated for Pyglet by Gummbum
 ## Added display lists for glDrawPixels(), as it is a very expensive operation
-## Gumm note: Yeah, there's a lotta freaky voodoo in here.
-## The inverted image doesn't save any pixels for some mysterious reason. All
-## the other modes can be saved.
+## The image operations run on the CPU with the imaging module rather than
+## through glPixelTransfer/glPixelMap and a glReadPixels round trip, so every
+## mode is a single glDrawPixels of a ready-made buffer.
 """
 
 
@@ -25,6 +25,9 @@ from gltools import *
 from math3d import *
 from glframe import GLFrame
 from simple_menu import SimpleMenu
+from capture import FrameCapture
+import imaging
+import tga
 
 
 def gl_vec(typ, *args):
@@ -56,15 +59,10 @@ def gl_vec(typ, *args):
 
 class Window(pyglet.window.Window):
 
-    # source image data
-    image = None
+    # source image data, as a (height, width, 3) BGR numpy array
     pImage = None
-    pModifiedBytes = None
     iWidth = 0
     iHeight = 0
-    iComponents = 0
-    eFormat = 0
-    data = None
 
     # desired drawing mode
     menu = None
@@ -82,13 +80,21 @@ class Window(pyglet.window.Window):
     ]
     iRenderMode = 1
 
-    # GL display lists
+    # GL display lists stored by name
     dlists = {}
 
+    # Screenshots are read back and encoded off the GL thread
+    capture = None
+
     def __init__(self, w, h, title='Pyglet App'):
         super(Window, self).__init__(w, h, title)
 
-        self.image = pyglet.image.load('horse.tga')
+        image = tga.load('horse.tga')
+        self.pImage = image.as_array().copy()
+        image.close()
+        self.iHeight, self.iWidth = self.pImage.shape[:2]
+
+        self.capture = FrameCapture()
 
         pyglet.clock.schedule_interval(self._update, 1.0/60.0)
 
@@ -105,119 +111,60 @@ class Window(pyglet.window.Window):
     def on_draw(self):
         self.clear()
 
-#        iViewport = [0] * 4
-        pModifiedBytes = None
-        invertMap = [0] * 256
-        
-        iRenderMode = self.iRenderMode
-        iWidth,iHeight,eFormat,pImage = self.iWidth, self.iHeight, self.eFormat, self.pImage
-        
         # Current Raster Position always at bottom left hand corner of window
-        glRasterPos2i(0, 0);
-            
-        # Do image operation, depending on rendermode index
-        if iRenderMode == 2:     # Flip the pixels
-            glPixelZoom(-1.0, -1.0)
-            glRasterPos2i(iWidth, iHeight)
-        elif iRenderMode == 3:     # Zoom pixels to fill window
-            iViewport = glGetIntegerv(GL_VIEWPORT)
-            glPixelZoom(float(iViewport[2])/iWidth, float(iViewport[3])/iHeight)
-        elif iRenderMode == 4:     # Just Red
-            glPixelTransferf(GL_RED_SCALE, 1.0)         
-            glPixelTransferf(GL_GREEN_SCALE, 0.0)
-            glPixelTransferf(GL_BLUE_SCALE, 0.0) 
-        elif iRenderMode == 5:     # Just Green
-            glPixelTransferf(GL_RED_SCALE, 0.0)         
-            glPixelTransferf(GL_GREEN_SCALE, 1.0)
-            glPixelTransferf(GL_BLUE_SCALE, 0.0) 
-        elif iRenderMode == 6:     # Just Blue
-            glPixelTransferf(GL_RED_SCALE, 0.0)         
-            glPixelTransferf(GL_GREEN_SCALE, 0.0)
-            glPixelTransferf(GL_BLUE_SCALE, 1.0)
-        elif iRenderMode == 7:     # Black & White, more tricky
-            if pModifiedBytes is None:
-                # First draw image into color buffer
-                self._call_display_list('color image')
-
-                # Allocate space for the luminance map
-                nBytes = iWidth * iHeight
-                pModifiedBytes = gl_vec(GLubyte, ([0]*nBytes))
-                
-                # Scale colors according to NSTC standard
-                glPixelTransferf(GL_RED_SCALE, 0.3)
-                glPixelTransferf(GL_GREEN_SCALE, 0.59)
-                glPixelTransferf(GL_BLUE_SCALE, 0.11)
-                
-                # Read pixles into buffer (scale above will be applied)
-                glReadPixels(0,0, iWidth, iHeight, GL_LUMINANCE, GL_UNSIGNED_BYTE, pModifiedBytes)
-                
-                # Return color scaling to normal
-                glPixelTransferf(GL_RED_SCALE, 1.0)
-                glPixelTransferf(GL_GREEN_SCALE, 1.0)
-                glPixelTransferf(GL_BLUE_SCALE, 1.0)
-                
-                self.pModifiedBytes = pModifiedBytes
-                self._make_display_list('bw image', self._make_bw_image)
-        elif iRenderMode ==  8:     # Invert colors
-            invertMap[0] = 1.0
-            for i in range(256):
-                invertMap[i] = 1.0 - (1.0 / 255.0 * i)
-                
-            glPixelMapfv(GL_PIXEL_MAP_R_TO_R, 255, invertMap)
-            glPixelMapfv(GL_PIXEL_MAP_G_TO_G, 255, invertMap)
-            glPixelMapfv(GL_PIXEL_MAP_B_TO_B, 255, invertMap)
-            glPixelTransferi(GL_MAP_COLOR, GL_TRUE)
+        glRasterPos2i(0, 0)
 
-        if False:
-            # Let pyglet render (a manual hack for debugging)
-            self.image.blit(0, 0)
+        # Each render mode is processed once on the CPU and kept in a display
+        # list. Zoom depends on the window size, so it gets a list per size.
+        iRenderMode = self.iRenderMode
+        if iRenderMode == 3:
+            name = (iRenderMode, self.width, self.height)
         else:
-            # Do the pixel draw
-            if pModifiedBytes is None:
-                if self.pImage is None:
-                    self._make_display_list('color image', self._make_color_image)
-                else:
-                    self._call_display_list('color image')
-            else:
-                self._call_display_list('bw image')
-
-        # Reset everyting to default
-        glPixelTransferi(GL_MAP_COLOR, GL_FALSE)
-        glPixelTransferf(GL_RED_SCALE, 1.0)
-        glPixelTransferf(GL_GREEN_SCALE, 1.0)
-        glPixelTransferf(GL_BLUE_SCALE, 1.0)
-        glPixelZoom(1.0, 1.0)   # No Pixel Zooming
+            name = iRenderMode
+        if name not in self.dlists:
+            pixels, eFormat = self._process_image(iRenderMode)
+            def draw():
+                h, w = pixels.shape[:2]
+                glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+                glDrawPixels(w, h, eFormat, GL_UNSIGNED_BYTE, pixels)
+            self._make_display_list(name, draw)
+        self._call_display_list(name)
+
+        # Capture before the menu goes on top
+        self.capture.frame(self.width, self.height)
 
         # If the menu exists, draw it.
         if self.menu is not None:
             self.menu.draw()
 
-    def _make_color_image(self):
-        # Details needed by GL
-        self.iWidth = self.image.width
-        self.iHeight = self.image.height
-        self.eFormat = self.image._get_gl_format_and_type(self.image.format)[0]
-        # And the data needed by GL
-        raw_image = self.image.get_image_data()
-        pixels = raw_image.get_data(raw_image.format, raw_image.pitch)
-        self.pImage = gl_vec(GLubyte, pixels)
-        # Render the image
-        iWidth,iHeight,eFormat,pImage = self.iWidth, self.iHeight, self.eFormat, self.pImage
-        glDrawPixels(iWidth, iHeight, eFormat, GL_UNSIGNED_BYTE, pImage)
-    
-    def _make_bw_image(self):
-        iWidth,iHeight,pModifiedBytes = self.iWidth, self.iHeight, self.pModifiedBytes
-        glDrawPixels(iWidth, iHeight, GL_LUMINANCE, GL_UNSIGNED_BYTE, pModifiedBytes)
+    def _process_image(self, iRenderMode):
+        """return (pixels, GL format) for iRenderMode"""
+        pImage = self.pImage
+        r, g, b = imaging.BGR_ORDER
+        # Do image operation, depending on rendermode index
+        if iRenderMode == 2:     # Flip the pixels
+            return imaging.flip(pImage), GL_BGR
+        elif iRenderMode == 3:     # Zoom pixels to fill window
+            return imaging.zoom(pImage, self.width, self.height), GL_BGR
+        elif iRenderMode == 4:     # Just Red
+            return imaging.isolate_channel(pImage, r), GL_BGR
+        elif iRenderMode == 5:     # Just Green
+            return imaging.isolate_channel(pImage, g), GL_BGR
+        elif iRenderMode == 6:     # Just Blue
+            return imaging.isolate_channel(pImage, b), GL_BGR
+        elif iRenderMode == 7:     # Black & White, scaled by NTSC standard
+            return imaging.luminance(pImage, imaging.BGR_ORDER), GL_LUMINANCE
+        elif iRenderMode ==  8:     # Invert colors
+            return imaging.invert(pImage), GL_BGR
+        return pImage, GL_BGR
 
-    
     def _update(self, dt):
         if self.menu_option is None:
             return
         
         if self.menu_option == 0 and self.menu is None:
              # Save image, but wait until menu is destroyed
-            self.on_draw()
-            pyglet.image.get_buffer_manager().get_color_buffer().save('Screenshot.png')
+            self.capture.screenshot('Screenshot.png')
             self.menu_option = None
         else:
             # Change render mode index to match menu entry index
@@ -230,6 +177,10 @@ class Window(pyglet.window.Window):
         if h == 0:
             h = 1
 
+        # The zoomed image has to be redone for the new size
+        for name in [n for n in self.dlists if isinstance(n, tuple)]:
+            glDeleteLists(self.dlists.pop(name), 1)
+
         glViewport(0, 0, w, h)
             
         # Reset the coordinate system before modifying
@@ -257,6 +208,7 @@ class Window(pyglet.window.Window):
 
     def on_close(self):
         pyglet.clock.unschedule(self._update)
+        self.capture.close()
         super(Window, self).on_close()
 
 
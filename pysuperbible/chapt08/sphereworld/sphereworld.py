@@ -24,6 +24,8 @@ sys.path.append('../../lib')
 from gltools import *
 from math3d import *
 from glframe import GLFrame
+import texcache
+from atlas import TextureAtlas
 
 
 def gl_vec(typ, *args):
@@ -56,6 +58,8 @@ def gl_vec(typ, *args):
 class Window(pyglet.window.Window):
 
     NUM_SPHERES = 30
+    # Reused for every sphere's actor transform
+    mActor = M3DMatrix44f()
     spheres = [None] * NUM_SPHERES
     frameCamera = GLFrame()
 
@@ -73,8 +77,11 @@ class Window(pyglet.window.Window):
     TORUS_TEXTURE  = 1
     SPHERE_TEXTURE = 2
     NUM_TEXTURES   = 3
-    images = []
     textureObjects = []
+    # Torus and spheres share one atlas texture; the ground tiles its grass
+    # with GL_REPEAT, so it keeps a texture of its own.
+    atlasTexture = None
+    regions = {}
 
     # Movement
     forward = 0.0
@@ -143,11 +150,13 @@ class Window(pyglet.window.Window):
       
         # Set up texture maps
         glEnable(GL_TEXTURE_2D)
-        for name in self.szTextureFiles:
-            image = pyglet.image.load(name)
-            texid = image.get_mipmapped_texture().id
-            self.images.append(image)
-            self.textureObjects.append(texid)
+        texid = texcache.load_mipmapped_texture(self.szTextureFiles[self.GROUND_TEXTURE])
+        self.textureObjects.append(texid)
+        atlas = TextureAtlas()
+        for which in (self.TORUS_TEXTURE, self.SPHERE_TEXTURE):
+            atlas.add_file(self.szTextureFiles[which], which)
+        self.atlasTexture = atlas.upload()
+        self.regions = atlas.regions
 
         # Set up display lists for faster rendering
         self._make_display_list('ground', self._draw_ground)
@@ -216,11 +225,12 @@ class Window(pyglet.window.Window):
             glColor4f(1.0, 1.0, 1.0, 1.0)
         else:
             glColor4f(0.0, 0.0, 0.0, 0.6);  # Shadow color
+        glBindTexture(GL_TEXTURE_2D, self.atlasTexture)
       
         # Draw the randomly located spheres
         for i in range(self.NUM_SPHERES):
             glPushMatrix()
-            self.spheres[i].ApplyActorTransform()
+            self.spheres[i].ApplyActorTransform(out=self.mActor)
             #self._draw_big_sphere()
             self._call_display_list('big sphere')
             glPopMatrix()
@@ -273,18 +283,15 @@ class Window(pyglet.window.Window):
 
     def _draw_torus(self):
         """draw torus; this should go in a display list"""
-        glBindTexture(GL_TEXTURE_2D, self.textureObjects[self.TORUS_TEXTURE])
-        gltDrawTorus(0.35, 0.15, 61, 37)
+        gltDrawTorus(0.35, 0.15, 61, 37, self.regions[self.TORUS_TEXTURE])
     
     def _draw_small_sphere(self):
         """draw small sphere; this should go in a display list"""
-        glBindTexture(GL_TEXTURE_2D, self.textureObjects[self.SPHERE_TEXTURE])
-        gltDrawSphere(0.1, 21, 11)
+        gltDrawSphere(0.1, 21, 11, self.regions[self.SPHERE_TEXTURE])
 
     def _draw_big_sphere(self):
         """draw big sphere; this should go in a display list"""
-        glBindTexture(GL_TEXTURE_2D, self.textureObjects[self.SPHERE_TEXTURE])
-        gltDrawSphere(0.3, 21, 11)
+        gltDrawSphere(0.3, 21, 11, self.regions[self.SPHERE_TEXTURE])
 
     def _update(self, dt):
         self.yRot = (self.yRot + 1.0) % 360.0
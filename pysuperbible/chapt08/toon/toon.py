@@ -20,6 +20,9 @@ sys.path.append('../../lib')
 from gltools import *
 from math3d import *
 from glframe import GLFrame
+from mesh import torus_mesh
+from celshade import CelShadedMesh
+from matrixstack import MatrixStack
 
 
 def gl_vec(typ, *args):
@@ -58,6 +61,9 @@ class Window(pyglet.window.Window):
     vLightDir = [-1.0, 1.0, 1.0]
 
     def __init__(self, w, h, title='Pyglet App'):
+        # Both matrices are kept on the CPU; the light needs the modelview
+        self.modelview = MatrixStack()
+        self.projection = MatrixStack(GL_PROJECTION, 2)
         super(Window, self).__init__(w, h, title)
 
         # Load a 1D texture with toon shaded values
@@ -83,79 +89,29 @@ class Window(pyglet.window.Window):
         
         glEnable(GL_TEXTURE_1D)
 
+        self.torus = CelShadedMesh(torus_mesh(0.35, 0.15, 50, 25))
+
         pyglet.clock.schedule_interval(self._update, 1.0/60.0)
 
     def on_draw(self):
         self.clear()
 
-        glPushMatrix()
-        glTranslatef(0.0, 0.0, -2.5)
-        glRotatef(self.yRot, 0.0, 1.0, 0.0)
-        self.toonDrawTorus(0.35, 0.15, 50, 25, self.vLightDir)
-        glPopMatrix()
+        with self.modelview:
+            self.modelview.translate(0.0, 0.0, -2.5)
+            self.modelview.rotate(self.yRot, 0.0, 1.0, 0.0)
+            self.modelview.flush()
+            self.toonDrawTorus(self.vLightDir)
         
         # Rotate 1/2 degree more each frame
         self.yRot = (self.yRot + 0.5) % 360.0
 
-    def toonDrawTorus(self, majorRadius, minorRadius,  numMajor, numMinor, vLightDir):
-        # Draw a torus (doughnut), using the current 1D texture for light shading
-        mInvertedLight = M3DMatrix44f()
-        vNewLight = M3DVector3f()
-        vNormal = M3DVector3f()
-        majorStep = 2.0*M3D_PI / numMajor
-        minorStep = 2.0*M3D_PI / numMinor
-
-        # Get the modelview matrix
-        mModelViewMatrix = glGetFloatv(GL_MODELVIEW_MATRIX)
-    
-        # Instead of transforming every normal and then dotting it with
-        # the light vector, we will transform the light into object 
-        # space by multiplying it by the inverse of the modelview matrix
-## IMPASSE: m3dInvertMatrix44 using array pointer math. Too complicated
-## to want to pursue right now. Anyway, possibly a job for numpy.
-        m3dInvertMatrix44(mInvertedLight, mModelViewMatrix)
-        m3dTransformVector3(vNewLight, vLightDir, mInvertedLight)
-        vNewLight[0] -= mInvertedLight[12]
-        vNewLight[1] -= mInvertedLight[13]
-        vNewLight[2] -= mInvertedLight[14]
-        m3dNormalizeVector(vNewLight)
-    
-        # Draw torus as a series of triangle strips
-        for i in range(numMajor):
-            a0 = i * majorStep
-            a1 = a0 + majorStep
-            x0 = cos(a0)
-            y0 = sin(a0)
-            x1 = cos(a1)
-            y1 = sin(a1)
-
-            glBegin(GL_TRIANGLE_STRIP)
-            for j in range(numMinor+1):
-                b = j * minorStep
-                c = cos(b)
-                r = minorRadius * c + majorRadius
-                z = minorRadius * sin(b)
-
-                # First point
-                vNormal[0] = x0*c
-                vNormal[1] = y0*c
-                vNormal[2] = z/minorRadius
-                m3dNormalizeVector(vNormal)
-                
-                # Texture coordinate is set by intensity of light
-                glTexCoord1f(m3dDotProduct(vNewLight, vNormal))
-                glVertex3f(x0*r, y0*r, z)
-
-                # Second point
-                vNormal[0] = x1*c
-                vNormal[1] = y1*c
-                vNormal[2] = z/minorRadius
-                m3dNormalizeVector(vNormal)
-                
-                # Texture coordinate is set by intensity of light
-                glTexCoord1f(m3dDotProduct(vNewLight, vNormal))
-                glVertex3f(x1*r, y1*r, z)
-            glEnd()
+    def toonDrawTorus(self, vLightDir):
+        # Draw the torus, using the current 1D texture for light shading.
+        # The light goes into object space through the inverse of the
+        # modelview matrix, and every texture coordinate comes from one
+        # product with the normal array.
+        self.torus.update(self.modelview.matrix, vLightDir)
+        self.torus.draw()
 
     def _update(self, dt):
         pass
@@ -168,23 +124,24 @@ class Window(pyglet.window.Window):
 
         glViewport(0, 0, w, h)
             
-        fAspect = w / h
+        fAspect = float(w) / h
 
         # Reset the coordinate system before modifying
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
+        self.projection.load_identity()
         
         # Set the clipping volume
-        gluPerspective(35.0, fAspect, 1.0, 50.0)
+        self.projection.perspective(35.0, fAspect, 1.0, 50.0)
+        self.projection.flush()
             
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        self.modelview.load_identity()
+        self.modelview.flush()
     
     def on_key_press(self, sym, mods):
         super(Window, self).on_key_press(sym, mods)
     
     def on_close(self):
         pyglet.clock.unschedule(self._update)
+        self.torus.delete()
         super(Window, self).on_close()
 
 
@@ -21,6 +21,7 @@ from gltools import *
 from math3d import *
 from glframe import GLFrame
 from simple_menu import SimpleMenu
+import texcache
 
 
 def gl_vec(typ, *args):
@@ -57,7 +58,7 @@ class Window(pyglet.window.Window):
     TEXTURE_FLOOR   = 1
     TEXTURE_CEILING = 2
     szTextureFiles = ('brick.tga', 'floor.tga', 'ceiling.tga')
-    images = []
+    textureObjects = []
 
     # Menu
     menu = None
@@ -86,13 +87,14 @@ class Window(pyglet.window.Window):
 
         # Textures applied as decals, no lighting or coloring effects
         glEnable(GL_TEXTURE_2D)
+        # Mip chains come prebuilt from the texture cache
         for name in self.szTextureFiles:
-            self.images.append(pyglet.image.load(name))
+            self.textureObjects.append(texcache.load_mipmapped_texture(name))
 
         pyglet.clock.schedule_interval(self._update, 1.0/60.0)
 
     def get_texture(self, which):
-        return self.images[which].get_mipmapped_texture().id
+        return self.textureObjects[which]
 
     def on_draw(self):
         self.clear()
@@ -193,7 +195,7 @@ class Window(pyglet.window.Window):
     
     def _handle_menu(self):
         print 'menu option',self.menu_items[self.menu_option]
-        for tex in [im.get_mipmapped_texture().id for im in self.images]:
+        for tex in self.textureObjects:
             glBindTexture(GL_TEXTURE_2D, tex)
             if self.menu_option == 0:
                 glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
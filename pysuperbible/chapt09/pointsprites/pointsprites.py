@@ -22,6 +22,9 @@ from gltools import *
 from math3d import *
 from glframe import GLFrame
 from simple_menu import SimpleMenu
+import texcache
+from particles import ParticleSystem
+from geometry2d import GeometryCache, polyline
 
 
 def gl_vec(typ, *args):
@@ -62,13 +65,22 @@ class Window(pyglet.window.Window):
     vSmallStars = []
     vMediumStars = []
     vLargeStars = []
+    # All the stars, drawn a point size at a time
+    stars = None
+
+    # Horizon is built once into a vertex array
+    geometry = GeometryCache()
+    horizon = (
+        (0.0, 25.0), (50.0, 100.0), (100.0, 25.0), (225.0, 115.0),
+        (300.0, 50.0), (375.0, 100.0), (460.0, 25.0), (525.0, 100.0),
+        (600.0, 20.0), (675.0, 70.0), (750.0, 25.0), (800.0, 90.0),
+    )
 
     # Normal points
     drawMode = 2
 
     # Texture Objects
     image_files = ('star.tga','moon.tga')
-    images = []
     textureObjects = []
 
     # Menu is posted when menu is not None
@@ -101,18 +113,22 @@ class Window(pyglet.window.Window):
         # Populate star list
         for i in range(self.LARGE_STARS):
             self.vLargeStars.append((rand()*w*10/10.0, rand()*(h-100)*10.0/10.0+100.0))
+
+        self.stars = ParticleSystem(dims=2, capacity=self.SMALL_STARS +
+            self.MEDIUM_STARS + self.LARGE_STARS)
+        self.stars.emit(self.vSmallStars, sizes=7.0)       # 1.0
+        self.stars.emit(self.vMediumStars, sizes=12.0)     # 3.0
+        self.stars.emit(self.vLargeStars, sizes=20.0)      # 5.5
                 
         # Set drawing color to white
         glColor3f(0.0, 0.0, 0.0)
 
         # Load texture objects and texture maps
         for name in self.image_files:
-            image = pyglet.image.load(name)
-            texid = image.get_mipmapped_texture().id
+            texid = texcache.load_mipmapped_texture(name)
             glBindTexture(GL_TEXTURE_2D, texid)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
-            self.images.append(image)
             self.textureObjects.append(texid)
         
         glTexEnvi(GL_POINT_SPRITE, GL_COORD_REPLACE, GL_TRUE)
@@ -126,7 +142,6 @@ class Window(pyglet.window.Window):
         x = 700.0     # Location and radius of moon
         y = 500.0
         r = 50.0
-        angle = 0.0   # Another looping variable
                     
         # Everything is white
         glColor3f(1.0, 1.0, 1.0)
@@ -137,26 +152,8 @@ class Window(pyglet.window.Window):
             glBindTexture(GL_TEXTURE_2D, self.textureObjects[0])
             glEnable(GL_BLEND)
 
-        # Draw small stars
-        glPointSize(7.0)          # 1.0
-        glBegin(GL_POINTS)
-        for i in range(self.SMALL_STARS):
-            glVertex2fv(self.vSmallStars[i])
-        glEnd()
-            
-        # Draw medium sized stars
-        glPointSize(12.0)         # 3.0
-        glBegin(GL_POINTS)
-        for i in range(self.MEDIUM_STARS):
-            glVertex2fv(self.vMediumStars[i])
-        glEnd()
-            
-        # Draw largest stars
-        glPointSize(20.0)      # 5.5
-        glBegin(GL_POINTS)
-        for i in range(self.LARGE_STARS):
-            glVertex2fv(self.vLargeStars[i])
-        glEnd()
+        # Draw small, medium and large stars
+        self.stars.draw()
             
         glPointSize(120.0)
         if self.drawMode == 2:
@@ -172,20 +169,7 @@ class Window(pyglet.window.Window):
 
         # Draw distant horizon
         glLineWidth(3.5)
-        glBegin(GL_LINE_STRIP)
-        glVertex2f(0.0, 25.0)
-        glVertex2f(50.0, 100.0)
-        glVertex2f(100.0, 25.0)
-        glVertex2f(225.0, 115.0)
-        glVertex2f(300.0, 50.0)
-        glVertex2f(375.0, 100.0)
-        glVertex2f(460.0, 25.0)
-        glVertex2f(525.0, 100.0)
-        glVertex2f(600.0, 20.0)
-        glVertex2f(675.0, 70.0)
-        glVertex2f(750.0, 25.0)
-        glVertex2f(800.0, 90.0)    
-        glEnd()
+        self.geometry.get('horizon', polyline, self.horizon).draw()
 
         # Menu is drawn after all world rendering.
         if self.menu is not None:
@@ -0,0 +1,280 @@
+"""
+Per-frame allocation profiling.
+
+To find out which temporaries a frame creates and what garbage collection
+costs, an AllocationProfiler counts, frame by frame, every construction of
+the math3d vector and matrix classes and every call of gl_vec (the demos'
+ctypes array constructor), by type and by the line that made them, and
+times every garbage collection:
+
+    profiler = AllocationProfiler()
+    profiler.start()
+    ...
+    def on_draw(self):
+        ...
+        profiler.end_frame()
+    ...
+    profiler.stop()
+    profiler.report()
+
+skel.Window does this when its profile_allocations class attribute is set.
+
+Python 2 has neither tracemalloc nor gc callbacks, so the counting is done
+with a sys.setprofile hook that watches for the constructors' code objects,
+and the collector is switched to manual while profiling: at the end of each
+frame the profiler runs the collection CPython would have run during it,
+and times it. Collections therefore happen between frames rather than
+inside them. The hook slows everything down considerably; compare counts
+between runs, not frame times. Only the thread that called start is
+profiled, and ctypes arrays made without gl_vec are not seen.
+"""
+
+
+import collections
+import gc
+import os
+import sys
+import time
+
+import math3d
+
+
+class FrameAllocations(object):
+    """What one frame allocated and collected.
+
+    sites -> {(type name, file, line, function): count}
+    gc_pauses -> [(generation, seconds)] of each collection
+    pool_hits, pool_misses -> math3d.m3dPool activity
+    """
+
+    __slots__ = ('sites', 'gc_pauses', 'pool_hits', 'pool_misses')
+
+    def __init__(self):
+        self.sites = {}
+        self.gc_pauses = []
+        self.pool_hits = 0
+        self.pool_misses = 0
+
+    @property
+    def total(self):
+        return sum(self.sites.itervalues())
+
+    @property
+    def by_type(self):
+        """{type name: count}"""
+        types = {}
+        for site, n in self.sites.iteritems():
+            types[site[0]] = types.get(site[0], 0) + n
+        return types
+
+    @property
+    def gc_time(self):
+        return sum(seconds for generation, seconds in self.gc_pauses)
+
+
+class AllocationProfiler(object):
+    """Counts allocations and garbage collection pauses per frame.
+
+    types -> classes whose construction is counted, in addition to the
+        math3d vectors and matrices
+    functions -> names of functions each call of which counts as one
+        allocation of that name
+    history -> number of most recent frames kept for the report
+    """
+
+    def __init__(self, types=(), functions=('gl_vec',), history=600):
+        self.functions = frozenset(functions)
+        self.frames = collections.deque(maxlen=history)
+        self.current = FrameAllocations()
+        self.running = False
+        self._gc_was_enabled = False
+
+        # Code object -> name of what it allocates. Constructors are looked
+        # up by their __init__, trusted() by its cls argument.
+        classes = list(math3d._M3DVector.__subclasses__()) + list(types)
+        self._codes = {}
+        for cls in classes:
+            init = cls.__dict__.get('__init__')
+            if init is not None:
+                self._codes[init.func_code] = cls.__name__
+        self._trusted = math3d._M3DVector.__dict__['trusted'].__func__.func_code
+        self._codes[self._trusted] = None
+        # Frames attributed to their caller instead of themselves: the
+        # pool, and vector operators returning new vectors
+        skip = [math3d.M3DPool.acquire.im_func.func_code,
+                math3d._M3DPoolScope.__enter__.im_func.func_code]
+        for value in math3d._M3DVector.__dict__.itervalues():
+            if hasattr(value, 'func_code'):
+                skip.append(value.func_code)
+        self._skip = frozenset(skip)
+
+    def start(self):
+        """start counting in the calling thread, with the collector under
+        the profiler's control"""
+        if self.running:
+            return
+        self.running = True
+        self._gc_was_enabled = gc.isenabled()
+        gc.disable()
+        self.current = FrameAllocations()
+        self._pool = (math3d.m3dPool.hits, math3d.m3dPool.misses)
+        sys.setprofile(self._profile)
+
+    def stop(self):
+        """stop counting and give the collector back"""
+        if not self.running:
+            return
+        sys.setprofile(None)
+        self.running = False
+        if self._gc_was_enabled:
+            gc.enable()
+
+    def _profile(self, frame, event, arg):
+        if event != 'call':
+            return
+        code = frame.f_code
+        name = self._codes.get(code, False)
+        if name is False:
+            if code.co_name not in self.functions:
+                return
+            name = self._codes[code] = code.co_name
+        elif name is None:
+            name = frame.f_locals['cls'].__name__
+        caller = frame.f_back
+        while caller is not None and caller.f_code in self._skip:
+            caller = caller.f_back
+        if caller is None:
+            site = (name, '?', 0, '?')
+        else:
+            site = (name, os.path.basename(caller.f_code.co_filename),
+                    caller.f_lineno, caller.f_code.co_name)
+        sites = self.current.sites
+        sites[site] = sites.get(site, 0) + 1
+
+    def _collect(self):
+        """run the collection CPython would run now, timed"""
+        counts = gc.get_count()
+        thresholds = gc.get_threshold()
+        generation = -1
+        for g in range(3):
+            if thresholds[g] and counts[g] > thresholds[g]:
+                generation = g
+        if generation < 0:
+            return
+        start = time.time()
+        gc.collect(generation)
+        self.current.gc_pauses.append((generation, time.time() - start))
+
+    def end_frame(self):
+        """close the current frame's counts and start the next"""
+        if not self.running:
+            return
+        sys.setprofile(None)
+        self._collect()
+        pool = math3d.m3dPool
+        self.current.pool_hits = pool.hits - self._pool[0]
+        self.current.pool_misses = pool.misses - self._pool[1]
+        self._pool = (pool.hits, pool.misses)
+        self.frames.append(self.current)
+        self.current = FrameAllocations()
+        sys.setprofile(self._profile)
+
+    def offenders(self, n=10):
+        """return the n call sites allocating most over the recorded frames,
+        as [(count, (type name, file, line, function))]"""
+        sites = {}
+        for frame in self.frames:
+            for site, count in frame.sites.iteritems():
+                sites[site] = sites.get(site, 0) + count
+        return sorted(((count, site) for site, count in sites.iteritems()),
+                      reverse=True)[:n]
+
+    def report(self, out=None, n=10):
+        """print a summary of the recorded frames"""
+        out = out or sys.stdout
+        frames = list(self.frames)
+        if not frames:
+            print >> out, 'no frames recorded'
+            return
+        count = float(len(frames))
+        print >> out, 'allocations over %d frames: %.1f per frame' % (
+            len(frames), sum(f.total for f in frames) / count)
+
+        types = {}
+        for frame in frames:
+            for name, k in frame.by_type.iteritems():
+                types[name] = types.get(name, 0) + k
+        for name, k in sorted(types.iteritems(), key=lambda t: -t[1]):
+            print >> out, '  %10.1f  %s' % (k / count, name)
+
+        print >> out, 'top call sites, per frame:'
+        for k, (name, filename, line, function) in self.offenders(n):
+            print >> out, '  %10.1f  %s  %s:%d in %s' % (
+                k / count, name, filename, line, function)
+
+        pauses = [seconds for f in frames for generation, seconds in f.gc_pauses]
+        if pauses:
+            print >> out, 'gc: %d collections, %.2f ms mean, %.2f ms max' % (
+                len(pauses), 1000.0 * sum(pauses) / len(pauses), 1000.0 * max(pauses))
+        else:
+            print >> out, 'gc: no collections'
+        worst = max(frames, key=lambda f: f.total)
+        print >> out, 'worst frame: %d allocations, %.2f ms in gc' % (
+            worst.total, 1000.0 * worst.gc_time)
+        hits = sum(f.pool_hits for f in frames)
+        misses = sum(f.pool_misses for f in frames)
+        if hits or misses:
+            print >> out, 'm3dPool: %.1f%% hits%s' % (100.0 * hits / (hits + misses),
+                '' if math3d.m3dPool.enabled else ' (disabled)')
+
+
+if __name__ == '__main__':
+    import ctypes
+    from glframe import GLFrame
+
+    def gl_vec(typ, *args):
+        return (typ * len(args))(*args)
+
+    print 'allocations are counted per frame by type and call site'
+    f = GLFrame()
+    profiler = AllocationProfiler()
+    profiler.start()
+    for i in range(3):
+        f.RotateLocalY(0.1)
+        v = math3d.M3DVector3f(1, 2, 3)
+        w = v + v
+        gl_vec(ctypes.c_float, 1.0, 2.0)
+        profiler.end_frame()
+    profiler.stop()
+    assert len(profiler.frames) == 3
+    frame = profiler.frames[-1]
+    assert frame.by_type == {'M3DVector3f': 3, 'M3DMatrix44f': 1, 'gl_vec': 1}, frame.by_type
+    sites = [site for count, site in profiler.offenders()]
+    assert [site[1:2] + site[3:] for site in sites if site[0] == 'M3DMatrix44f'] == \
+        [('glframe.py', 'RotateLocalY')]
+    # v + v is charged to this line, not to the operator in math3d
+    assert set(site[1:2] + site[3:] for site in sites if site[0] == 'M3DVector3f') == \
+        set([('glframe.py', 'RotateLocalY'), ('allocprof.py', '<module>')])
+
+    print 'pooled temporaries stop showing up'
+    math3d.m3dPool.enabled = True
+    profiler = AllocationProfiler()
+    profiler.start()
+    for i in range(3):
+        f.RotateLocalY(0.1)
+        profiler.end_frame()
+    profiler.stop()
+    math3d.m3dPool.enabled = False
+    assert profiler.frames[0].total == 2
+    assert profiler.frames[-1].total == 0 and profiler.frames[-1].pool_hits == 2
+
+    print 'collections are run and timed between frames'
+    profiler = AllocationProfiler()
+    profiler.start()
+    assert not gc.isenabled()
+    for i in range(2000):
+        a = []; a.append(a)
+    profiler.end_frame()
+    profiler.stop()
+    assert gc.isenabled()
+    assert profiler.frames[0].gc_pauses
@@ -0,0 +1,384 @@
+"""
+Texture atlas builder.
+
+Packs many small textures into one large texture so a scene that used to
+bind a texture per object or per face can bind once and batch its draws.
+Each packed texture gets a Region that maps its own 0..1 texture
+coordinates into the atlas; mesh generators take a region and emit remapped
+coordinates (see gltDrawTorus and gltDrawSphere in gltools), and baked
+vertex arrays can be remapped in place with Region.remap_array().
+
+An atlas made only with add_file keeps its packed mip chain in the
+texcache directory, keyed on the contents of the source files, so later runs
+upload it without decoding, packing or filtering anything.
+
+Only textures whose coordinates stay within 0..1 can share an atlas. Tiled
+textures that rely on GL_REPEAT, such as the SphereWorld grass, must keep
+their own texture object.
+"""
+
+
+import os
+
+import numpy
+from OpenGL.GL import *
+
+from math3d import m3dIsPOW2
+import tga
+import texcache
+
+
+class AtlasError(Exception):
+    def __init__(self, message):
+        self.value = message
+    def __str__(self):
+        return str(self.value)
+
+
+class Region(object):
+    """The place of one texture in an atlas.
+
+    x, y, width, height -> pixel rectangle of the texture, not counting
+        its padding
+    s0, t0, s1, t1 -> the same rectangle in atlas texture coordinates
+    """
+
+    def __init__(self, x, y, width, height, atlas_width, atlas_height):
+        self.x, self.y = x, y
+        self.width, self.height = width, height
+        # Sample from texel centers at the edges so bilinear filtering does
+        # not reach into the padding more than half a texel.
+        self.s0 = (x + 0.5) / atlas_width
+        self.t0 = (y + 0.5) / atlas_height
+        self.s1 = (x + width - 0.5) / atlas_width
+        self.t1 = (y + height - 0.5) / atlas_height
+
+    def remap(self, s, t):
+        """return the atlas coordinates of texture coordinates s, t"""
+        return (self.s0 + s * (self.s1 - self.s0),
+                self.t0 + t * (self.t1 - self.t0))
+
+    def remap_array(self, st, out=None):
+        """remap an (N,2) array of texture coordinates into the atlas
+
+        st -> numpy array whose last axis is (s, t)
+        out -> array to receive the result; may be st itself. A new array is
+            made when out is None.
+        Returns out.
+        """
+        scale = numpy.array((self.s1 - self.s0, self.t1 - self.t0), st.dtype)
+        offset = numpy.array((self.s0, self.t0), st.dtype)
+        out = numpy.multiply(st, scale, out)
+        out += offset
+        return out
+
+
+class TextureAtlas(object):
+    """Collects textures, packs them, and uploads the result.
+
+    padding -> texels of edge-replicated border around each texture, to
+        stop filtering and the smaller mip levels bleeding across regions
+    power_of_two -> round the atlas size up to powers of two
+    """
+
+    def __init__(self, padding=4, power_of_two=False):
+        self.padding = padding
+        self.power_of_two = power_of_two
+        self.regions = {}
+        self.width = self.height = 0
+        self.pixels = None
+        self.texture = None
+        self._pending = []
+        # (key, filename) of everything queued, or None once add() has been
+        # given pixels that the cache cannot key on
+        self._files = []
+
+    def add(self, key, pixels):
+        """queue a texture for packing
+
+        key -> name to look the region up by
+        pixels -> (height, width, components) uint8 numpy array in BGR or
+            BGRA order, as from tga.TGAImage.as_array()
+        """
+        if self.regions:
+            raise AtlasError('atlas is already packed')
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, numpy.newaxis]
+        self._pending.append((key, pixels))
+        self._files = None
+
+    def add_file(self, filename, key=None):
+        """queue the .tga file filename; key defaults to filename. The file
+        is read when the atlas is packed, which a cached upload skips."""
+        if self.regions:
+            raise AtlasError('atlas is already packed')
+        if key is None:
+            key = filename
+        self._pending.append((key, filename))
+        if self._files is not None:
+            self._files.append((key, filename))
+
+    def __getitem__(self, key):
+        return self.regions[key]
+
+    def pack(self):
+        """place every queued texture and build the atlas pixels
+
+        Uses shelf packing: textures are sorted by height and laid left to
+        right in rows whose height is set by their tallest member.
+        """
+        if not self._pending:
+            raise AtlasError('nothing to pack')
+        self._pending = [(key, _load(p) if isinstance(p, basestring) else p)
+                         for key, p in self._pending]
+        pad = self.padding
+        components = max(p.shape[2] for k, p in self._pending)
+        if components == 2:
+            components = 3
+        items = sorted(self._pending, key=lambda kp: -kp[1].shape[0])
+
+        # Aim for a roughly square atlas that is at least as wide as the
+        # widest texture.
+        area = sum((p.shape[0] + 2*pad) * (p.shape[1] + 2*pad) for k, p in items)
+        width = max(int(numpy.ceil(numpy.sqrt(area))),
+                    max(p.shape[1] + 2*pad for k, p in items))
+        if self.power_of_two:
+            width = m3dIsPOW2(width)
+
+        places = []
+        x = y = shelf = 0
+        for key, p in items:
+            h, w = p.shape[0] + 2*pad, p.shape[1] + 2*pad
+            if x + w > width:
+                x, y, shelf = 0, y + shelf, 0
+            places.append((key, p, x, y))
+            x += w
+            shelf = max(shelf, h)
+        height = y + shelf
+        if self.power_of_two:
+            height = m3dIsPOW2(height)
+
+        atlas = numpy.zeros((height, width, components), numpy.uint8)
+        if components == 4:
+            atlas[:, :, 3] = 255
+        for key, p, x, y in places:
+            h, w = p.shape[:2]
+            block = _expand(p, components)
+            if pad:
+                block = numpy.pad(block, ((pad, pad), (pad, pad), (0, 0)), 'edge')
+            atlas[y:y + h + 2*pad, x:x + w + 2*pad] = block
+            self.regions[key] = Region(x + pad, y + pad, w, h, width, height)
+
+        self.width, self.height = width, height
+        self.pixels = atlas
+        self._pending = []
+        return atlas
+
+    def upload(self, mipmap=True, cache=True):
+        """make a GL texture object of the packed atlas
+
+        mipmap -> also build and upload the mip chain
+        cache -> when every texture came from add_file, take the mip chain
+            from the texture cache, building the cache file on a miss
+        Returns the texture name, left bound to GL_TEXTURE_2D.
+        """
+        if self.texture is None:
+            self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        if mipmap and cache and self._files:
+            cached = self._open_cached()
+            try:
+                cached.tex_image_2d(GL_TEXTURE_2D)
+            finally:
+                cached.close()
+        else:
+            if self.pixels is None:
+                self.pack()
+            format, internal_format = _FORMATS[self.pixels.shape[2]]
+            if mipmap:
+                levels = texcache.build_mip_chain(self.pixels)
+            else:
+                levels = [self.pixels]
+            glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+            for i, level in enumerate(levels):
+                h, w = level.shape[:2]
+                glTexImage2D(GL_TEXTURE_2D, i, internal_format, w, h, 0,
+                    format, GL_UNSIGNED_BYTE, numpy.ascontiguousarray(level))
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        if mipmap:
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        else:
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        return self.texture
+
+    def _open_cached(self):
+        """return a texcache.CachedTexture of the atlas mip chain and set up
+        the regions, packing and writing the cache file if there is none
+
+        The cache file is named by the source files and the packing options.
+        A .regions file beside it holds the rectangle of each source, in the
+        order they were added, since the keys themselves need not be
+        printable.
+        """
+        keys = [key for key, filename in self._files]
+        name = texcache.sources_hash([filename for key, filename in self._files],
+                                     keys, self.padding, self.power_of_two)
+        path = os.path.join(texcache.cache_dir, name + '.wktc')
+        regions_path = os.path.join(texcache.cache_dir, name + '.regions')
+        if not (os.path.exists(path) and os.path.exists(regions_path)):
+            if self.pixels is None:
+                self.pack()
+            if not os.path.isdir(texcache.cache_dir):
+                os.makedirs(texcache.cache_dir)
+            # The level data is renamed into place last, so a cache file is
+            # never found without its regions.
+            tmp = '%s.%d.tmp' % (regions_path, os.getpid())
+            f = open(tmp, 'w')
+            try:
+                for key in keys:
+                    r = self.regions[key]
+                    f.write('%d %d %d %d\n' % (r.x, r.y, r.width, r.height))
+            finally:
+                f.close()
+            os.rename(tmp, regions_path)
+            format, internal_format = _FORMATS[self.pixels.shape[2]]
+            texcache.write_cache(path, texcache.build_mip_chain(self.pixels),
+                                 format, internal_format)
+        cached = texcache.CachedTexture(path)
+        self.width, self.height = cached.width, cached.height
+        f = open(regions_path)
+        try:
+            rects = [map(int, line.split()) for line in f]
+        finally:
+            f.close()
+        for key, (x, y, width, height) in zip(keys, rects):
+            self.regions[key] = Region(x, y, width, height, self.width, self.height)
+        self._pending = []
+        return cached
+
+
+# Components -> (GL external format, GL internal format)
+_FORMATS = {
+    1: (GL_LUMINANCE, GL_LUMINANCE8),
+    3: (GL_BGR, GL_RGB8),
+    4: (GL_BGRA, GL_RGBA8),
+}
+
+
+def _load(filename):
+    """return the pixels of the .tga file filename as an array of their own"""
+    image = tga.load(filename)
+    try:
+        return image.as_array().copy()
+    finally:
+        image.close()
+
+
+def _expand(pixels, components):
+    """return pixels with its channels widened to components
+
+    One and two channel pixels are luminance and luminance-alpha; the
+    luminance goes to every color channel.
+    """
+    have = pixels.shape[2]
+    if have == components:
+        return pixels
+    h, w = pixels.shape[:2]
+    out = numpy.empty((h, w, components), numpy.uint8)
+    if have <= 2:
+        out[:, :, :3] = pixels[:, :, :1]
+    else:
+        out[:, :, :3] = pixels[:, :, :3]
+    if components == 4:
+        out[:, :, 3] = pixels[:, :, have - 1] if have in (2, 4) else 255
+    return out
+
+
+if __name__ == '__main__':
+    print 'shelf packing places every texture without overlap'
+    atlas = TextureAtlas(padding=2)
+    sizes = [(64, 64), (128, 32), (16, 100), (50, 50), (8, 8)]
+    for i, (h, w) in enumerate(sizes):
+        atlas.add(i, numpy.full((h, w, 3), i + 1, numpy.uint8))
+    pixels = atlas.pack()
+    for i, (h, w) in enumerate(sizes):
+        r = atlas[i]
+        assert (pixels[r.y:r.y + h, r.x:r.x + w] == i + 1).all()
+
+    print 'padding replicates texture edges'
+    r = atlas[0]
+    assert (pixels[r.y - 2:r.y, r.x:r.x + 64] == 1).all()
+
+    print 'regions remap 0..1 into texel centers of the region'
+    s, t = r.remap(0.0, 1.0)
+    assert abs(s * atlas.width - (r.x + 0.5)) < 1e-9
+    assert abs(t * atlas.height - (r.y + r.height - 0.5)) < 1e-9
+    st = numpy.array([[0.0, 0.0], [1.0, 1.0]], numpy.float32)
+    r.remap_array(st, st)
+    assert numpy.allclose(st, [r.remap(0.0, 0.0), r.remap(1.0, 1.0)])
+
+    print 'mixed BGR and BGRA sources make a BGRA atlas'
+    atlas = TextureAtlas()
+    atlas.add('rgb', numpy.zeros((4, 4, 3), numpy.uint8))
+    atlas.add('rgba', numpy.zeros((4, 4, 4), numpy.uint8))
+    assert atlas.pack().shape[2] == 4
+
+    print 'two channel sources spread luminance and keep their alpha'
+    la = numpy.empty((4, 4, 2), numpy.uint8)
+    la[:, :, 0], la[:, :, 1] = 10, 20
+    atlas = TextureAtlas(padding=0)
+    atlas.add('la', la)
+    pixels = atlas.pack()
+    assert pixels.shape[2] == 3 and (pixels == 10).all()
+    atlas = TextureAtlas(padding=0)
+    atlas.add('la', la)
+    atlas.add('rgba', numpy.zeros((4, 4, 4), numpy.uint8))
+    pixels = atlas.pack()
+    r = atlas['la']
+    assert (pixels[r.y:r.y + 4, r.x:r.x + 4] == (10, 10, 10, 20)).all()
+
+    print 'a file atlas uploads from the texture cache on later runs'
+    import shutil
+    import sys
+    import tempfile
+    uploads = []
+    def glTexImage2D(target, level, internal_format, w, h, border, format,
+                     type, data):
+        uploads.append((level, w, h, numpy.array(data).tostring()))
+    for module in (sys.modules[__name__], texcache):
+        setattr(module, 'glTexImage2D', glTexImage2D)
+        for name in ('glGenTextures', 'glBindTexture', 'glPixelStorei',
+                     'glTexParameteri'):
+            setattr(module, name, lambda *args: 1)
+    texcache.cache_dir = tempfile.mkdtemp()
+    try:
+        files = []
+        for i, (w, h) in enumerate([(6, 4), (3, 9)]):
+            name = os.path.join(texcache.cache_dir, '%d.tga' % (i,))
+            f = open(name, 'wb')
+            f.write(tga._HEADER.pack(0, 0, tga.TGA_TRUECOLOR, 0, 0, 0, 0, 0,
+                                     w, h, 24, 0))
+            f.write(chr(40 * (i + 1)) * (w * h * 3))
+            f.close()
+            files.append(name)
+        runs = []
+        for run in range(2):
+            del uploads[:]
+            atlas = TextureAtlas(padding=1)
+            for i, name in enumerate(files):
+                atlas.add_file(name, i)
+            atlas.upload()
+            runs.append((list(uploads), atlas.pixels,
+                         [vars(atlas[i]) for i in range(len(files))]))
+        (cold, packed, cold_regions), (warm, unpacked, warm_regions) = runs
+        assert packed is not None and unpacked is None
+        assert cold == warm and cold_regions == warm_regions
+        assert len(cold) == len(texcache.build_mip_chain(packed))
+        r = atlas[1]
+        pixels = numpy.frombuffer(warm[0][3], numpy.uint8).reshape(packed.shape)
+        assert (pixels[r.y:r.y + r.height, r.x:r.x + r.width] == 80).all()
+    finally:
+        shutil.rmtree(texcache.cache_dir)
@@ -0,0 +1,212 @@
+"""
+Asynchronous framebuffer capture.
+
+Reading the framebuffer back with glReadPixels and encoding it as PNG on the
+GL thread stalls rendering for the whole round trip. FrameCapture instead
+reads into pixel buffer objects: the glReadPixels call for frame N only
+queues a copy into a PBO, and the PBO is mapped on frame N+1 (or later, with
+more buffers), by which time the copy has finished. The mapped bytes are
+handed to a worker thread that does the PNG encoding, whose zlib work runs
+outside the GIL.
+
+Call frame() once per frame after the scene is drawn:
+
+    capture = FrameCapture()
+    ...
+    def on_draw(self):
+        ...draw scene...
+        capture.frame(self.width, self.height)
+
+Then capture.screenshot('Screenshot.png') saves the next frame, and
+capture.start_sequence('frame%05d.png') saves every frame until
+stop_sequence(). If the encoder falls behind, frames are dropped (and
+counted in dropped) rather than slowing down rendering.
+"""
+
+
+import ctypes
+import Queue
+import struct
+import threading
+import zlib
+
+import numpy
+from OpenGL.GL import *
+try:
+    from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as _glReadPixelsRaw
+except ImportError:
+    from OpenGL.raw.GL import glReadPixels as _glReadPixelsRaw
+
+
+def write_png(filename, width, height, rgba, level=6):
+    """write RGBA pixels to filename as a PNG
+
+    rgba -> width*height*4 bytes (str or numpy array) in GL order, i.e.
+        bottom row first
+    level -> zlib compression level
+    """
+    rows = numpy.frombuffer(rgba, numpy.uint8).reshape(height, width * 4)
+    # PNG is top row first, and each row starts with a filter type byte
+    raw = numpy.zeros((height, width * 4 + 1), numpy.uint8)
+    raw[:, 1:] = rows[::-1]
+
+    def chunk(tag, data):
+        crc = zlib.crc32(tag + data) & 0xffffffff
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+    f = open(filename, 'wb')
+    try:
+        f.write('\x89PNG\r\n\x1a\n')
+        f.write(chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        f.write(chunk('IDAT', zlib.compress(raw.tostring(), level)))
+        f.write(chunk('IEND', ''))
+    finally:
+        f.close()
+
+
+class FrameCapture(object):
+    """Double-buffered PBO readback with a background PNG encoder.
+
+    buffers -> number of PBOs in the ring. During a sequence a PBO is
+        mapped when the ring comes back round to it, buffers frames after
+        its read was issued.
+    max_pending -> frames waiting for the encoder before new ones are
+        dropped
+    """
+
+    def __init__(self, buffers=2, max_pending=8):
+        self.dropped = 0
+        self._nbuffers = buffers
+        self._pbos = None
+        self._size = None
+        self._index = 0
+        # Per PBO: (filename, width, height) of a read in flight, or None
+        self._inflight = [None] * buffers
+        self._requests = []
+        self._pattern = None
+        self._sequence = 0
+        self._queue = Queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._encode_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Requests
+    def screenshot(self, filename):
+        """save the next frame to filename"""
+        self._requests.append(filename)
+
+    def start_sequence(self, pattern, first=0):
+        """save every frame to pattern % n, with n counting from first"""
+        self._pattern = pattern
+        self._sequence = first
+
+    def stop_sequence(self):
+        self._pattern = None
+
+    # Per-frame work on the GL thread
+    def frame(self, width, height):
+        """capture the frame just drawn if one was requested, and hand any
+        finished readbacks to the encoder"""
+        filename = None
+        if self._requests:
+            filename = self._requests.pop(0)
+        elif self._pattern is not None:
+            filename = self._pattern % (self._sequence,)
+            self._sequence += 1
+        if filename is None and not any(self._inflight):
+            return
+
+        if self._size != (width, height):
+            self._resize(width, height)
+
+        i = self._index
+        self._index = (i + 1) % self._nbuffers
+        # The buffer we are about to reuse holds the oldest read; collect it
+        # first.
+        self._collect(i)
+        if filename is not None:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, self._pbos[i])
+            glPixelStorei(GL_PACK_ALIGNMENT, 1)
+            _glReadPixelsRaw(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE,
+                ctypes.c_void_p(0))
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+            self._inflight[i] = (filename, width, height)
+        elif not any(self._inflight):
+            return
+        else:
+            # Nothing new to read; drain the rest of the ring so the last
+            # frames of a sequence do not wait for another capture.
+            for j in range(self._nbuffers):
+                if j != i:
+                    self._collect(j)
+
+    def _resize(self, width, height):
+        self.flush()
+        if self._pbos is None:
+            self._pbos = [glGenBuffers(1) for i in range(self._nbuffers)]
+        for pbo in self._pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, width * height * 4, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self._size = (width, height)
+
+    def _collect(self, i):
+        """map PBO i, if a read is in flight there, and queue its pixels"""
+        job = self._inflight[i]
+        if job is None:
+            return
+        self._inflight[i] = None
+        filename, width, height = job
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self._pbos[i])
+        ptr = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        if ptr:
+            data = ctypes.string_at(ptr, width * height * 4)
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+            try:
+                self._queue.put_nowait((filename, width, height, data))
+            except Queue.Full:
+                self.dropped += 1
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def flush(self):
+        """collect every read in flight; call on the GL thread"""
+        for i in range(self._nbuffers):
+            self._collect(i)
+
+    def close(self):
+        """collect outstanding frames, wait for the encoder to finish, and
+        free the PBOs"""
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        if self._pbos is not None:
+            glDeleteBuffers(len(self._pbos), self._pbos)
+            self._pbos = None
+
+    # Encoder thread
+    def _encode_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            filename, width, height, data = job
+            write_png(filename, width, height, data)
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    print 'write_png writes a valid PNG, top row first'
+    path = os.path.join(tempfile.mkdtemp(), 'test.png')
+    # 2x2: bottom row red, top row green
+    rgba = numpy.array([255, 0, 0, 255] * 2 + [0, 255, 0, 255] * 2, numpy.uint8)
+    write_png(path, 2, 2, rgba.tostring())
+    data = open(path, 'rb').read()
+    assert data.startswith('\x89PNG\r\n\x1a\n')
+    idat = data.index('IDAT')
+    length = struct.unpack('>I', data[idat - 4:idat])[0]
+    raw = zlib.decompress(data[idat + 4:idat + 4 + length])
+    assert raw == '\x00' + '\x00\xff\x00\xff' * 2 + '\x00' + '\xff\x00\x00\xff' * 2
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
@@ -0,0 +1,121 @@
+"""
+Cel (toon) shading with a 1D texture, computed for a whole mesh at once.
+
+Toon shading looks up a 1D texture of flat color bands with the diffuse
+intensity N.L of each vertex. Rather than transform every normal into eye
+space, the light is taken into object space once per frame through the
+inverse of the modelview matrix, and then a single matrix product of the
+normal array with the light gives every texture coordinate.
+
+Positions and indices go into static vertex buffers when the mesh is
+created; only the texture coordinate stream is rewritten each frame,
+through a streambuffer.StreamBuffer.
+
+    torus = CelShadedMesh(mesh.torus_mesh(0.35, 0.15, 50, 25))
+    ...
+    torus.update(modelview.matrix, vLightDir)   # a matrixstack.MatrixStack
+    torus.draw()
+"""
+
+
+import numpy
+from OpenGL.GL import *
+
+from streambuffer import StreamBuffer
+from vertexpipe import as_matrix
+
+
+def object_space_light(vLightDir, modelview):
+    """return the unit direction, in object space, of an eye space light
+    direction, given the modelview matrix (column-major, flat or (4, 4) as
+    glGetFloatv returns it)"""
+    inverse = numpy.linalg.inv(as_matrix(numpy.ravel(modelview)))
+    # A direction has no position, so only the upper 3x3 applies
+    light = numpy.dot(numpy.asarray(vLightDir, numpy.float32), inverse[:3, :3])
+    return (light / numpy.sqrt(numpy.dot(light, light))).astype(numpy.float32)
+
+
+def toon_texcoords(normals, light, out=None):
+    """return the 1D toon texture coordinate N.L for each row of an (n, 3)
+    unit normal array, into out if given"""
+    return numpy.dot(normals, light, out)
+
+
+class CelShadedMesh(object):
+    """A mesh drawn with toon texture coordinates from its normals.
+
+    mesh -> a mesh.Mesh with unit normals
+    stream -> optional StreamBuffer for the texture coordinates, shared
+        with other dynamic meshes; its owner calls end_frame after the
+        frame's draws. By default the mesh keeps one of its own.
+    """
+
+    def __init__(self, mesh, stream=None):
+        self.mesh = mesh
+        self.texcoords = numpy.zeros(len(mesh), numpy.float32)
+        mesh.upload(('positions',))
+        self._own_stream = stream is None
+        if stream is None:
+            stream = StreamBuffer(4 * self.texcoords.nbytes)
+        self.stream = stream
+        self._region = None
+
+    def update(self, modelview, vLightDir):
+        """recompute the texture coordinates for the light direction (eye
+        space) under modelview, and stream them to the GPU"""
+        light = object_space_light(vLightDir, modelview)
+        toon_texcoords(self.mesh.normals, light, self.texcoords)
+        if self._own_stream:
+            # The last update has been drawn by now
+            self.stream.end_frame()
+        self._region = self.stream.write(self.texcoords) + (1,)
+
+    def draw(self):
+        """draw with the current modelview and the 1D toon texture bound"""
+        self.mesh.draw(normals=None, texcoords=self._region)
+
+    def delete(self):
+        """free the vertex buffers"""
+        self.mesh.delete()
+        if self._own_stream and self.stream is not None:
+            self.stream.delete()
+            self.stream = None
+
+
+if __name__ == '__main__':
+    import time
+
+    from math3d import M3DMatrix44f, M3DVector3f, m3dRotationMatrix44, \
+        m3dInvertMatrix44, m3dTransformVector3, m3dNormalizeVector, \
+        m3dDotProduct, m3dDegToRad
+    import mesh
+
+    print 'object space light matches the m3dInvertMatrix44 route'
+    m = M3DMatrix44f()
+    m3dRotationMatrix44(m, m3dDegToRad(40.0), 0.0, 1.0, 0.0)
+    m[14] = -2.5
+    vLightDir = [-1.0, 1.0, 1.0]
+    mInvertedLight = M3DMatrix44f()
+    vNewLight = M3DVector3f()
+    m3dInvertMatrix44(mInvertedLight, m)
+    m3dTransformVector3(vNewLight, vLightDir, mInvertedLight)
+    vNewLight[0] -= mInvertedLight[12]
+    vNewLight[1] -= mInvertedLight[13]
+    vNewLight[2] -= mInvertedLight[14]
+    m3dNormalizeVector(vNewLight)
+    glmatrix = numpy.array(m[:], numpy.float32).reshape(4, 4)
+    light = object_space_light(vLightDir, glmatrix)
+    assert numpy.allclose(light, vNewLight[:], atol=1e-6)
+
+    print 'texture coordinates are N.L per vertex'
+    torus = mesh.torus_mesh(0.35, 0.15, 50, 25)
+    tc = toon_texcoords(torus.normals, light)
+    for i in (0, 7, len(torus) - 1):
+        assert abs(tc[i] - m3dDotProduct(vNewLight, torus.normals[i].tolist())) < 1e-5
+
+    big = mesh.torus_mesh(0.35, 0.15, 500, 250)
+    out = numpy.empty(len(big), numpy.float32)
+    t = time.time()
+    for i in range(50):
+        toon_texcoords(big.normals, object_space_light(vLightDir, glmatrix), out)
+    print '%d vertices: %.2f ms per frame' % (len(big), (time.time() - t) * 1000.0 / 50)
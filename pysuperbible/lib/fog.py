@@ -0,0 +1,129 @@
+"""
+Per-vertex fog on the CPU.
+
+GL fog is computed per fragment on many software renderers. For geometry
+whose vertices we already have in arrays, Fog computes the fog factor of
+every vertex from its eye space depth in one vectorized pass and blends the
+vertex colors toward the fog color, so GL_FOG can be turned off for it.
+Anything entirely beyond the distance where fog becomes opaque can be
+skipped outright:
+
+    fog = Fog.from_gl()         # same parameters as the glFog calls
+    ...
+    depth = eye_depth(centers, modelview)
+    for obj in compress(objects, fog.visible(depth, radius)):
+        ...
+
+The equations are GL's: linear (end - d) / (end - start), exp e**(-density
+* d) and exp2 e**(-(density * d)**2), clamped to 0..1, where d is the eye
+space depth, the same approximation of distance GL uses.
+"""
+
+
+import math
+
+import numpy
+from OpenGL.GL import *
+
+from vertexpipe import as_matrix
+
+
+# Exponential fog never reaches zero; stop where it is below one step of an
+# 8 bit color channel.
+_EPSILON = 1.0 / 255.0
+
+
+def eye_depth(points, modelview):
+    """return the eye space depth of each row of an (n, 3) array of points
+    under a column-major modelview matrix"""
+    m = as_matrix(modelview)
+    return numpy.abs(numpy.dot(points, m[:3, 2]) + m[3, 2])
+
+
+class Fog(object):
+    """Fog parameters and the per-vertex fog equation.
+
+    mode -> GL_LINEAR, GL_EXP or GL_EXP2
+    start, end -> linear fog range
+    density -> exp and exp2 density
+    color -> RGB(A) fog color
+    """
+
+    def __init__(self, mode=GL_LINEAR, start=0.0, end=1.0, density=1.0,
+                 color=(0.0, 0.0, 0.0, 0.0)):
+        self.mode = mode
+        self.start = start
+        self.end = end
+        self.density = density
+        self.color = numpy.asarray(color, numpy.float32)[:3]
+
+    @classmethod
+    def from_gl(cls):
+        """return the fog set up by the current glFog state"""
+        return cls(int(glGetIntegerv(GL_FOG_MODE)), float(glGetFloatv(GL_FOG_START)),
+                   float(glGetFloatv(GL_FOG_END)), float(glGetFloatv(GL_FOG_DENSITY)),
+                   glGetFloatv(GL_FOG_COLOR))
+
+    @property
+    def far(self):
+        """depth beyond which the fog is opaque"""
+        if self.mode == GL_LINEAR:
+            return self.end
+        if self.mode == GL_EXP:
+            return -math.log(_EPSILON) / self.density
+        return math.sqrt(-math.log(_EPSILON)) / self.density
+
+    def factors(self, depth, out=None):
+        """return the fog factor, 1.0 clear to 0.0 fogged, for each depth"""
+        depth = numpy.asarray(depth, numpy.float32)
+        if out is None:
+            out = numpy.empty(depth.shape, numpy.float32)
+        if self.mode == GL_LINEAR:
+            numpy.subtract(self.end, depth, out)
+            out *= 1.0 / (self.end - self.start)
+        else:
+            numpy.multiply(depth, -self.density, out)
+            if self.mode == GL_EXP2:
+                numpy.square(out, out)
+                numpy.negative(out, out)
+            numpy.exp(out, out)
+        return numpy.clip(out, 0.0, 1.0, out)
+
+    def apply(self, colors, depth, factors=None):
+        """blend the RGB of an (n, 3) or (n, 4) color array toward the fog
+        color in place, by the fog factor of each depth"""
+        f = self.factors(depth, factors)[:, numpy.newaxis]
+        rgb = colors[:, :3]
+        rgb -= self.color
+        rgb *= f
+        rgb += self.color
+
+    def visible(self, depth, radius=0.0):
+        """return whether things of the given radius at each depth show at
+        all through the fog; a bool, or bool array for an array of depths"""
+        return numpy.asarray(depth) - radius < self.far
+
+
+if __name__ == '__main__':
+    print 'fog factors follow the GL equations'
+    fog = Fog(GL_LINEAR, 5.0, 30.0, color=(0.25, 0.25, 0.25, 1.0))
+    assert numpy.allclose(fog.factors([0.0, 5.0, 17.5, 30.0, 40.0]), [1, 1, 0.5, 0, 0])
+    fog = Fog(GL_EXP, density=0.1)
+    assert numpy.allclose(fog.factors([10.0]), [math.exp(-1.0)])
+    fog = Fog(GL_EXP2, density=0.1)
+    assert numpy.allclose(fog.factors([20.0]), [math.exp(-4.0)])
+
+    print 'colors blend toward the fog color'
+    fog = Fog(GL_LINEAR, 5.0, 30.0, color=(0.25, 0.25, 0.25, 1.0))
+    colors = numpy.array([[1.0, 0.0, 0.5, 1.0]] * 3, numpy.float32)
+    fog.apply(colors, [0.0, 17.5, 30.0])
+    assert numpy.allclose(colors[:, 0], [1.0, 0.625, 0.25])
+    assert numpy.allclose(colors[:, 3], 1.0)
+
+    print 'depth and culling work in eye space'
+    m = numpy.identity(4, numpy.float32)
+    m[3, 2] = -10.0     # translate by -10 in z
+    depth = eye_depth(numpy.array([[0, 0, 0], [0, 0, -25.0]]), m.ravel())
+    assert numpy.allclose(depth, [10.0, 35.0])
+    assert fog.visible(depth, 1.0).tolist() == [True, False]
+    assert fog.visible(depth, 6.0).tolist() == [True, True]
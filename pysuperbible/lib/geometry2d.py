@@ -0,0 +1,110 @@
+"""
+Cached 2D geometry in vertex arrays.
+
+The 2D backdrops in the demos (moons, horizons) used to be re-emitted every
+frame with glBegin/glVertex2f loops, computing cos and sin per vertex. Here
+the shapes are generated once into numpy vertex arrays and drawn with one
+glDrawArrays each. A GeometryCache keeps them by name along with the
+parameters they were built from, so a shape is only rebuilt when its
+parameters change or the cache is invalidated, e.g. on resize.
+
+    cache = GeometryCache()
+    ...
+    cache.get('moon', disc, x, y, r).draw()
+"""
+
+
+import numpy
+from OpenGL.GL import *
+
+from math3d import M3D_2PI
+
+
+class Shape2D(object):
+    """A vertex array and the primitive it is drawn as.
+
+    mode -> GL primitive, e.g. GL_TRIANGLE_FAN or GL_LINE_STRIP
+    vertices -> (n, 2) float32 numpy array
+    """
+
+    def __init__(self, mode, vertices):
+        self.mode = mode
+        self.vertices = numpy.ascontiguousarray(vertices, numpy.float32)
+
+    def draw(self):
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(2, GL_FLOAT, 0, self.vertices)
+        glDrawArrays(self.mode, 0, len(self.vertices))
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+
+def circle_points(x, y, r, segments=64):
+    """return (segments, 2) points evenly spaced around a circle"""
+    angle = numpy.arange(segments) * (M3D_2PI / segments)
+    points = numpy.empty((segments, 2), numpy.float32)
+    points[:, 0] = x + numpy.cos(angle) * r
+    points[:, 1] = y + numpy.sin(angle) * r
+    return points
+
+
+def circle(x, y, r, segments=64):
+    """return a Shape2D outline of a circle"""
+    return Shape2D(GL_LINE_LOOP, circle_points(x, y, r, segments))
+
+
+def disc(x, y, r, segments=64):
+    """return a Shape2D filled circle: a triangle fan around the center,
+    closed back on its first rim vertex"""
+    rim = circle_points(x, y, r, segments)
+    return Shape2D(GL_TRIANGLE_FAN, numpy.concatenate(([(x, y)], rim, rim[:1])))
+
+
+def polyline(points, closed=False):
+    """return a Shape2D line strip (or loop if closed) through points"""
+    return Shape2D(GL_LINE_LOOP if closed else GL_LINE_STRIP, points)
+
+
+def strip(points):
+    """return a Shape2D triangle strip of points"""
+    return Shape2D(GL_TRIANGLE_STRIP, points)
+
+
+class GeometryCache(object):
+    """Shapes by name, rebuilt only when their parameters change."""
+
+    def __init__(self):
+        self._shapes = {}
+
+    def get(self, name, builder, *args):
+        """return the shape called name, building it with builder(*args) if
+        it is missing or was built with different args"""
+        entry = self._shapes.get(name)
+        if entry is None or entry[0] != args:
+            entry = (args, builder(*args))
+            self._shapes[name] = entry
+        return entry[1]
+
+    def invalidate(self, name=None):
+        """forget the shape called name, or every shape if name is None"""
+        if name is None:
+            self._shapes.clear()
+        else:
+            self._shapes.pop(name, None)
+
+
+if __name__ == '__main__':
+    print 'disc is a closed fan around its center'
+    d = disc(10.0, 20.0, 5.0, 4)
+    assert d.mode == GL_TRIANGLE_FAN
+    assert d.vertices[0].tolist() == [10.0, 20.0]
+    assert d.vertices[1].tolist() == d.vertices[-1].tolist() == [15.0, 20.0]
+    assert len(d.vertices) == 6
+
+    print 'cache reuses shapes until their parameters change'
+    cache = GeometryCache()
+    a = cache.get('moon', disc, 0.0, 0.0, 1.0)
+    assert cache.get('moon', disc, 0.0, 0.0, 1.0) is a
+    assert cache.get('moon', disc, 0.0, 0.0, 2.0) is not a
+    b = cache.get('moon', disc, 0.0, 0.0, 2.0)
+    cache.invalidate()
+    assert cache.get('moon', disc, 0.0, 0.0, 2.0) is not b
@@ -76,37 +76,36 @@ class GLFrame(object):
     def TranslateWorld(self, *xyz):
         """Set up from xyz. xyz[0] is either a M3DVector3f object, or
         a sequence of length 3, or xyz[0:3] is x, y, and z points."""
-        x,y,z = vector_varargs(xyz, self.origin)
-        self.origin += (x,y,z)
+        self.origin.add_into(vector_varargs(xyz, self.origin))
     
     def TranslateLocal(self, *xyz):
         """Set up from xyz. xyz[0] is either a M3DVector3f object, or
         a sequence of length 3, or xyz[0:3] is x, y, and z points."""
         x,y,z = vector_varargs(xyz, self.origin)
-        self.MoveForward(z); self.Up(y); self.MoveRight(x)
+        self.MoveForward(z); self.MoveUp(y); self.MoveRight(x)
 
     # Move Forward (along Z axis)
     def MoveForward(self, delta):
         # Move along direction of front direction
-        self.origin[:] += self.forward * ((delta,)*3)
+        self.origin.madd(self.forward, delta)
 
     def MoveUp(self, delta):
         # Move along direction of up direction
-        self.origin[:] += self.up * ((delta,)*3)
+        self.origin.madd(self.up, delta)
     
     def MoveRight(self, delta):
-        cross = M3DVector3f()
-        m3dCrossProduct(cross, self.up, self.forward)
-        self.origin += cross * ((delta,)*3)
+        with m3dPool.scope(M3DVector3f) as (cross,):
+            m3dCrossProduct(cross, self.up, self.forward)
+            self.origin.madd(cross, delta)
 
     # Just assemble the matrix
     def GetMatrix(self, matrix, rotation_only=False):
         """matrix is a M3DMatrix44f object."""
         # Calculate the right side (x) vector, drop it right into the matrix
-        xaxis = M3DVector3f()
-        m3dCrossProduct(xaxis, self.up, self.forward)
-        # Set matrix column does not fill in the fourth value...
-        m3dSetMatrixColumn44(matrix, xaxis, 0)
+        with m3dPool.scope(M3DVector3f) as (xaxis,):
+            m3dCrossProduct(xaxis, self.up, self.forward)
+            # Set matrix column does not fill in the fourth value...
+            m3dSetMatrixColumn44(matrix, xaxis, 0)
         matrix[3] = 0.0
         # Y Column
         m3dSetMatrixColumn44(matrix, self.up, 1)
@@ -128,39 +127,37 @@ class GLFrame(object):
         m is a M3DMatrix44f object. Get a 4x4 transformation matrix that
         describes the camera orientation.
         """
-        x = M3DVector3f()
-        z = M3DVector3f()
-
-        # Make rotation matrix
-        # Z vector is reversed
-        forward = self.forward
-        z.x = -forward.x
-        z.y = -forward.y
-        z.z = -forward.z
-
-        # X vector = Y cross Z 
-        up = self.up
-        m3dCrossProduct(x, up, z)
-
-        # Matrix has no translation information and is
-        # transposed.... (rows instead of columns)
-        def M(row,col,val): m[col*4+row] = val
-        M(0,0, x[0])
-        M(0,1, x[1])
-        M(0,2, x[2])
-        M(0,3, 0.0)
-        M(1,0, up[0])
-        M(1,1, up[1])
-        M(1,2, up[2])
-        M(1,3, 0.0)
-        M(2,0, z[0])
-        M(2,1, z[1])
-        M(2,2, z[2])
-        M(2,3, 0.0)
-        M(3,0, 0.0)
-        M(3,1, 0.0)
-        M(3,2, 0.0)
-        M(3,3, 1.0)
+        with m3dPool.scope(M3DVector3f, M3DVector3f) as (x, z):
+            # Make rotation matrix
+            # Z vector is reversed
+            forward = self.forward
+            z.x = -forward.x
+            z.y = -forward.y
+            z.z = -forward.z
+
+            # X vector = Y cross Z 
+            up = self.up
+            m3dCrossProduct(x, up, z)
+
+            # Matrix has no translation information and is
+            # transposed.... (rows instead of columns)
+            def M(row,col,val): m[col*4+row] = val
+            M(0,0, x[0])
+            M(0,1, x[1])
+            M(0,2, x[2])
+            M(0,3, 0.0)
+            M(1,0, up[0])
+            M(1,1, up[1])
+            M(1,2, up[2])
+            M(1,3, 0.0)
+            M(2,0, z[0])
+            M(2,1, z[1])
+            M(2,2, z[2])
+            M(2,3, 0.0)
+            M(3,0, 0.0)
+            M(3,1, 0.0)
+            M(3,2, 0.0)
+            M(3,3, 1.0)
 
     def ApplyCameraTransform(self, rot_only=False):
         """Perform viewing or modeling transformations.
@@ -172,16 +169,16 @@ class GLFrame(object):
         routines are used... This will get called once per frame.... Go
         ahead and inline.
         """
-        m = M3DMatrix44f()
-
-        self.GetCameraOrientation(m)
+        with m3dPool.scope(M3DMatrix44f) as (m,):
+            self.GetCameraOrientation(m)
         
-        # Camera Transform   
-        glMultMatrixf(list(m))
+            # Camera Transform   
+            glMultMatrixf(m[:])
     
         # If Rotation only, then do not do the translation
         if not rot_only:
-            glTranslatef(*-self.origin);
+            origin = self.origin
+            glTranslatef(-origin[0], -origin[1], -origin[2])
 
         """
         /*gluLookAt(vOrigin[0], vOrigin[1], vOrigin[2],
@@ -192,74 +189,68 @@ class GLFrame(object):
         */
         """
 
-    def ApplyActorTransform(self, rotation_only=False):
+    def ApplyActorTransform(self, rotation_only=False, out=None):
         """Position as an object in the scene.
         This places and orients a coordinate frame for other objects
         (besides the camera). There is ample room for optimization
         here... This is going to be called alot... don't inline. Add flag
         to perform actor rotation only and not the translation.
+        Returns the matrix applied: out if given, else a new M3DMatrix44f.
         """
-        rot_mat = M3DMatrix44f()
+        rot_mat = M3DMatrix44f() if out is None else out
         self.GetMatrix(rot_mat, rotation_only);
 
         # Apply rotation to the current matrix
-        glMultMatrixf(list(rot_mat))
+        glMultMatrixf(rot_mat[:])
         return rot_mat
 
     def RotateLocalX(self, angle):
         """Rotate around local X Axes - Note all rotations are in radians"""
-        rot_mat = M3DMatrix44f()
-        cross = M3DVector3f()
-        m3dCrossProduct(cross, self.up, self.forward)
-        m3dRotationMatrix44(rot_mat, angle, cross.x, cross.y, cross.z)
-
-        new_vect = M3DVector3f('000')
-        # Inline 3x3 matrix multiply for rotation only
-        forward = self.forward
-        new_vect[0] = rot_mat[0] * forward[0] + rot_mat[4] * forward[1] + rot_mat[8] *  forward[2]
-        new_vect[1] = rot_mat[1] * forward[0] + rot_mat[5] * forward[1] + rot_mat[9] *  forward[2]
-        new_vect[2] = rot_mat[2] * forward[0] + rot_mat[6] * forward[1] + rot_mat[10] * forward[2]
-        forward[:] = new_vect
-
-        # Update pointing up vector
-        up = self.up
-        new_vect[0] = rot_mat[0] * up[0] + rot_mat[4] * up[1] + rot_mat[8] *  up[2]
-        new_vect[1] = rot_mat[1] * up[0] + rot_mat[5] * up[1] + rot_mat[9] *  up[2]
-        new_vect[2] = rot_mat[2] * up[0] + rot_mat[6] * up[1] + rot_mat[10] * up[2]
-        up[:] = new_vect
+        with m3dPool.scope(M3DMatrix44f, M3DVector3f, M3DVector3f) as (rot_mat, cross, new_vect):
+            m3dCrossProduct(cross, self.up, self.forward)
+            m3dRotationMatrix44(rot_mat, angle, cross.x, cross.y, cross.z)
+
+            # Inline 3x3 matrix multiply for rotation only
+            forward = self.forward
+            new_vect[0] = rot_mat[0] * forward[0] + rot_mat[4] * forward[1] + rot_mat[8] *  forward[2]
+            new_vect[1] = rot_mat[1] * forward[0] + rot_mat[5] * forward[1] + rot_mat[9] *  forward[2]
+            new_vect[2] = rot_mat[2] * forward[0] + rot_mat[6] * forward[1] + rot_mat[10] * forward[2]
+            forward[:] = new_vect
+
+            # Update pointing up vector
+            up = self.up
+            new_vect[0] = rot_mat[0] * up[0] + rot_mat[4] * up[1] + rot_mat[8] *  up[2]
+            new_vect[1] = rot_mat[1] * up[0] + rot_mat[5] * up[1] + rot_mat[9] *  up[2]
+            new_vect[2] = rot_mat[2] * up[0] + rot_mat[6] * up[1] + rot_mat[10] * up[2]
+            up[:] = new_vect
 
     def RotateLocalY(self, angle):
         """Rotate around local Y"""
-        rot_mat = M3DMatrix44f()
-
-        # Just Rotate around the up vector
-        # Create a rotation matrix around my Up (Y) vector
-        up = self.up
-        m3dRotationMatrix44(rot_mat, angle, up[0], up[1], up[2])
-
-        new_vect = M3DVector3f()
-
-        # Rotate forward pointing vector (inlined 3x3 transform)
-        forward = self.forward
-        new_vect[0] = rot_mat[0] * forward[0] + rot_mat[4] * forward[1] + rot_mat[8] *  forward[2]
-        new_vect[1] = rot_mat[1] * forward[0] + rot_mat[5] * forward[1] + rot_mat[9] *  forward[2]
-        new_vect[2] = rot_mat[2] * forward[0] + rot_mat[6] * forward[1] + rot_mat[10] * forward[2]
-        forward[:] = new_vect
+        with m3dPool.scope(M3DMatrix44f, M3DVector3f) as (rot_mat, new_vect):
+            # Just Rotate around the up vector
+            # Create a rotation matrix around my Up (Y) vector
+            up = self.up
+            m3dRotationMatrix44(rot_mat, angle, up[0], up[1], up[2])
+
+            # Rotate forward pointing vector (inlined 3x3 transform)
+            forward = self.forward
+            new_vect[0] = rot_mat[0] * forward[0] + rot_mat[4] * forward[1] + rot_mat[8] *  forward[2]
+            new_vect[1] = rot_mat[1] * forward[0] + rot_mat[5] * forward[1] + rot_mat[9] *  forward[2]
+            new_vect[2] = rot_mat[2] * forward[0] + rot_mat[6] * forward[1] + rot_mat[10] * forward[2]
+            forward[:] = new_vect
 
     def RotateLocalZ(self, fAngle):
         """Rotate around local Z"""
-        rot_mat = M3DMatrix44f()
+        with m3dPool.scope(M3DMatrix44f, M3DVector3f) as (rot_mat, new_vect):
+            # Only the up vector needs to be rotated
+            forward = self.forward
+            m3dRotationMatrix44(rot_mat, fAngle, forward.x, forward.y, forward.z)
 
-        # Only the up vector needs to be rotated
-        forward = self.forward
-        m3dRotationMatrix44(rot_mat, fAngle, forward.x, forward.y, forward.z)
-
-        new_vect = M3DVector3f()
-        up = self.up
-        new_vect[0] = rot_mat[0] * up[0] + rot_mat[4] * up[1] + rot_mat[8] *  up[2]
-        new_vect[1] = rot_mat[1] * up[0] + rot_mat[5] * up[1] + rot_mat[9] *  up[2]
-        new_vect[2] = rot_mat[2] * up[0] + rot_mat[6] * up[1] + rot_mat[10] * up[2]
-        up[:] = new_vect
+            up = self.up
+            new_vect[0] = rot_mat[0] * up[0] + rot_mat[4] * up[1] + rot_mat[8] *  up[2]
+            new_vect[1] = rot_mat[1] * up[0] + rot_mat[5] * up[1] + rot_mat[9] *  up[2]
+            new_vect[2] = rot_mat[2] * up[0] + rot_mat[6] * up[1] + rot_mat[10] * up[2]
+            up[:] = new_vect
 
     def Normalize(self):
         """Reset axes to make sure they are orthonormal. This should be
@@ -336,24 +327,22 @@ class GLFrame(object):
 
     def WorldToLocal(self, vWorld, vLocal):
         """Change world coordinates into "local" coordinates"""
-        # Translate the origin
-        vNewWorld = M3DVector3f()
-        origin = self.origin
-        vNewWorld[0] = vWorld[0] - origin.x
-        vNewWorld[1] = vWorld[1] - origin.y
-        vNewWorld[2] = vWorld[2] - origin.z
-
-        # Create the rotation matrix based on the vectors
-        rotMat = M3DMatrix44f()
-        invMat = M3DMatrix44f()
-        self.GetMatrix(rotMat, True)
-
-        # Do the rotation based on inverted matrix
-        m3dInvertMatrix44(invMat, rotMat)
-
-        vLocal[0] = invMat[0] * vNewWorld[0] + invMat[4] * vNewWorld[1] + invMat[8] *  vNewWorld[2]
-        vLocal[1] = invMat[1] * vNewWorld[0] + invMat[5] * vNewWorld[1] + invMat[9] *  vNewWorld[2]
-        vLocal[2] = invMat[2] * vNewWorld[0] + invMat[6] * vNewWorld[1] + invMat[10] * vNewWorld[2]
+        with m3dPool.scope(M3DVector3f, M3DMatrix44f, M3DMatrix44f) as (vNewWorld, rotMat, invMat):
+            # Translate the origin
+            origin = self.origin
+            vNewWorld[0] = vWorld[0] - origin.x
+            vNewWorld[1] = vWorld[1] - origin.y
+            vNewWorld[2] = vWorld[2] - origin.z
+
+            # Create the rotation matrix based on the vectors
+            self.GetMatrix(rotMat, True)
+
+            # Do the rotation based on inverted matrix
+            m3dInvertMatrix44(invMat, rotMat)
+
+            vLocal[0] = invMat[0] * vNewWorld[0] + invMat[4] * vNewWorld[1] + invMat[8] *  vNewWorld[2]
+            vLocal[1] = invMat[1] * vNewWorld[0] + invMat[5] * vNewWorld[1] + invMat[9] *  vNewWorld[2]
+            vLocal[2] = invMat[2] * vNewWorld[0] + invMat[6] * vNewWorld[1] + invMat[10] * vNewWorld[2]
     
     def TransformPoint(vPointSrc, vPointDst):
         """Transform a point by frame matrix"""
@@ -404,3 +393,41 @@ if __name__ == '__main__':
     assert f.up == [1,0,0]
     f.SetUpVector((0,1,0))
     assert f.up == [0,1,0]
+
+    print 'GLFrame takes its temporaries from the pool when it is enabled'
+    results = []
+    for enabled in (False, True):
+        m3dPool.enabled = enabled
+        f = GLFrame()
+        f.SetOrigin(1, 2, 3)
+        local = M3DVector3f()
+        for i in range(3):
+            f.RotateLocalX(0.1); f.RotateLocalY(0.2); f.RotateLocalZ(0.3)
+            f.WorldToLocal((0, 0, 0), local)
+        misses = m3dPool.misses
+        f.RotateLocalX(0.1); f.RotateLocalY(0.2); f.RotateLocalZ(0.3)
+        f.WorldToLocal((0, 0, 0), local)
+        assert enabled == (m3dPool.misses == misses)
+        results.append(f.forward[:] + f.up[:] + local[:])
+    assert all(abs(a - b) < 1e-9 for a, b in zip(*results))
+    m3dPool.enabled = False
+    m3dPool.clear()
+
+    print 'camera and actor transforms make no math3d objects from a warm pool'
+    applied = []
+    glMultMatrixf = lambda m: applied.append(m)
+    glTranslatef = lambda x, y, z: None
+    m3dPool.enabled = True
+    f = GLFrame()
+    f.SetOrigin(1, 2, 3)
+    actor = M3DMatrix44f()
+    f.ApplyCameraTransform(); f.MoveRight(0.5)
+    misses = m3dPool.misses
+    for i in range(3):
+        f.ApplyCameraTransform()
+        assert f.ApplyActorTransform(out=actor) is actor
+        f.MoveRight(0.5)
+    assert m3dPool.misses == misses
+    assert applied[-1] == actor[:] and actor[12:15] == [-0.5, 2.0, 3.0]
+    m3dPool.enabled = False
+    m3dPool.clear()
@@ -1,18 +1,49 @@
 from math import cos, sin
 
+import numpy
+
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
 
 from math3d import *
+import tga
+
 
+# Load a TGA as a 2D Texture. Returns the pixel data (a numpy byte array,
+# bottom row first) and the width, height, GL internal format and GL external
+# format needed to feed it to glTexImage2D. The pixels of an uncompressed file
+# are a view of a memory map of the file, so nothing is copied until GL reads
+# them.
+def gltLoadTGA(szFileName):
+    image = tga.load(szFileName)
+    return image.data, image.width, image.height, image.internal_format, image.format
+
+# Texture coordinate helper for the shape functions. When an atlas Region is
+# given, the shape's 0..1 coordinates are remapped into that region.
+def _texCoordFunc(region):
+    if region is None:
+        return glTexCoord2f
+    def texCoord(s, t):
+        glTexCoord2f(*region.remap(s, t))
+    return texCoord
 
 # For best results, put this in a display list
 # Draw a torus (doughnut)  at z = fZVal... torus is in xy plane
-def gltDrawTorus(majorRadius, minorRadius, numMajor, numMinor):
-    vNormal = M3DVector3f()
+# region -> optional atlas.Region the texture coordinates are remapped into
+def gltDrawTorus(majorRadius, minorRadius, numMajor, numMinor, region=None):
+    glTexCoord2f = _texCoordFunc(region)
     majorStep = 2.0*M3D_PI / numMajor
     minorStep = 2.0*M3D_PI / numMinor
+
+    # Every normal at once, normalized in one call
+    a = numpy.arange(numMajor + 1)[:, numpy.newaxis] * majorStep
+    b = numpy.arange(numMinor + 1)[numpy.newaxis, :] * minorStep
+    vNormals = numpy.empty((numMajor + 1, numMinor + 1, 3))
+    vNormals[..., 0] = numpy.cos(a) * numpy.cos(b)
+    vNormals[..., 1] = numpy.sin(a) * numpy.cos(b)
+    vNormals[..., 2] = numpy.sin(b)
+    vNormals = m3dNormalizeVectorArray(vNormals).tolist()
     
     for i in range(numMajor):
         a0 = i * majorStep
@@ -31,25 +62,19 @@ def gltDrawTorus(majorRadius, minorRadius, numMajor, numMinor):
             
             # First point
             glTexCoord2f(float(i)/float(numMajor), float(j)/float(numMinor))
-            vNormal.x = x0*c
-            vNormal.y = y0*c
-            vNormal.z = z/minorRadius
-            m3dNormalizeVector(vNormal)
-            glNormal3fv(list(vNormal))
+            glNormal3fv(vNormals[i][j])
             glVertex3f(x0*r, y0*r, z)
             
             glTexCoord2f(float(i+1)/float(numMajor), float(j)/float(numMinor))
-            vNormal.x = x1*c
-            vNormal.y = y1*c
-            vNormal.z = z/minorRadius
-            m3dNormalizeVector(vNormal)
-            glNormal3fv(list(vNormal))
+            glNormal3fv(vNormals[i+1][j])
             glVertex3f(x1*r, y1*r, z)
         glEnd()
 
 # For best results, put this in a display list
 # Draw a sphere at the origin
-def gltDrawSphere(fRadius, iSlices, iStacks):
+# region -> optional atlas.Region the texture coordinates are remapped into
+def gltDrawSphere(fRadius, iSlices, iStacks, region=None):
+    glTexCoord2f = _texCoordFunc(region)
     drho = 3.141592653589 / iStacks
     dtheta = 2.0 * 3.141592653589 / iSlices
     ds = 1.0 / iSlices
@@ -0,0 +1,536 @@
+"""
+Recording and replaying the GL call stream.
+
+GLRecorder captures every gl* call a program makes for a number of frames,
+with its arguments, into a compact binary trace. Buffers passed to GL,
+ctypes arrays and numpy arrays, are stored once per distinct content, by
+hash, however often they are passed. replay() then issues the trace again,
+normally in a process doing nothing else, and times it per call group,
+which separates what GL and the driver cost from what the Python that
+produced the calls costs:
+
+    recorder = GLRecorder('demo.gltrace', frames=100)
+    recorder.start()
+    ...
+    def on_draw(self):
+        ...
+        recorder.end_frame()    # writes the trace after the 100th frame
+
+    $ python gltrace.py demo.gltrace
+
+The command line replay opens an invisible pyglet window for a context and
+issues the calls through PyOpenGL; on a machine without a display, run it
+under Xvfb with Mesa. skel.Window records when its trace_frames class
+attribute is set.
+
+Recording works by replacing, in every loaded module outside of pyglet.gl
+and PyOpenGL, each name of the form glXxx with a wrapper, so it sees the
+calls the program makes whether through pyglet.gl or OpenGL.GL, but not
+those GLU, GLUT or the libraries make internally. Calls a recorded call
+makes are not recorded again. Where an immediate.ImmediateBatch is
+installed, the recording is made beneath it: the vertex arrays and draws
+its flushes issue, and the calls it passes on, rather than the glVertex
+calls that never reach GL. Pointer arguments such as c_void_p(offset), the
+buffer object offsets Mesh.draw passes, are recorded as integers. Object
+names (textures, lists, buffers) are
+replayed as recorded, which matches on a fresh context that hands them out
+in the same order; pointers made with byref and other arguments that cannot
+be stored are replayed as None, and calls that fail on replay are counted
+and skipped.
+
+Trace format: the header '<4sI' (magic 'GLTR', version), then a zlib
+stream of records, each a one byte tag:
+    N  function name: '<H' id, '<H' length, name
+    B  buffer: '<I' id, '<B' length, numpy dtype string, '<B' ndim,
+       '<I' per dimension, '<I' byte count, bytes
+    C  call: '<H' function id, '<B' argument count, arguments
+    F  end of frame
+Arguments are a one byte type and a value: n None, i '<q', f '<d',
+s '<I' length and bytes, b '<I' buffer id, t '<H' count and arguments,
+o '<H' length and type name (replayed as None).
+"""
+
+
+import ctypes
+import hashlib
+import re
+import struct
+import sys
+import timeit
+import zlib
+
+import numpy
+
+
+_MAGIC = 'GLTR'
+_VERSION = 1
+_HEADER = '<4sI'
+
+_GL_NAME = re.compile(r'gl[A-Z]\w*$')
+# Modules whose gl names are the implementation, not its callers
+_SKIP_MODULES = ('OpenGL', 'pyglet.gl', 'ctypes', 'numpy', __name__)
+
+
+class GLTraceError(Exception):
+    def __init__(self, message):
+        self.value = message
+    def __str__(self):
+        return str(self.value)
+
+
+def _as_buffer(value):
+    """return a numpy array with the contents of a buffer argument, or None
+    if value is not one"""
+    if isinstance(value, numpy.ndarray):
+        return value
+    if isinstance(value, ctypes.Array):
+        return numpy.ctypeslib.as_array(value)
+    if isinstance(value, ctypes._SimpleCData) and type(value)._type_ not in 'zZ':
+        return numpy.array([value.value], numpy.dtype(type(value)))
+    return None
+
+
+class GLRecorder(object):
+    """Records the gl calls of a number of frames to a trace file.
+
+    filename -> trace file, written when the last frame ends or on stop()
+    frames -> number of frames to record
+    modules -> modules whose gl names to wrap; default all loaded modules
+        outside of pyglet.gl, PyOpenGL, ctypes and numpy
+    """
+
+    def __init__(self, filename, frames=1, modules=None):
+        self.filename = filename
+        self.frames = frames
+        self.modules = modules
+        self.recording = False
+        self.frame = 0
+        self.calls = 0
+        self._patched = []
+        self._depth = 0
+
+    def start(self):
+        """wrap the gl functions and start recording"""
+        if self.recording:
+            return
+        self._out = []
+        self._names = {}
+        self._buffers = {}
+        self.frame = 0
+        self.calls = 0
+        self._patch()
+        self.recording = True
+
+    def stop(self):
+        """stop recording, restore the gl functions and write the trace"""
+        if not self.recording:
+            return
+        self.recording = False
+        self._unpatch()
+        f = open(self.filename, 'wb')
+        try:
+            f.write(struct.pack(_HEADER, _MAGIC, _VERSION))
+            f.write(zlib.compress(''.join(self._out), 9))
+        finally:
+            f.close()
+        self._out = None
+
+    def end_frame(self):
+        """mark the end of a frame; returns True once the last frame has
+        been recorded and the trace written"""
+        if not self.recording:
+            return False
+        self._out.append('F')
+        self.frame += 1
+        if self.frame >= self.frames:
+            self.stop()
+            return True
+        return False
+
+    def _patch(self):
+        if self.modules is None:
+            modules = [m for name, m in sys.modules.items()
+                       if m is not None and not name.startswith(_SKIP_MODULES)]
+        else:
+            modules = self.modules
+        namespaces = [vars(module) for module in modules]
+        batches = []
+        wrappers = {}
+        for namespace in namespaces:
+            for name, value in namespace.items():
+                if not _GL_NAME.match(name) or not callable(value) or isinstance(value, type):
+                    continue
+                # An ImmediateBatch's replacements are left alone; the
+                # functions they call through are wrapped instead
+                batch = getattr(value, 'immediate_batch', None)
+                if batch is not None:
+                    if batch not in batches:
+                        batches.append(batch)
+                        namespaces.append(batch.functions)
+                    continue
+                key = (name, id(value))
+                if key not in wrappers:
+                    wrappers[key] = self._wrap(name, value)
+                namespace[name] = wrappers[key]
+                self._patched.append((namespace, name, value))
+
+    def _unpatch(self):
+        for namespace, name, value in self._patched:
+            namespace[name] = value
+        self._patched = []
+
+    def _wrap(self, name, func):
+        recorder = self
+        def wrapper(*args, **kwargs):
+            if recorder._depth == 0 and recorder.recording:
+                recorder._record(name, args)
+            recorder._depth += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder._depth -= 1
+        wrapper.__name__ = name
+        return wrapper
+
+    def _record(self, name, args):
+        out = self._out
+        i = self._names.get(name)
+        if i is None:
+            i = self._names[name] = len(self._names)
+            out.append('N' + struct.pack('<HH', i, len(name)) + name)
+        # Encode the arguments first, so buffers they define come before
+        # the call
+        encoded = [self._encode(arg) for arg in args]
+        out.append('C' + struct.pack('<HB', i, len(args)) + ''.join(encoded))
+        self.calls += 1
+
+    def _encode(self, value):
+        if value is None:
+            return 'n'
+        if isinstance(value, (bool, int, long, numpy.integer)):
+            return 'i' + struct.pack('<q', int(value))
+        if isinstance(value, (float, numpy.floating)):
+            return 'f' + struct.pack('<d', float(value))
+        if isinstance(value, str):
+            return 's' + struct.pack('<I', len(value)) + value
+        if isinstance(value, (tuple, list)):
+            return 't' + struct.pack('<H', len(value)) + ''.join(
+                [self._encode(v) for v in value])
+        if isinstance(value, ctypes.c_void_p):
+            # An offset into a buffer object, or NULL
+            return 'i' + struct.pack('<q', value.value or 0)
+        if isinstance(value, ctypes.c_char_p):
+            return self._encode(value.value)
+        array = _as_buffer(value)
+        if array is not None:
+            return 'b' + struct.pack('<I', self._buffer(array))
+        typename = type(value).__name__
+        return 'o' + struct.pack('<H', len(typename)) + typename
+
+    def _buffer(self, array):
+        array = numpy.ascontiguousarray(array)
+        data = array.tostring()
+        dtype = array.dtype.str
+        digest = hashlib.sha1(dtype + repr(array.shape) + data).digest()
+        i = self._buffers.get(digest)
+        if i is None:
+            i = self._buffers[digest] = len(self._buffers)
+            self._out.append('B' + struct.pack('<IB', i, len(dtype)) + dtype +
+                             struct.pack('<B', array.ndim) +
+                             struct.pack('<%dI' % array.ndim, *array.shape) +
+                             struct.pack('<I', len(data)) + data)
+        return i
+
+
+class GLTrace(object):
+    """A trace file read back.
+
+    names -> function names by id
+    buffers -> numpy arrays by id
+    frames -> per frame, a list of (function name, argument tuple)
+    """
+
+    def __init__(self, filename):
+        f = open(filename, 'rb')
+        try:
+            header = f.read(struct.calcsize(_HEADER))
+            data = f.read()
+        finally:
+            f.close()
+        if len(header) < struct.calcsize(_HEADER):
+            raise GLTraceError('%s: not a GL trace' % filename)
+        magic, version = struct.unpack(_HEADER, header)
+        if magic != _MAGIC or version != _VERSION:
+            raise GLTraceError('%s: not a GL trace, or an unknown version' % filename)
+        self._data = zlib.decompress(data)
+        self._pos = 0
+        self.names = {}
+        self.buffers = {}
+        self.frames = []
+        self._parse()
+        del self._data
+
+    def _read(self, fmt):
+        values = struct.unpack_from(fmt, self._data, self._pos)
+        self._pos += struct.calcsize(fmt)
+        return values
+
+    def _bytes(self, n):
+        s = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return s
+
+    def _parse(self):
+        calls = []
+        end = len(self._data)
+        while self._pos < end:
+            tag = self._bytes(1)
+            if tag == 'C':
+                i, nargs = self._read('<HB')
+                calls.append((self.names[i], tuple([self._arg() for n in range(nargs)])))
+            elif tag == 'F':
+                self.frames.append(calls)
+                calls = []
+            elif tag == 'N':
+                i, n = self._read('<HH')
+                self.names[i] = self._bytes(n)
+            elif tag == 'B':
+                i, n = self._read('<IB')
+                dtype = self._bytes(n)
+                ndim, = self._read('<B')
+                shape = self._read('<%dI' % ndim)
+                nbytes, = self._read('<I')
+                self.buffers[i] = numpy.frombuffer(
+                    self._bytes(nbytes), numpy.dtype(dtype)).reshape(shape).copy()
+            else:
+                raise GLTraceError('corrupt trace, record %r at %d' % (tag, self._pos - 1))
+        if calls:
+            self.frames.append(calls)
+
+    def _arg(self):
+        tag = self._bytes(1)
+        if tag == 'i':
+            return self._read('<q')[0]
+        if tag == 'f':
+            return self._read('<d')[0]
+        if tag == 'b':
+            return self.buffers[self._read('<I')[0]]
+        if tag == 'n':
+            return None
+        if tag == 's':
+            return self._bytes(self._read('<I')[0])
+        if tag == 't':
+            return tuple([self._arg() for n in range(self._read('<H')[0])])
+        if tag == 'o':
+            self._bytes(self._read('<H')[0])
+            return None
+        raise GLTraceError('corrupt trace, argument %r at %d' % (tag, self._pos - 1))
+
+
+def by_function(name):
+    """group calls by function: glVertex3f"""
+    return name
+
+
+_TYPE_SUFFIX = re.compile(r'[1-4](b|s|i|f|d|ub|us|ui)v?$')
+
+def by_family(name):
+    """group calls by function without the type suffix: glVertex3f and
+    glVertex2fv are both glVertex"""
+    return _TYPE_SUFFIX.sub('', name)
+
+
+class ReplayTimes(object):
+    """Timing of a replay.
+
+    groups -> {group: [calls, seconds]}
+    frames -> seconds per frame replayed, including the glFinish
+    failures -> {function name: calls that raised}
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.frames = []
+        self.failures = {}
+
+    def report(self, out=None, n=20):
+        out = out or sys.stdout
+        if not self.frames:
+            print >> out, 'no frames replayed'
+            return
+        count = float(len(self.frames))
+        print >> out, '%d frames, %.3f ms per frame' % (
+            len(self.frames), 1000.0 * sum(self.frames) / count)
+        print >> out, '  ms/frame  calls/frame  us/call  group'
+        ranked = sorted(self.groups.iteritems(), key=lambda g: -g[1][1])
+        for group, (calls, seconds) in ranked[:n]:
+            print >> out, '  %8.3f  %11.1f  %7.2f  %s' % (
+                1000.0 * seconds / count, calls / count, 1e6 * seconds / calls, group)
+        for name, calls in sorted(self.failures.iteritems()):
+            print >> out, '  %s failed %d times' % (name, calls)
+
+
+def replay(trace, gl=None, group=by_function, repeat=1):
+    """issue the calls of a trace and time them, returning ReplayTimes
+
+    trace -> a GLTrace
+    gl -> namespace to look the functions up in, by default OpenGL.GL; a
+        current GL context is needed
+    group -> function from a function name to the group it is timed in
+    repeat -> times to replay the whole trace
+
+    Each frame ends with glFinish, timed as its own group, so work the
+    driver defers shows up there rather than being lost.
+    """
+    if gl is None:
+        import OpenGL.GL as gl
+    clock = timeit.default_timer
+    times = ReplayTimes()
+    groups = times.groups
+    functions = {}
+    for name in trace.names.itervalues():
+        functions[name] = (getattr(gl, name, None), group(name))
+    finish = getattr(gl, 'glFinish', None)
+
+    for r in range(repeat):
+        for calls in trace.frames:
+            frame_start = clock()
+            for name, args in calls:
+                func, key = functions[name]
+                start = clock()
+                try:
+                    func(*args)
+                except Exception:
+                    times.failures[name] = times.failures.get(name, 0) + 1
+                    continue
+                elapsed = clock() - start
+                g = groups.get(key)
+                if g is None:
+                    g = groups[key] = [0, 0.0]
+                g[0] += 1
+                g[1] += elapsed
+            if finish is not None:
+                start = clock()
+                finish()
+                g = groups.setdefault('glFinish (end of frame)', [0, 0.0])
+                g[0] += 1
+                g[1] += clock() - start
+            times.frames.append(clock() - frame_start)
+    return times
+
+
+def _replay_main(args):
+    import pyglet
+    # An invisible window just for its context
+    window = pyglet.window.Window(visible=False)
+    trace = GLTrace(args[0])
+    repeat = int(args[1]) if len(args) > 1 else 1
+    replay(trace, repeat=repeat).report()
+    window.close()
+
+
+if __name__ == '__main__' and len(sys.argv) > 1:
+    _replay_main(sys.argv[1:])
+
+elif __name__ == '__main__':
+    import os
+    import tempfile
+    import types
+
+    # A stand-in for a GL binding that remembers what it was asked to do
+    log = []
+    fake = types.ModuleType('fakegl')
+    def make(name):
+        def func(*args):
+            log.append((name, args))
+        return func
+    for name in ('glBegin', 'glVertex3f', 'glEnd', 'glLightfv', 'glMultMatrixf',
+                 'glFinish', 'glShaderSource'):
+        setattr(fake, name, make(name))
+    def glCallsOthers(*args):
+        fake.glBegin(0)
+    fake.glCallsOthers = glCallsOthers
+    fake.gl_vec = lambda *args: None
+
+    print 'calls are recorded, with buffers stored once'
+    filename = os.path.join(tempfile.mkdtemp(), 'test.gltrace')
+    recorder = GLRecorder(filename, frames=2, modules=[fake])
+    recorder.start()
+    assert fake.gl_vec.__name__ == '<lambda>'
+    light = (ctypes.c_float * 4)(0.0, 1.0, 0.0, 0.0)
+    matrix = numpy.identity(4, numpy.float32)
+    for frame in range(3):
+        fake.glBegin(4)
+        fake.glVertex3f(0.5, -1.0, numpy.float32(2.0))
+        fake.glEnd()
+        fake.glLightfv(16384, 4611, light)
+        fake.glMultMatrixf(matrix)
+        fake.glCallsOthers(ctypes.byref(ctypes.c_int()))
+        fake.glShaderSource(1, ['void main() {}'], None)
+        recorder.end_frame()
+    assert not recorder.recording
+    assert fake.glBegin.__name__ == 'func'
+    assert recorder.calls == 14
+    # glCallsOthers' own glBegin is not recorded
+    recorded = ['glBegin', 'glVertex3f', 'glEnd', 'glLightfv', 'glMultMatrixf',
+                'glCallsOthers', 'glShaderSource']
+    assert [name for name, args in log[:7]] == recorded[:5] + ['glBegin'] + recorded[6:]
+
+    print 'the trace reads back as recorded'
+    trace = GLTrace(filename)
+    assert len(trace.frames) == 2 and len(trace.buffers) == 2
+    assert [name for name, args in trace.frames[0]] == recorded
+    assert trace.frames[1][1] == ('glVertex3f', (0.5, -1.0, 2.0))
+    assert (trace.frames[0][3][1][2] == (0.0, 1.0, 0.0, 0.0)).all()
+    assert (trace.frames[1][4][1][0] == matrix).all()
+    assert trace.frames[0][5][1] == (None,)
+    assert trace.frames[0][6][1] == (1, ('void main() {}',), None)
+
+    print 'replay issues every call and times them by group'
+    del log[:]
+    times = replay(trace, fake, group=by_family, repeat=2)
+    assert len(times.frames) == 4
+    assert times.groups['glVertex'][0] == 4
+    assert times.groups['glFinish (end of frame)'][0] == 4
+    assert [name for name, args in log[:7]] == recorded[:5] + ['glBegin'] + recorded[6:]
+    assert by_family('glColor4ubv') == 'glColor' and by_family('glEnd') == 'glEnd'
+
+    print 'buffer object offsets are recorded as integers'
+    fake.glVertexPointer = make('glVertexPointer')
+    recorder = GLRecorder(filename, modules=[fake])
+    recorder.start()
+    for offset in (ctypes.c_void_p(0), ctypes.c_void_p(), ctypes.c_void_p(48)):
+        fake.glVertexPointer(3, 5126, 0, offset)
+    recorder.end_frame()
+    trace = GLTrace(filename)
+    assert [args[3] for name, args in trace.frames[0]] == [0, 0, 48]
+    assert not trace.buffers
+
+    print 'an ImmediateBatch is recorded by the draws it makes'
+    import immediate
+    for name in ('glPushClientAttrib', 'glPopClientAttrib', 'glBindBuffer',
+                 'glEnableClientState', 'glVertexPointer', 'glDrawArrays'):
+        setattr(immediate, name, make(name))
+    demo = types.ModuleType('demo')
+    for name in ('glBegin', 'glVertex3f', 'glEnd', 'glRotatef'):
+        setattr(demo, name, make(name))
+    batch = immediate.ImmediateBatch()
+    batch.install(vars(demo))
+    recorder = GLRecorder(filename, modules=[demo, immediate])
+    recorder.start()
+    demo.glBegin(immediate.GL_TRIANGLES)
+    for i in range(3):
+        demo.glVertex3f(float(i), 0.0, 0.0)
+    demo.glEnd()
+    demo.glRotatef(45.0, 0.0, 0.0, 1.0)
+    recorder.end_frame()
+    assert demo.glBegin.immediate_batch is batch
+    trace = GLTrace(filename)
+    names = [name for name, args in trace.frames[0]]
+    assert names == ['glPushClientAttrib', 'glBindBuffer', 'glEnableClientState',
+                     'glVertexPointer', 'glDrawArrays', 'glPopClientAttrib',
+                     'glRotatef'], names
+    # The interleaved vertices are stored with the pointer call
+    vertices = trace.frames[0][3][1][3].reshape(-1, 15)
+    assert vertices[:, 0].tolist() == [0.0, 1.0, 2.0]
+    os.remove(filename)
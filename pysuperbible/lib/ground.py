@@ -0,0 +1,214 @@
+"""
+Ground planes as indexed grid meshes.
+
+The demos draw their ground as nested loops of glVertex3f calls, thousands
+per frame unless they happen to be compiled into a display list. Here a
+ground is generated in a few array operations as one or more indexed
+meshes:
+
+    checkerboard(extent, step) -> a single mesh of alternately colored cells
+    Ground(extent, step) -> a flat grid
+    Ground(extent, step, height=f) -> a heightmapped grid, with normals
+
+A Ground is cut into square chunks of chunk_cells cells. Each chunk keeps
+index lists for several levels of detail (every vertex, every second,
+every fourth, ...) over the same vertices, and draw(eye) picks a level per
+chunk by its distance from the eye. A plane of a few thousand cells with
+the default chunk size is one draw.
+"""
+
+
+import numpy
+from OpenGL.GL import *
+
+from math3d import m3dNormalizeVectorArray
+from mesh import Mesh, grid_indices
+
+
+def grid_normals(heights, step):
+    """return (rows, cols, 3) unit normals of a height grid, rows along z
+    and columns along x, step apart"""
+    dz, dx = numpy.gradient(heights, step)
+    normals = numpy.empty(heights.shape + (3,), numpy.float32)
+    normals[..., 0] = -dx
+    normals[..., 1] = 1.0
+    normals[..., 2] = -dz
+    return m3dNormalizeVectorArray(normals)
+
+
+def lod_indices(rows, cols, stride):
+    """return GL_TRIANGLES indices for a rows x cols cell grid (vertices
+    numbered row by row) using only every stride-th row and column"""
+    r, c = rows // stride, cols // stride
+    coarse = grid_indices(r, c)
+    # Map coarse vertex numbers back to the full grid
+    return ((coarse // (c + 1)) * stride * (cols + 1) +
+            (coarse % (c + 1)) * stride).astype(numpy.uint32)
+
+
+class _Chunk(object):
+    __slots__ = ('mesh', 'center', 'levels')
+
+
+class Ground(object):
+    """A square grid ground centered on the origin, in chunks.
+
+    extent -> the ground runs from -extent to extent in x and z
+    step -> cell size
+    y -> base height
+    height -> optional heights: a function f(x, z) of coordinate arrays,
+        or a (cells + 1, cells + 1) array with rows along z. Added to y.
+    chunk_cells -> cells along a side of a chunk
+    levels -> levels of detail per chunk; level k uses every 2**k-th vertex
+    lod_distance -> distance from the eye covered by each level
+    tex_scale -> if given, texture coordinates are x and z times tex_scale
+    """
+
+    def __init__(self, extent, step, y=0.0, height=None, chunk_cells=64,
+                 levels=1, lod_distance=10.0, tex_scale=None):
+        self.extent = extent
+        self.step = step
+        self.lod_distance = lod_distance
+        cells = int(round(2.0 * extent / step))
+        self.cells = cells
+        coords = -extent + numpy.arange(cells + 1) * step
+        x, z = numpy.meshgrid(coords, coords)
+
+        heights = numpy.zeros(x.shape, numpy.float32)
+        if callable(height):
+            heights[...] = height(x, z)
+        elif height is not None:
+            heights[...] = height
+        heights += y
+        if height is None:
+            normals = numpy.zeros(x.shape + (3,), numpy.float32)
+            normals[..., 1] = 1.0
+        else:
+            normals = grid_normals(heights, step)
+        self.heights = heights
+
+        self.chunks = []
+        for r0 in range(0, cells, chunk_cells):
+            for c0 in range(0, cells, chunk_cells):
+                r1 = min(cells, r0 + chunk_cells)
+                c1 = min(cells, c0 + chunk_cells)
+                self.chunks.append(self._chunk(x, z, heights, normals, tex_scale,
+                                               r0, r1, c0, c1, levels))
+
+    def _chunk(self, x, z, heights, normals, tex_scale, r0, r1, c0, c1, levels):
+        rows, cols = r1 - r0, c1 - c0
+        window = (slice(r0, r1 + 1), slice(c0, c1 + 1))
+        positions = numpy.column_stack((x[window].ravel(), heights[window].ravel(),
+                                        z[window].ravel()))
+        texcoords = None
+        if tex_scale is not None:
+            texcoords = positions[:, 0::2] * tex_scale
+
+        # Every level whose stride divides the chunk evenly, finest first,
+        # all in one index array
+        parts = []
+        ranges = []
+        first = 0
+        for k in range(levels):
+            stride = 1 << k
+            if rows % stride or cols % stride:
+                break
+            part = lod_indices(rows, cols, stride)
+            parts.append(part)
+            ranges.append((first, len(part)))
+            first += len(part)
+
+        chunk = _Chunk()
+        chunk.mesh = Mesh(GL_TRIANGLES, positions, normals[window].reshape(-1, 3),
+                          texcoords, indices=numpy.concatenate(parts))
+        chunk.center = positions.mean(0)
+        chunk.levels = ranges
+        return chunk
+
+    def upload(self):
+        """move every chunk into vertex buffer objects"""
+        for chunk in self.chunks:
+            chunk.mesh.upload()
+
+    def delete(self):
+        for chunk in self.chunks:
+            chunk.mesh.delete()
+
+    def level(self, chunk, eye):
+        """return the level of detail to draw chunk at, seen from eye"""
+        if eye is None:
+            return 0
+        d = numpy.sqrt(((chunk.center - eye) ** 2).sum())
+        return min(len(chunk.levels) - 1, int(d / self.lod_distance))
+
+    def draw(self, eye=None):
+        """draw the ground
+
+        eye -> optional (x, y, z) world position of the viewer, for level
+            of detail selection. Without it everything is drawn in full.
+        """
+        if eye is not None:
+            eye = numpy.asarray(eye[:3], numpy.float32)
+        for chunk in self.chunks:
+            chunk.mesh.draw(chunk.levels[self.level(chunk, eye)])
+
+
+def checkerboard(extent, step, y=0.0,
+                 colors=((1.0, 1.0, 1.0, 1.0), (0.0, 0.0, 0.0, 1.0))):
+    """return a Mesh of a checkerboard running from -extent to extent in x
+    and z, step to a square, alternating between two RGBA colors. Squares
+    do not share vertices, so each is a single flat color."""
+    cells = int(round(2.0 * extent / step))
+    r, c = numpy.mgrid[0:cells, 0:cells]
+    r, c = r.ravel(), c.ravel()
+    x0 = -extent + c * step
+    z0 = -extent + r * step
+
+    # Corners per square: (x0, z0), (x1, z0), (x0, z1), (x1, z1)
+    positions = numpy.empty((len(r), 4, 3), numpy.float32)
+    positions[..., 1] = y
+    positions[:, :, 0] = x0[:, numpy.newaxis] + numpy.array([0, step, 0, step])
+    positions[:, :, 2] = z0[:, numpy.newaxis] + numpy.array([0, 0, step, step])
+    normals = numpy.zeros_like(positions)
+    normals[..., 1] = 1.0
+    palette = numpy.asarray(colors, numpy.float32)
+    color = numpy.repeat(palette[(r + c) % 2], 4, axis=0)
+
+    # Same winding as grid_indices: a, d, e and a, e, b
+    base = (numpy.arange(len(r)) * 4)[:, numpy.newaxis]
+    indices = (base + numpy.array([0, 2, 3, 0, 3, 1])).ravel()
+    return Mesh(GL_TRIANGLES, positions.reshape(-1, 3), normals.reshape(-1, 3),
+                colors=color, indices=indices)
+
+
+if __name__ == '__main__':
+    print 'ground triangles face up'
+    g = Ground(20.0, 1.0, y=-0.4, chunk_cells=16, levels=3)
+    assert g.cells == 40
+    assert len(g.chunks) == 9
+    for chunk in g.chunks:
+        tri = chunk.mesh.positions[chunk.mesh.indices.reshape(-1, 3)]
+        face = numpy.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+        assert (face[:, 1] > 0).all()
+        assert (chunk.mesh.positions[:, 1] == numpy.float32(-0.4)).all()
+
+    print 'levels of detail cover the chunk with fewer triangles'
+    chunk = g.chunks[0]
+    assert [count for first, count in chunk.levels] == [16*16*6, 8*8*6, 4*4*6]
+    # The 8 cell wide edge chunks still divide by stride 4
+    assert len(g.chunks[2].levels) == 3
+    assert g.level(chunk, None) == 0
+    assert g.level(chunk, chunk.center + (25.0, 0, 0)) == 2
+
+    print 'heightmapped normals follow the slope'
+    g = Ground(4.0, 1.0, height=lambda x, z: 0.5 * x)
+    n = g.chunks[0].mesh.normals
+    assert numpy.allclose(n, numpy.array([-0.5, 1.0, 0.0]) / numpy.sqrt(1.25))
+
+    print 'checkerboard alternates colors per square and faces up'
+    m = checkerboard(1.0, 0.5)
+    assert len(m) == 16 * 4
+    assert m.colors[0, 0] == 1.0 and m.colors[4, 0] == 0.0 and m.colors[16, 0] == 0.0
+    tri = m.positions[m.indices.reshape(-1, 3)]
+    face = numpy.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    assert (face[:, 1] > 0).all()
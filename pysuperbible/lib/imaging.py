@@ -0,0 +1,121 @@
+"""
+Vectorized image operations on decoded pixel buffers.
+
+These are CPU replacements for the GL imaging pipeline tricks used by the
+Operations demo (glPixelZoom, glPixelTransfer scales, glPixelMap and a
+glReadPixels round trip for luminance). Each kernel works on a whole
+(height, width, components) uint8 numpy array at once, so the result is
+ready for a single glDrawPixels or glTexImage2D upload with no readback and
+no per-byte Python loops.
+
+Channel order is given as a tuple holding the index of red, green and blue
+within a pixel. Targa data is BGR, so tga images use BGR_ORDER.
+"""
+
+
+import numpy
+
+
+RGB_ORDER = (0, 1, 2)
+BGR_ORDER = (2, 1, 0)
+
+# NTSC luminance weights for red, green and blue, scaled to sum to 256 so
+# the weighted sum fits in 16 bits and divides with a shift.
+_NTSC = (77, 151, 28)
+
+
+def flip(pixels):
+    """return pixels rotated by 180 degrees, like glPixelZoom(-1.0, -1.0)"""
+    return numpy.ascontiguousarray(pixels[::-1, ::-1])
+
+
+def zoom(pixels, width, height):
+    """return pixels resampled to width x height by nearest neighbour,
+    like glPixelZoom(width/w, height/h)"""
+    h, w = pixels.shape[:2]
+    rows = numpy.arange(height) * h // height
+    cols = numpy.arange(width) * w // width
+    return pixels[rows[:, numpy.newaxis], cols]
+
+
+def isolate_channel(pixels, channel, out=None):
+    """keep one color channel and zero the others
+
+    pixels -> (height, width, components) uint8 array
+    channel -> index of the channel to keep
+    out -> array to receive the result; a new one is made when None. May
+        not be pixels itself.
+    Any alpha channel is kept as is.
+    """
+    if out is None:
+        out = numpy.zeros_like(pixels)
+    else:
+        out[:, :, :3] = 0
+    out[:, :, channel] = pixels[:, :, channel]
+    if pixels.shape[2] == 4:
+        out[:, :, 3] = pixels[:, :, 3]
+    return out
+
+
+def luminance(pixels, order=BGR_ORDER, out=None):
+    """return the NTSC weighted luminance of pixels as a (height, width)
+    uint8 array, suitable for drawing as GL_LUMINANCE
+
+    order -> indices of red, green and blue within a pixel
+    out -> (height, width) uint8 array to receive the result
+    """
+    r, g, b = order
+    wide = pixels.astype(numpy.uint16)
+    acc = wide[:, :, r] * _NTSC[0]
+    acc += wide[:, :, g] * _NTSC[1]
+    acc += wide[:, :, b] * _NTSC[2]
+    acc >>= 8
+    if out is None:
+        return acc.astype(numpy.uint8)
+    out[...] = acc
+    return out
+
+
+def invert(pixels, out=None):
+    """return 255 - pixels for the color channels; alpha is kept
+
+    out -> array to receive the result; may be pixels itself
+    """
+    if out is None:
+        out = numpy.empty_like(pixels)
+    if pixels.shape[2] == 4:
+        numpy.invert(pixels[:, :, :3], out[:, :, :3])
+        if out is not pixels:
+            out[:, :, 3] = pixels[:, :, 3]
+    else:
+        numpy.invert(pixels, out)
+    return out
+
+
+if __name__ == '__main__':
+    px = numpy.array([[[10, 20, 30], [40, 50, 60]],
+                      [[70, 80, 90], [100, 110, 120]]], numpy.uint8)
+
+    print 'flip turns the image upside down and mirrors it'
+    assert flip(px)[0, 0].tolist() == [100, 110, 120]
+
+    print 'zoom resamples by nearest neighbour'
+    z = zoom(px, 4, 4)
+    assert z.shape == (4, 4, 3)
+    assert z[3, 3].tolist() == [100, 110, 120]
+    assert z[0, 1].tolist() == [10, 20, 30]
+
+    print 'isolate_channel keeps one channel'
+    assert isolate_channel(px, 1)[1, 1].tolist() == [0, 110, 0]
+
+    print 'luminance uses NTSC weights'
+    white = numpy.full((1, 1, 3), 255, numpy.uint8)
+    assert luminance(white)[0, 0] == 255
+    blue = numpy.array([[[255, 0, 0]]], numpy.uint8)
+    assert luminance(blue, BGR_ORDER)[0, 0] == 255 * 28 // 256
+
+    print 'invert flips color channels but keeps alpha'
+    rgba = numpy.array([[[0, 100, 255, 7]]], numpy.uint8)
+    assert invert(rgba)[0, 0].tolist() == [255, 155, 0, 7]
+    invert(px, px)
+    assert px[0, 0].tolist() == [245, 235, 225]
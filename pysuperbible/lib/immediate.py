@@ -0,0 +1,390 @@
+"""
+glBegin / glEnd drawing batched into vertex arrays.
+
+Most of the demos draw with glBegin, a run of glVertex, glNormal, glColor
+and glTexCoord calls, and glEnd: one ctypes call per attribute per vertex,
+every frame. An ImmediateBatch installed into a demo's namespace takes the
+place of those functions. The calls append to one growing typed array
+instead, and whole runs of primitives are drawn with glDrawArrays (or
+glMultiDrawArrays for strips, fans and loops) when the demo calls any
+other GL, GLU, GLUT or gltools function, which is where the state they are
+drawn with could change:
+
+    from gltools import *
+    from immediate import ImmediateBatch
+
+    # Batch the glBegin/glEnd drawing below
+    immediate = ImmediateBatch()
+    immediate.install(globals())
+
+Nothing else in the demo changes. A frame whose last drawing is a glEnd
+with no GL call after it needs an immediate.flush() at the end of on_draw.
+
+Attributes behave as in GL: a vertex takes the current normal, color and
+texture coordinate, and set outside glBegin / glEnd they are also passed
+on to GL at once, so drawing the layer does not handle, such as GLUT
+shapes, uses them too. Only attributes set through the layer while a batch collected
+are sent as arrays; the others come from GL's current values. State
+changed between a glBegin and its glEnd, with glMaterial for instance,
+applies to the whole primitive rather than to the vertices after it.
+Drawing is done through PyOpenGL; vertex buffer object 0 must be bound,
+which is how the demos leave it.
+"""
+
+
+import array
+import re
+
+import numpy
+from OpenGL.GL import *
+
+
+class ImmediateError(Exception):
+    def __init__(self, message):
+        self.value = message
+    def __str__(self):
+        return str(self.value)
+
+
+# Names in a namespace the batch takes over: GL, GLU, GLUT and gltools
+# functions, not gl_vec
+_GL_NAME = re.compile(r'gl(u|ut|t)?[A-Z]\w*$')
+_ATTRIBUTE = re.compile(r'gl(Vertex|Normal|Color|TexCoord)([1-4])(b|s|i|f|d|ub|us|ui)(v?)$')
+
+# Largest value of each integer type, which maps to 1.0 where GL
+# normalizes
+_TYPE_MAX = {'b': 127.0, 's': 32767.0, 'i': 2147483647.0,
+             'ub': 255.0, 'us': 65535.0, 'ui': 4294967295.0}
+
+# Layout of a vertex in the array, in floats: position xyzw, normal xyz,
+# color rgba, texture coordinate strq
+_STRIDE = 15
+_SLOTS = {'Normal': (4, 7), 'Color': (7, 11), 'TexCoord': (11, 15)}
+_DEFAULTS = (0.0, 0.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+_CURRENT = {'Normal': GL_CURRENT_NORMAL, 'Color': GL_CURRENT_COLOR,
+            'TexCoord': GL_CURRENT_TEXTURE_COORDS}
+
+# Primitives made of a fixed number of vertices each; consecutive runs of
+# them are drawn as one
+_INDEPENDENT = {GL_POINTS: 1, GL_LINES: 2, GL_TRIANGLES: 3, GL_QUADS: 4}
+
+
+class ImmediateBatch(object):
+    """Collects glBegin / glEnd drawing and draws it as vertex arrays.
+
+    vertices -> vertices collected so far
+    draws -> glDrawArrays / glMultiDrawArrays calls made so far
+    """
+
+    def __init__(self):
+        self._data = array.array('f')
+        self.vertices = 0
+        self.draws = 0
+        # Completed primitives as [mode, first, count]
+        self._runs = []
+        # Mode and first vertex of the open primitive, between glBegin and
+        # glEnd
+        self._mode = None
+        self._first = 0
+        self._attributes = list(_DEFAULTS)
+        self._current = tuple(_DEFAULTS)
+        # Attributes set through the batch at all, and since the last flush
+        self._known = set()
+        self._used = set()
+        self._installed = []
+        # The functions install replaced, by name, which the replacements
+        # call through; a GL tracer patches them here
+        self.functions = {}
+
+    def install(self, namespace):
+        """replace the GL functions in a namespace, usually a demo's
+        globals(), with the batch's"""
+        for name, value in namespace.items():
+            if (not _GL_NAME.match(name) or not callable(value)
+                    or isinstance(value, type)):
+                continue
+            attribute = _ATTRIBUTE.match(name)
+            if name == 'glBegin':
+                function = lambda mode: self.begin(mode)
+            elif name == 'glEnd':
+                function = lambda: self.end()
+            elif attribute:
+                function = self._attribute_function(name, *attribute.groups())
+            else:
+                function = self._flushing(name)
+            function.immediate_batch = self
+            self.functions[name] = value
+            self._installed.append((namespace, name, value))
+            namespace[name] = function
+
+    def uninstall(self):
+        """flush, and put back the functions install replaced"""
+        self.flush()
+        for namespace, name, value in self._installed:
+            namespace[name] = value
+        self._installed = []
+        self.functions = {}
+
+    def begin(self, mode):
+        if self._mode is not None:
+            raise ImmediateError('glBegin inside glBegin / glEnd')
+        self._mode = mode
+        self._first = self.vertices
+
+    def end(self):
+        if self._mode is None:
+            raise ImmediateError('glEnd without glBegin')
+        mode, first = self._mode, self._first
+        self._mode = None
+        count = self.vertices - first
+        if not count:
+            return
+        runs = self._runs
+        if runs:
+            last = runs[-1]
+            per = _INDEPENDENT.get(mode)
+            if last[0] == mode and per and last[2] % per == 0:
+                last[2] += count
+                return
+        runs.append([mode, first, count])
+
+    def vertex(self, x, y, z=0.0, w=1.0):
+        if self._mode is None:
+            raise ImmediateError('glVertex outside glBegin / glEnd')
+        self._data.extend((x, y, z, w) + self._current)
+        self.vertices += 1
+
+    def _attribute_function(self, name, kind, size, typ, vector):
+        """return a replacement for one glVertex, glNormal, glColor or
+        glTexCoord variant"""
+        size = int(size)
+        vector = bool(vector)
+        scale = None
+        if typ in _TYPE_MAX and (kind == 'Color' or (kind == 'Normal' and typ != 'ui')):
+            scale = 1.0 / _TYPE_MAX[typ]
+
+        if kind == 'Vertex':
+            pad = (0.0, 1.0)[size - 2:]
+            batch = self
+            def vertex(*args):
+                if vector:
+                    args = tuple(args[0])
+                if batch._mode is None:
+                    raise ImmediateError('glVertex outside glBegin / glEnd')
+                batch._data.extend(args + pad + batch._current)
+                batch.vertices += 1
+            return vertex
+
+        start, end = _SLOTS[kind]
+        pad = (0.0, 0.0, 0.0, 1.0)[size:end - start] if kind == 'TexCoord' else \
+              (1.0,)[:end - start - size]
+        def attribute(*args):
+            values = args[0] if vector else args
+            if scale is not None:
+                values = [v * scale for v in values]
+            self._set(kind, tuple(values) + pad)
+            if self._mode is None:
+                self.functions[name](*args)
+        return attribute
+
+    def _set(self, kind, values):
+        start, end = _SLOTS[kind]
+        if kind not in self._used:
+            self._use(kind)
+        self._attributes[start - 4:end - 4] = values
+        self._current = tuple(self._attributes)
+        self._known.add(kind)
+
+    def _use(self, kind):
+        """start sending an attribute as an array. Vertices collected
+        before used GL's current value, unless it was set through the
+        batch, in which case they have it already."""
+        self._used.add(kind)
+        if not self.vertices or kind in self._known:
+            return
+        start, end = _SLOTS[kind]
+        value = array.array('f', [float(v) for v in glGetFloatv(_CURRENT[kind])][:end - start])
+        data = self._data
+        for i in xrange(start, len(data), _STRIDE):
+            data[i:i + end - start] = value
+
+    def _flushing(self, name):
+        """return the function of that name made to flush the batch before
+        it runs"""
+        batch = self
+        functions = self.functions
+        def flushing(*args, **kwargs):
+            if batch._runs:
+                batch.flush()
+            return functions[name](*args, **kwargs)
+        flushing.__name__ = name
+        return flushing
+
+    def flush(self):
+        """draw the completed primitives collected so far"""
+        runs = self._runs
+        if not runs:
+            return
+        # Views of the interleaved array from each attribute's first float,
+        # rather than raw addresses, so a GL tracer can store the data
+        data = numpy.frombuffer(self._data, numpy.float32)
+        stride = _STRIDE * 4
+
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(4, GL_FLOAT, stride, data)
+        if 'Normal' in self._used:
+            glEnableClientState(GL_NORMAL_ARRAY)
+            glNormalPointer(GL_FLOAT, stride, data[4:])
+        if 'Color' in self._used:
+            glEnableClientState(GL_COLOR_ARRAY)
+            glColorPointer(4, GL_FLOAT, stride, data[7:])
+        if 'TexCoord' in self._used:
+            glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+            glTexCoordPointer(4, GL_FLOAT, stride, data[11:])
+
+        i = 0
+        while i < len(runs):
+            mode = runs[i][0]
+            j = i + 1
+            while j < len(runs) and runs[j][0] == mode:
+                j += 1
+            if j - i == 1:
+                glDrawArrays(mode, runs[i][1], runs[i][2])
+            else:
+                glMultiDrawArrays(mode,
+                    numpy.array([r[1] for r in runs[i:j]], numpy.int32),
+                    numpy.array([r[2] for r in runs[i:j]], numpy.int32), j - i)
+            self.draws += 1
+            i = j
+        glPopClientAttrib()
+
+        # Drawing with an attribute array leaves GL's current value of it
+        # undefined
+        a = self._attributes
+        if 'Normal' in self._used:
+            glNormal3f(*a[0:3])
+        if 'Color' in self._used:
+            glColor4f(*a[3:7])
+        if 'TexCoord' in self._used:
+            glTexCoord4f(*a[7:11])
+
+        # Keep the open primitive, if any
+        del data
+        keep = self.vertices - self._first if self._mode is not None else 0
+        del self._data[:len(self._data) - keep * _STRIDE]
+        self.vertices = keep
+        self._first = 0
+        self._runs = []
+        self._used = set()
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Stand-ins for the GL calls flush makes
+    log = []
+    def logger(name):
+        def log_call(*args):
+            log.append((name,) + args)
+        return log_call
+    module = sys.modules[__name__]
+    for name in ('glPushClientAttrib', 'glPopClientAttrib', 'glBindBuffer',
+                 'glEnableClientState', 'glVertexPointer', 'glNormalPointer',
+                 'glColorPointer', 'glTexCoordPointer', 'glDrawArrays',
+                 'glMultiDrawArrays', 'glNormal3f', 'glColor4f', 'glTexCoord4f'):
+        setattr(module, name, logger(name))
+    module.glGetFloatv = lambda pname: [0.5, 0.5, 0.5, 1.0]
+
+    def vertices(batch):
+        return numpy.frombuffer(batch._data, numpy.float32).reshape(-1, _STRIDE)
+
+    # A demo's namespace, as from pyglet.gl import * would leave it
+    demo = {'GL_TRIANGLES': GL_TRIANGLES, 'gl_vec': lambda *a: None}
+    for name in ('glBegin', 'glEnd', 'glVertex3f', 'glVertex2fv', 'glNormal3fv',
+                 'glColor3ub', 'glColor3f', 'glTexCoord2f', 'glRotatef', 'gluPerspective'):
+        demo[name] = logger(name)
+
+    print 'installing replaces gl functions only'
+    batch = ImmediateBatch()
+    batch.install(demo)
+    assert demo['glBegin'].immediate_batch is batch
+    assert demo['glRotatef'].immediate_batch is batch
+    assert batch.functions['glRotatef'].__name__ == 'log_call'
+    assert not hasattr(demo['gl_vec'], 'immediate_batch')
+
+    print 'vertices take the current attributes'
+    exec """
+glColor3ub(255, 0, 0)
+glBegin(GL_TRIANGLES)
+glNormal3fv([0.0, 1.0, 0.0])
+glVertex3f(1.0, 2.0, 3.0)
+glVertex2fv((4.0, 5.0))
+glColor3f(0.0, 1.0, 0.0)
+glVertex3f(6.0, 7.0, 8.0)
+glEnd()
+""" in demo
+    assert batch.vertices == 3 and len(batch._runs) == 1
+    v = vertices(batch)
+    assert v[1].tolist() == [4, 5, 0, 1, 0, 1, 0, 1, 0, 0, 1, 0, 0, 0, 1]
+    assert v[2, 7:11].tolist() == [0, 1, 0, 1]
+    # Only the color set outside glBegin reached GL
+    assert log == [('glColor3ub', 255, 0, 0)]
+
+    print 'consecutive primitives coalesce and are drawn at a state change'
+    del log[:]
+    exec """
+glBegin(GL_TRIANGLES)
+glVertex3f(0.0, 0.0, 0.0); glVertex3f(1.0, 0.0, 0.0); glVertex3f(0.0, 1.0, 0.0)
+glEnd()
+glRotatef(10.0, 0.0, 1.0, 0.0)
+""" in demo
+    assert batch.vertices == 0 and batch.draws == 1
+    assert ('glDrawArrays', GL_TRIANGLES, 0, 6) in log
+    pointer = [call for call in log if call[0] == 'glVertexPointer'][0]
+    assert pointer[4][:3].tolist() == [1.0, 2.0, 3.0]
+    assert ('glEnableClientState', GL_COLOR_ARRAY) in log
+    assert ('glEnableClientState', GL_TEXTURE_COORD_ARRAY) not in log
+    assert log[-2] == ('glColor4f', 0.0, 1.0, 0.0, 1.0)
+    assert log[-1] == ('glRotatef', 10.0, 0.0, 1.0, 0.0)
+
+    print 'strips are drawn with one glMultiDrawArrays'
+    del log[:]
+    for n in (3, 4):
+        batch.begin(GL_TRIANGLE_STRIP)
+        for i in range(n):
+            batch.vertex(i, 0.0, 0.0)
+        batch.end()
+    batch.flush()
+    multi = [call for call in log if call[0] == 'glMultiDrawArrays'][0]
+    assert multi[2].tolist() == [0, 3] and multi[3].tolist() == [3, 4]
+
+    print 'an attribute first set mid-batch is back-filled from GL'
+    batch.begin(GL_POINTS)
+    batch.vertex(0.0, 0.0, 0.0)
+    batch.end()
+    batch.begin(GL_TRIANGLES)
+    batch.vertex(0.0, 0.0, 0.0)
+    demo['glTexCoord2f'](0.25, 0.75)
+    batch.vertex(1.0, 0.0, 0.0)
+    v = vertices(batch)
+    assert v[0, 11:15].tolist() == [0.5, 0.5, 0.5, 1.0]
+    assert v[2, 11:15].tolist() == [0.25, 0.75, 0.0, 1.0]
+
+    print 'the open primitive survives a flush'
+    demo['gluPerspective'](35.0, 1.0, 1.0, 100.0)
+    assert batch.vertices == 2
+    batch.vertex(0.0, 1.0, 0.0)
+    batch.end()
+    assert batch._runs == [[GL_TRIANGLES, 0, 3]]
+    assert vertices(batch)[1, 11:13].tolist() == [0.25, 0.75]
+    try:
+        batch.vertex(0.0, 0.0, 0.0)
+    except ImmediateError:
+        pass
+    else:
+        raise AssertionError('glVertex outside glBegin')
+
+    batch.uninstall()
+    assert demo['glBegin'].__name__ == 'log_call'
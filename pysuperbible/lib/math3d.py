@@ -1,6 +1,8 @@
 import math
 from math import acos, cos, sin, sqrt
 
+import numpy
+
 
 def vector_varargs(args, vector):
     if len(args) == len(vector):
@@ -58,6 +60,15 @@ class _M3DVector(object):
         else:
             args = vector_varargs(args, self)
         self.__data = [float(n) for n in args]
+    @classmethod
+    def trusted(cls, data):
+        """Construct a vector around data without checking or converting
+        it. data must be a list of exactly the subclass's number of floats;
+        the vector takes it over rather than copying it."""
+        v = cls.__new__(cls)
+        v.__data = data
+        v.__length = len(data)
+        return v
     # Container methods.
     def __getitem__(self, i): return self.__data[i]
     def __setitem__(self, i, v): self.__data[i] = float(v)
@@ -89,24 +100,68 @@ class _M3DVector(object):
     def __ge__(self, other): return self.__data >= other[:]
     def __cmp__(self, other): return cmp(self.__data, other[:])
     def __nonzero__(self): return all([n != None for n in self.__data])
-    # Unary methods.
-    def __neg__(self): return self.__class__([-v for v in self.__data])
-    def __pos__(self): return self.__class__([+v for v in self.__data])
-    def __abs__(self): return self.__class__([abs(v) for v in self.__data])
+    # Unary methods. Results of float arithmetic are floats already, so
+    # they skip the constructor's checks.
+    def __neg__(self): return self.trusted([-v for v in self.__data])
+    def __pos__(self): return self.trusted([+v for v in self.__data])
+    def __abs__(self): return self.trusted([abs(v) for v in self.__data])
     def __invert__(self): ~self[0]  ## Not valid: raises TypeError
     # Math methods.
-    def __add__(self, other): return self.__class__([v+other[i] for i,v in enumerate(self.__data)])
-    def __sub__(self, other): return self.__class__([v-other[i] for i,v in enumerate(self.__data)])
-    def __mul__(self, other): return self.__class__([v*other[i] for i,v in enumerate(self.__data)])
-    def __div__(self, other): return self.__class__([v/other[i] for i,v in enumerate(self.__data)])
+    def __add__(self, other): return self.trusted([v+float(other[i]) for i,v in enumerate(self.__data)])
+    def __sub__(self, other): return self.trusted([v-float(other[i]) for i,v in enumerate(self.__data)])
+    def __mul__(self, other): return self.trusted([v*float(other[i]) for i,v in enumerate(self.__data)])
+    def __div__(self, other): return self.trusted([v/float(other[i]) for i,v in enumerate(self.__data)])
     def __radd__(self, other): return self + other
     def __rsub__(self, other): return self - other
     def __rmul__(self, other): return self * other
     def __rdiv__(self, other): return self / other
-    def __iadd__(self, other): self[:] = [v+other[i] for i,v in enumerate(self.__data)]; return self
-    def __isub__(self, other): self[:] = [v-other[i] for i,v in enumerate(self.__data)]; return self
-    def __imul__(self, other): self[:] = [v*other[i] for i,v in enumerate(self.__data)]; return self
-    def __idiv__(self, other): self[:] = [v/other[i] for i,v in enumerate(self.__data)]; return self
+    def __iadd__(self, other): return self.add_into(other)
+    def __isub__(self, other): return self.sub_into(other)
+    def __imul__(self, other): return self.mul_into(other)
+    def __idiv__(self, other):
+        d = self.__data
+        for i in xrange(self.__length): d[i] /= other[i]
+        return self
+    # Fast paths. These write the result into out, or into self if out is
+    # not given, and return it. Nothing is allocated and nothing is checked:
+    # out must be a vector of the same size as self, and other must hold at
+    # least as many numbers.
+    def add_into(self, other, out=None):
+        """out = self + other"""
+        if out is None: out = self
+        d, s = out.__data, self.__data
+        for i in xrange(self.__length): d[i] = s[i] + other[i]
+        return out
+    def sub_into(self, other, out=None):
+        """out = self - other"""
+        if out is None: out = self
+        d, s = out.__data, self.__data
+        for i in xrange(self.__length): d[i] = s[i] - other[i]
+        return out
+    def mul_into(self, other, out=None):
+        """out = self * other, component by component"""
+        if out is None: out = self
+        d, s = out.__data, self.__data
+        for i in xrange(self.__length): d[i] = s[i] * other[i]
+        return out
+    def scale_into(self, scale, out=None):
+        """out = self * scale, for a number scale"""
+        if out is None: out = self
+        d, s = out.__data, self.__data
+        for i in xrange(self.__length): d[i] = s[i] * scale
+        return out
+    def neg_into(self, out=None):
+        """out = -self"""
+        if out is None: out = self
+        d, s = out.__data, self.__data
+        for i in xrange(self.__length): d[i] = -s[i]
+        return out
+    def madd(self, other, scale, out=None):
+        """out = self + other * scale, for a number scale"""
+        if out is None: out = self
+        d, s = out.__data, self.__data
+        for i in xrange(self.__length): d[i] = s[i] + other[i] * scale
+        return out
     # Conversion methods.
     def int(self): return [int(i) for i in self.__data]
     def long(self): return [long(i) for i in self.__data]
@@ -291,6 +346,95 @@ class M3DMatrix44d(_M3DVector):
     def __init__(self, *args):
         _M3DVector.__init__(self, 16, *args)
 
+
+class M3DPool(object):
+    """Free lists of vectors and matrices for use as temporaries.
+
+    Many functions here and in GLFrame need scratch vectors and matrices
+    for the length of one call. With the pool enabled they take them from
+    a free list per class and give them back when done, so once every free
+    list has grown to its working size nothing more is allocated:
+
+        m3dPool.enabled = True
+        ...
+        with m3dPool.scope(M3DVector3f, M3DMatrix44f) as (v, m):
+            ...
+        print m3dPool.hit_rate
+
+    Objects from the pool hold whatever their last user left in them, so
+    write every element before reading. Disabled, as it is by default,
+    acquire makes a new zeroed object each time and release drops it.
+
+    hits -> acquisitions served from a free list
+    misses -> acquisitions that had to make a new object
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.free = {}
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, cls):
+        """return an instance of cls, from its free list if possible"""
+        if self.enabled:
+            free = self.free.get(cls)
+            if free:
+                self.hits += 1
+                return free.pop()
+        self.misses += 1
+        return cls()
+
+    def release(self, obj):
+        """return obj to its free list; it must not be used afterwards"""
+        if self.enabled:
+            free = self.free.get(type(obj))
+            if free is None:
+                free = self.free[type(obj)] = []
+            free.append(obj)
+
+    def scope(self, *classes):
+        """return a context manager acquiring one instance of each class
+        on entry, as a tuple, and releasing them all on exit"""
+        return _M3DPoolScope(self, classes)
+
+    @property
+    def hit_rate(self):
+        """fraction of acquisitions served from a free list"""
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """drop every free object"""
+        self.free.clear()
+
+
+class _M3DPoolScope(object):
+    __slots__ = ('pool', 'classes', 'objects')
+
+    def __init__(self, pool, classes):
+        self.pool = pool
+        self.classes = classes
+
+    def __enter__(self):
+        acquire = self.pool.acquire
+        self.objects = tuple([acquire(cls) for cls in self.classes])
+        return self.objects
+
+    def __exit__(self, *exc_info):
+        release = self.pool.release
+        for obj in self.objects:
+            release(obj)
+        self.objects = None
+
+
+# The pool math3d and GLFrame take their temporaries from
+m3dPool = M3DPool()
+
 # Useful constants
 M3D_PI = math.pi
 M3D_2PI = 2.0 * math.pi
@@ -410,6 +554,47 @@ def m3dGetVectorLength(u):
 def m3dNormalizeVector(u):
     m3dScaleVector3(u, 1.0 / m3dGetVectorLength(u))
 
+# Vector arrays. These mirror the functions above over arrays of vectors,
+# one per row of an (n, 3) or (n, 4) array (or any array whose last axis
+# holds the components), in a few numpy calls rather than n Python calls.
+# Like the single vector versions they use only the first three components.
+# Either argument of a binary function may be a single vector, used with
+# every row of the other. out is an optional array to write the result
+# into; for the functions returning vectors it may be one of the inputs.
+def m3dDotProductArray(u, v, out=None):
+    u = numpy.asarray(u)
+    v = numpy.asarray(v)
+    if out is None:
+        return numpy.einsum('...i,...i->...', u[..., :3], v[..., :3])
+    return numpy.einsum('...i,...i->...', u[..., :3], v[..., :3], out=out)
+
+def m3dCrossProductArray(u, v, out=None):
+    u = numpy.asarray(u)
+    v = numpy.asarray(v)
+    result = numpy.cross(u[..., :3], v[..., :3])
+    if out is None:
+        return result
+    out[..., :3] = result
+    return out
+
+def m3dGetVectorLengthSquaredArray(u, out=None):
+    return m3dDotProductArray(u, u, out)
+
+def m3dGetVectorLengthArray(u, out=None):
+    length = m3dGetVectorLengthSquaredArray(u, out)
+    return numpy.sqrt(length, length)
+
+# Scales the first three components of each vector to unit length, in place
+# unlike the rest, to match m3dNormalizeVector, unless out is given. Zero
+# vectors stay zero.
+def m3dNormalizeVectorArray(u, out=None):
+    if out is None:
+        out = u
+    length = m3dGetVectorLengthArray(u)
+    numpy.maximum(length, 1e-30, length)
+    numpy.divide(u[..., :3], length[..., numpy.newaxis], out[..., :3])
+    return out
+
 # Get/Set Column.
 def m3dGetMatrixColumn33(dst, src, column):
     off = 3 * column
@@ -435,21 +620,19 @@ def m3dGetPlaneEquation(planeEq, p1, p2, p3):
     of the plane equation coefficients.
     """
     # Get two vectors... do the cross product
-    v1 = M3DVector3f()
-    v2 = M3DVector3f()
-
-    # V1 = p3 - p1
-    v1[0] = p3[0] - p1[0]
-    v1[1] = p3[1] - p1[1]
-    v1[2] = p3[2] - p1[2]
-
-    # V2 = P2 - p1
-    v2[0] = p2[0] - p1[0]
-    v2[1] = p2[1] - p1[1]
-    v2[2] = p2[2] - p1[2]
-
-    # Unit normal to plane - Not sure which is the best way here
-    m3dCrossProduct(planeEq, v1, v2)
+    with m3dPool.scope(M3DVector3f, M3DVector3f) as (v1, v2):
+        # V1 = p3 - p1
+        v1[0] = p3[0] - p1[0]
+        v1[1] = p3[1] - p1[1]
+        v1[2] = p3[2] - p1[2]
+
+        # V2 = P2 - p1
+        v2[0] = p2[0] - p1[0]
+        v2[1] = p2[1] - p1[1]
+        v2[2] = p2[2] - p1[2]
+
+        # Unit normal to plane - Not sure which is the best way here
+        m3dCrossProduct(planeEq, v1, v2)
     m3dNormalizeVector(planeEq)
     # Back substitute to get D
     planeEq[3] = -(planeEq[0] * p3[0] + planeEq[1] * p3[1] + planeEq[2] * p3[2])
@@ -526,118 +709,218 @@ def m3dTransformVector4(vOut4f, v4f, m44f):
     vOut4f[2] = m44f[2] * v4f[0] + m44f[6] * v4f[1] + m44f[10] * v4f[2] + m44f[14] * v4f[3]
     vOut4f[3] = m44f[3] * v4f[0] + m44f[7] * v4f[1] + m44f[11] * v4f[2] + m44f[15] * v4f[3]
 
-# Creates a 3x3 rotation matrix, takes radians NOT degrees
-def m3dRotationMatrix33(m, angle, x, z):
-
-    s = float(sin(angle))
-    c = float(cos(angle))
-
-    mag = float(sqrt( x*x + y*y + z*z ))
-
-    # Identity matrix
+# Multiply two matrices, product = a * b, all column major. product may be
+# the same object as a or b.
+def m3dMatrixMultiply33(product, a, b):
+    product[:] = [a[i] * b[j*3] + a[3+i] * b[j*3+1] + a[6+i] * b[j*3+2]
+                  for j in range(3) for i in range(3)]
+
+def m3dMatrixMultiply44(product, a, b):
+    product[:] = [a[i] * b[j*4] + a[4+i] * b[j*4+1] + a[8+i] * b[j*4+2] + a[12+i] * b[j*4+3]
+                  for j in range(4) for i in range(4)]
+
+# Multiply arrays of 4x4 matrices pairwise, product[n] = a[n] * b[n]. a and
+# b are (n, 16) or (n, 4, 4) arrays of column-major matrices, or a single
+# matrix to use with every matrix of the other. product is an array to fill
+# or None; the (n, 16) float32 result is returned either way.
+def m3dMatrixMultiply44Array(product, a, b):
+    a = numpy.asarray(a, numpy.float32).reshape(-1, 4, 4)
+    b = numpy.asarray(b, numpy.float32).reshape(-1, 4, 4)
+    if product is None:
+        product = numpy.empty((max(len(a), len(b)), 16), numpy.float32)
+    # Stored column major, each matrix reads as its transpose, and
+    # (a * b)' = b' * a'
+    numpy.matmul(b, a, product.reshape(-1, 4, 4))
+    return product
+
+# Terms of the rotation by angle about the axis (x, y, z), row by row:
+#   r00 r01 r02
+#   r10 r11 r12
+#   r20 r21 r22
+# or None for a zero length axis.
+def _m3dRotationTerms(angle, x, y, z):
+    mag = sqrt(x*x + y*y + z*z)
     if mag == 0.0:
-        m3dLoadIdentity33(m)
+        return None
 
     # Rotation matrix is normalized
     x /= mag
     y /= mag
     z /= mag
 
-    xx = x * x
-    yy = y * y
-    zz = z * z
-    xy = x * y
-    yz = y * z
-    zx = z * x
+    s = sin(angle)
+    c = cos(angle)
     xs = x * s
     ys = y * s
     zs = z * s
     one_c = 1.0 - c
-
-    def M33(row,col,val): m[col*4+row] = val
-
-    M33(0,0, (one_c * xx) + c)
-    M33(0,1, (one_c * xy) - zs)
-    M33(0,2, (one_c * zx) + ys)
-
-    M33(1,0, (one_c * xy) + zs)
-    M33(1,1, (one_c * yy) + c)
-    M33(1,2, (one_c * yz) - xs)
-
-    M33(2,0, (one_c * zx) - ys)
-    M33(2,1, (one_c * yz) + xs)
-    M33(2,2, (one_c * zz) + c)
-
-# Creates a 4x4 rotation matrix, takes radians NOT degrees
+    xy = one_c * x * y
+    yz = one_c * y * z
+    zx = one_c * z * x
+
+    return ((one_c * x * x) + c, xy - zs, zx + ys,
+            xy + zs, (one_c * y * y) + c, yz - xs,
+            zx - ys, yz + xs, (one_c * z * z) + c)
+
+# Creates a 3x3 rotation matrix, takes radians NOT degrees. A zero length
+# axis gives the identity matrix.
+def m3dRotationMatrix33(m, angle, x, y, z):
+    r = _m3dRotationTerms(angle, x, y, z)
+    if r is None:
+        m3dLoadIdentity33(m)
+        return
+    # Column major
+    m[:] = (r[0], r[3], r[6],
+            r[1], r[4], r[7],
+            r[2], r[5], r[8])
+
+# Creates a 4x4 rotation matrix, takes radians NOT degrees. A zero length
+# axis gives the identity matrix.
 def m3dRotationMatrix44(m, angle, x, y, z):
-    s = float(sin(angle))
-    c = float(cos(angle))
-
-    mag = float(sqrt( x*x + y*y + z*z ))
-
-    # Identity matrix
-    if mag == 0.0:
+    r = _m3dRotationTerms(angle, x, y, z)
+    if r is None:
         m3dLoadIdentity44(m)
-
-    # Rotation matrix is normalized
-    x /= mag
-    y /= mag
-    z /= mag
-
-    xx = x * x
-    yy = y * y
-    zz = z * z
-    xy = x * y
-    yz = y * z
-    zx = z * x
-    xs = x * s
-    ys = y * s
-    zs = z * s
+        return
+    # Column major
+    m[:] = (r[0], r[3], r[6], 0.0,
+            r[1], r[4], r[7], 0.0,
+            r[2], r[5], r[8], 0.0,
+            0.0, 0.0, 0.0, 1.0)
+
+# Rotation matrices for arrays of angles (radians) and axes, (n, 3) or a
+# single axis for all. m is an (n, 9) or (n, 16) float32 array to fill, or
+# None for a new (n, size) array; size is 9 for 3x3 and 16 for 4x4 matrices.
+# Matrices are column major, one per row, and axes of zero length give the
+# identity. Returns m.
+def m3dRotationMatrixArray(m, angles, axes, size=16):
+    angles = numpy.asarray(angles, numpy.float64).ravel()
+    axes = numpy.asarray(axes, numpy.float64).reshape(-1, 3)
+    n = max(len(angles), len(axes))
+    if len(axes) < n:
+        axes = numpy.repeat(axes, n, 0)
+    if m is None:
+        m = numpy.empty((n, size), numpy.float32)
+    d = 3 if m.shape[-1] == 9 else 4
+
+    mag = numpy.sqrt((axes * axes).sum(1))
+    identity = mag == 0.0
+    axes = axes / numpy.where(identity, 1.0, mag)[:, numpy.newaxis]
+    x, y, z = axes[:, 0], axes[:, 1], axes[:, 2]
+    s = numpy.sin(angles)
+    c = numpy.cos(angles)
     one_c = 1.0 - c
-
-    def M(row,col,val): m[col*4+row] = val
-
-    M(0,0, (one_c * xx) + c)
-    M(0,1, (one_c * xy) - zs)
-    M(0,2, (one_c * zx) + ys)
-    M(0,3, 0.0)
-
-    M(1,0, (one_c * xy) + zs)
-    M(1,1, (one_c * yy) + c)
-    M(1,2, (one_c * yz) - xs)
-    M(1,3, 0.0)
-
-    M(2,0, (one_c * zx) - ys)
-    M(2,1, (one_c * yz) + xs)
-    M(2,2, (one_c * zz) + c)
-    M(2,3, 0.0)
-
-    M(3,0, 0.0)
-    M(3,1, 0.0)
-    M(3,2, 0.0)
-    M(3,3, 1.0)
+    xy = one_c * x * y
+    yz = one_c * y * z
+    zx = one_c * z * x
+
+    # View each matrix as [column][row]
+    r = numpy.zeros((n, d, d))
+    r[:, 0, 0] = one_c * x * x + c
+    r[:, 1, 0] = xy - z * s
+    r[:, 2, 0] = zx + y * s
+    r[:, 0, 1] = xy + z * s
+    r[:, 1, 1] = one_c * y * y + c
+    r[:, 2, 1] = yz - x * s
+    r[:, 0, 2] = zx - y * s
+    r[:, 1, 2] = yz + x * s
+    r[:, 2, 2] = one_c * z * z + c
+    if d == 4:
+        r[:, 3, 3] = 1.0
+    r[identity] = numpy.identity(d)
+    m.reshape(n, d, d)[...] = r
+    return m
+
+def m3dRotationMatrix33Array(m, angles, axes):
+    return m3dRotationMatrixArray(m, angles, axes, 9)
+
+def m3dRotationMatrix44Array(m, angles, axes):
+    return m3dRotationMatrixArray(m, angles, axes, 16)
+
+# Fold a chain of transformations into one 4x4 matrix, m = T1 * T2 * ...
+# Each op is a tuple like the matching gl call, and they apply in the same
+# order as the calls would:
+#   ('translate', x, y, z)
+#   ('rotate', angle, x, y, z)     angle in radians
+#   ('scale', x, y, z)
+#   ('matrix', m44)                any column-major 4x4 matrix
+def m3dComposeMatrix44(m, ops):
+    r = [1.0, 0.0, 0.0, 0.0,
+         0.0, 1.0, 0.0, 0.0,
+         0.0, 0.0, 1.0, 0.0,
+         0.0, 0.0, 0.0, 1.0]
+    rotation = None
+    for op in ops:
+        kind = op[0]
+        if kind == 'translate':
+            x, y, z = op[1:]
+            for i in range(4):
+                r[12+i] += x * r[i] + y * r[4+i] + z * r[8+i]
+        elif kind == 'scale':
+            for j in range(3):
+                for i in range(4):
+                    r[j*4+i] *= op[1+j]
+        elif kind == 'rotate':
+            if rotation is None:
+                rotation = M3DMatrix44f()
+            m3dRotationMatrix44(rotation, *op[1:])
+            m3dMatrixMultiply44(r, r, rotation)
+        elif kind == 'matrix':
+            m3dMatrixMultiply44(r, r, op[1])
+        else:
+            raise ValueError('unknown transformation %r' % (kind,))
+    m[:] = r
+
+# Determinant of the 3x3 minor of m left by removing row i and column j,
+# with m indexed as m[i*4+j]
+def _m3dDetIJ(m, i, j):
+    rows = [ii for ii in range(4) if ii != i]
+    cols = [jj for jj in range(4) if jj != j]
+    mat = [[m[ii*4+jj] for jj in cols] for ii in rows]
+    ret = mat[0][0] * (mat[1][1]*mat[2][2] - mat[2][1]*mat[1][2])
+    ret -= mat[0][1] * (mat[1][0]*mat[2][2] - mat[2][0]*mat[1][2])
+    ret += mat[0][2] * (mat[1][0]*mat[2][1] - mat[2][0]*mat[1][1])
+    return ret
+
+# Invert a 4x4 matrix by cofactors. m is a flat sequence of 16 values, so a
+# (4, 4) array from glGetFloatv should be flattened first.
+def m3dInvertMatrix44(mInverse, m):
+    # Calculate 4x4 determinant
+    det = 0.0
+    for i in range(4):
+        if i & 0x1:
+            det -= m[i] * _m3dDetIJ(m, 0, i)
+        else:
+            det += m[i] * _m3dDetIJ(m, 0, i)
+    det = 1.0 / det
+
+    # Calculate inverse
+    for i in range(4):
+        for j in range(4):
+            detij = _m3dDetIJ(m, j, i)
+            if (i+j) & 0x1:
+                mInverse[(i*4)+j] = -detij * det
+            else:
+                mInverse[(i*4)+j] = detij * det
 
 # Calculates the normal of a triangle specified by the three points
 # p1, p2, and p3. Each pointer points to an array of three floats. The
 # triangle is assumed to be wound counter clockwise. 
 def m3dFindNormal(result, point1, point2, point3):
     # Temporary vectors
-    v1 = M3DVector3f()
-    v2 = M3DVector3f()
+    with m3dPool.scope(M3DVector3f, M3DVector3f) as (v1, v2):
+        # Calculate two vectors from the three points. Assumes counter
+        # clockwise winding!
+        v1[0] = point1[0] - point2[0]
+        v1[1] = point1[1] - point2[1]
+        v1[2] = point1[2] - point2[2]
 
-    # Calculate two vectors from the three points. Assumes counter clockwise
-    # winding!
-    v1[0] = point1[0] - point2[0]
-    v1[1] = point1[1] - point2[1]
-    v1[2] = point1[2] - point2[2]
+        v2[0] = point2[0] - point3[0]
+        v2[1] = point2[1] - point3[1]
+        v2[2] = point2[2] - point3[2]
 
-    v2[0] = point2[0] - point3[0]
-    v2[1] = point2[1] - point3[1]
-    v2[2] = point2[2] - point3[2]
-
-    # Take the cross product of the two vectors to get
-    # the normal vector.
-    m3dCrossProduct(result, v1, v2)
+        # Take the cross product of the two vectors to get
+        # the normal vector.
+        m3dCrossProduct(result, v1, v2)
 
 if __name__ == '__main__':
     def _assert_float(v):
@@ -707,6 +990,22 @@ if __name__ == '__main__':
     v[0:2] = [0,2]; assert v == [0,2,2]; _assert_float(v)
     v[:] = [0,1,2]; assert v == [0,1,2]; _assert_float(v)
     
+    print '_M3DVector fast paths write in place or into out'
+    v = M3DVector3f(1, 2, 3)
+    out = M3DVector3f()
+    assert v.add_into((1, 1, 1), out) is out and out == [2,3,4]; _assert_float(out)
+    assert v.sub_into((1, 1, 1), out) == [0,1,2]; _assert_float(out)
+    assert v.mul_into((2, 2, 2), out) == [2,4,6]; _assert_float(out)
+    assert v.scale_into(0.5, out) == [.5,1,1.5]; _assert_float(out)
+    assert v.neg_into(out) == [-1,-2,-3]; _assert_float(out)
+    assert v == [1,2,3]
+    assert v.madd(M3DVector3f(1, 0, 0), 2.0) is v and v == [3,2,3]; _assert_float(v)
+    t = M3DVector3f.trusted([1.0, 2.0, 3.0])
+    assert isinstance(t, M3DVector3f) and len(t) == 3 and t == [1,2,3]
+    assert isinstance(t + t, M3DVector3f) and t + t == [2,4,6]; _assert_float(t + t)
+    assert isinstance(-t, M3DVector3f); _assert_float(-t)
+    v[:] = [0,1,2]
+
     print '_M3DVector enforces size in constructor, slices, and array operations'
     try: v = M3DVector3f(1,2); print 'constructor size enforcement not working!!'
     except VectorSizeError, e: assert v == [0,1,2]; _assert_float(v); print '  constructor:',e
@@ -742,6 +1041,142 @@ if __name__ == '__main__':
     M3DMatrix44f(*range(16))
     M3DMatrix44f(range(16))
 
+    print 'm3dMatrixMultiply44 matches numpy, in place too'
+    a = M3DMatrix44f(range(16))
+    b = M3DMatrix44f(range(16, 32))
+    m = M3DMatrix44f()
+    m3dMatrixMultiply44(m, a, b)
+    expect = numpy.dot(numpy.reshape(a[:], (4, 4)).T, numpy.reshape(b[:], (4, 4)).T)
+    assert numpy.allclose(m[:], expect.T.ravel())
+    m3dMatrixMultiply44(a, a, b)
+    assert a == m
+    a33 = M3DMatrix33f(range(9))
+    m33 = M3DMatrix33f()
+    m3dMatrixMultiply33(m33, a33, a33)
+    expect = numpy.dot(numpy.reshape(a33[:], (3, 3)).T, numpy.reshape(a33[:], (3, 3)).T)
+    assert numpy.allclose(m33[:], expect.T.ravel())
+
+    print 'm3dMatrixMultiply44Array multiplies pairwise and broadcasts'
+    many = numpy.random.rand(5, 16).astype(numpy.float32)
+    products = m3dMatrixMultiply44Array(None, many, b)
+    assert products.shape == (5, 16)
+    for n in range(5):
+        m3dMatrixMultiply44(m, many[n], b)
+        assert numpy.allclose(products[n], m[:], rtol=1e-5)
+    out = numpy.empty((5, 16), numpy.float32)
+    assert m3dMatrixMultiply44Array(out, b, many) is out
+    m3dMatrixMultiply44(m, b, many[3])
+    assert numpy.allclose(out[3], m[:], rtol=1e-5)
+
+    print 'm3dComposeMatrix44 applies ops in gl call order'
+    m3dComposeMatrix44(m, [('translate', 1.0, 2.0, 3.0),
+                           ('rotate', m3dDegToRad(90.0), 0.0, 0.0, 1.0),
+                           ('scale', 2.0, 2.0, 2.0)])
+    p = M3DVector3f()
+    m3dTransformVector3(p, (1.0, 0.0, 0.0), m)
+    assert all(abs(a - b) < 1e-6 for a, b in zip(p, (1.0, 4.0, 3.0)))
+
+    print 'vector array functions match the single vector ones'
+    a = numpy.random.rand(10, 3).astype(numpy.float32) - 0.5
+    b = numpy.random.rand(10, 4).astype(numpy.float32) - 0.5
+    dots = m3dDotProductArray(a, b)
+    crosses = m3dCrossProductArray(a, b)
+    lengths = m3dGetVectorLengthArray(b)
+    for n in range(10):
+        assert abs(dots[n] - m3dDotProduct(a[n], b[n])) < 1e-6
+        c = M3DVector3f()
+        m3dCrossProduct(c, a[n], b[n])
+        assert numpy.allclose(crosses[n], c[:], atol=1e-6)
+        assert abs(lengths[n] - m3dGetVectorLength(b[n])) < 1e-6
+    assert numpy.allclose(m3dDotProductArray(a, (0.0, 0.0, 2.0)), 2.0 * a[:, 2])
+
+    print 'vector array functions write to out'
+    out = numpy.empty(10, numpy.float32)
+    assert m3dDotProductArray(a, b, out) is out
+    assert numpy.allclose(out, dots)
+    assert m3dGetVectorLengthArray(a, out) is out
+    assert m3dCrossProductArray(a, b, a) is a
+    assert numpy.allclose(a, crosses)
+
+    print 'm3dNormalizeVectorArray works in place, leaving w and zeros alone'
+    b[0, :3] = 0.0
+    w = b[:, 3].copy()
+    assert m3dNormalizeVectorArray(b) is b
+    assert numpy.allclose(m3dGetVectorLengthArray(b[1:]), 1.0)
+    assert (b[0, :3] == 0.0).all() and (b[:, 3] == w).all()
+    grid = numpy.ones((2, 5, 3))
+    unit = m3dNormalizeVectorArray(grid, numpy.empty_like(grid))
+    assert numpy.allclose(unit, 1.0 / sqrt(3.0)) and (grid == 1.0).all()
+
+    print 'M3DPool reuses released objects and counts hits'
+    pool = M3DPool()
+    with pool.scope(M3DVector3f) as (a,):
+        pass
+    with pool.scope(M3DVector3f) as (b,):
+        assert b is not a
+    assert pool.hits == 0 and pool.misses == 2
+    pool.enabled = True
+    with pool.scope(M3DVector3f, M3DMatrix44f) as (a, m):
+        assert isinstance(a, M3DVector3f) and isinstance(m, M3DMatrix44f)
+    for i in range(3):
+        with pool.scope(M3DVector3f, M3DMatrix44f) as (b, n):
+            assert b is a and n is m
+    assert pool.hits == 6 and pool.misses == 4
+    pool.reset_counters()
+    assert pool.hit_rate == 0.0
+
+    print 'pooled temporaries give the same plane and normal'
+    plane = M3DVector4f()
+    normal = M3DVector3f()
+    m3dPool.enabled = True
+    for i in range(2):
+        m3dGetPlaneEquation(plane, (0, -0.4, 0), (10, -0.4, 0), (5, -0.4, -5))
+        assert all(abs(a - b) < 1e-6 for a, b in zip(plane, (0, -1, 0, -0.4)))
+        m3dFindNormal(normal, (0, 0, 0), (1, 0, 0), (0, 1, 0))
+        assert normal == [0, 0, 1]
+    assert m3dPool.hits == 6 and m3dPool.misses == 2
+    m3dPool.enabled = False
+    m3dPool.clear()
+
+    print 'rotation matrices turn x into y about z, 3x3 and 4x4'
+    m33 = M3DMatrix33f()
+    m3dRotationMatrix33(m33, m3dDegToRad(90.0), 0.0, 0.0, 2.0)
+    assert all(abs(a - b) < 1e-6 for a, b in zip(m33, (0,1,0, -1,0,0, 0,0,1)))
+    m = M3DMatrix44f()
+    m3dRotationMatrix44(m, m3dDegToRad(90.0), 0.0, 0.0, 2.0)
+    assert all(abs(a - b) < 1e-6 for a, b in zip(m, (0,1,0,0, -1,0,0,0, 0,0,1,0, 0,0,0,1)))
+    m3dRotationMatrix44(m, 1.0, 0.0, 0.0, 0.0)
+    assert m == [1,0,0,0, 0,1,0,0, 0,0,1,0, 0,0,0,1]
+    m3dRotationMatrix33(m33, 1.0, 0.0, 0.0, 0.0)
+    assert m33 == [1,0,0, 0,1,0, 0,0,1]
+
+    print 'batched rotation matrices match the single ones'
+    angles = numpy.random.rand(20) * 6.0
+    axes = numpy.random.rand(20, 3) - 0.5
+    axes[3] = 0.0
+    ms = m3dRotationMatrix44Array(None, angles, axes)
+    m33s = m3dRotationMatrix33Array(numpy.empty((20, 9), numpy.float32), angles, axes)
+    for i in range(20):
+        m3dRotationMatrix44(m, angles[i], *axes[i])
+        assert numpy.allclose(ms[i], m[:], atol=1e-6)
+        m3dRotationMatrix33(m33, angles[i], *axes[i])
+        assert numpy.allclose(m33s[i], m33[:], atol=1e-6)
+    spins = m3dRotationMatrix44Array(None, angles, (0.0, 1.0, 0.0))
+    m3dRotationMatrix44(m, angles[5], 0.0, 1.0, 0.0)
+    assert spins.shape == (20, 16) and numpy.allclose(spins[5], m[:], atol=1e-6)
+
+    print 'm3dInvertMatrix44 undoes a rotation and translation'
+    m = M3DMatrix44f()
+    m3dRotationMatrix44(m, m3dDegToRad(30.0), 0.0, 1.0, 0.0)
+    m[12], m[13], m[14] = 1.0, 2.0, 3.0
+    mInverse = M3DMatrix44f()
+    m3dInvertMatrix44(mInverse, m)
+    p = M3DVector3f(0.5, -1.0, 2.0)
+    q = M3DVector3f()
+    m3dTransformVector3(q, p, m)
+    m3dTransformVector3(q, q[:], mInverse)
+    assert all(abs(a - b) < 1e-6 for a, b in zip(p, q))
+
     print """
 That's it for the vector class tests. There is a hodge-podge of other
 functions for operating on vectors. A lot of it is carried over from
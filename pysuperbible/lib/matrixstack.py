@@ -0,0 +1,215 @@
+"""
+GL style matrix stacks kept on the CPU.
+
+Code that needs the current modelview for its own math, for shadows, CPU
+lighting or culling, usually asks the driver for it with glGetFloatv, which
+stalls until GL has caught up and copies sixteen floats through ctypes. A
+MatrixStack does the glPushMatrix / glTranslatef / glRotatef / ... work
+itself, so the current matrix is always at hand, and loads it into GL with
+one glLoadMatrixf when something is about to be drawn, and only if it
+changed since the last time:
+
+    modelview = MatrixStack()
+    ...
+    with modelview:
+        modelview.translate(0.0, 0.0, -2.5)
+        modelview.rotate(yRot, 0.0, 1.0, 0.0)
+        modelview.flush()
+        light = object_space_light(vLightDir, modelview.matrix)
+        ...draw...
+
+Matrices are column-major like math3d's M3DMatrix44f: anything that takes
+a math3d matrix or the result of glGetFloatv takes matrix, and mult and
+load accept math3d matrices. Internally the top of the stack is a (4, 4)
+float32 array laid out in GL order, as vertexpipe.as_matrix returns it.
+
+While a stack is in use, the GL matrix it mirrors should only be changed
+through it, or between a push and a pop on the GL side; anything else is
+overwritten at the next flush.
+"""
+
+
+import math
+
+import numpy
+from OpenGL.GL import *
+
+from math3d import M3DMatrix44f, m3dDegToRad, m3dRotationMatrix44
+from vertexpipe import as_matrix
+
+
+class MatrixStackError(Exception):
+    def __init__(self, message):
+        self.value = message
+    def __str__(self):
+        return str(self.value)
+
+
+class MatrixStack(object):
+    """A matrix stack mirroring one of GL's.
+
+    mode -> the GL stack to load into on flush, GL_MODELVIEW or
+        GL_PROJECTION
+    depth -> maximum depth; GL's own minimum is 32 for the modelview
+        stack and 2 for projection
+    """
+
+    def __init__(self, mode=GL_MODELVIEW, depth=32):
+        self.mode = mode
+        self.depth = depth
+        self._stack = [numpy.identity(4, numpy.float32)]
+        self._rotation = M3DMatrix44f()
+        self.dirty = True
+
+    @property
+    def top(self):
+        """the current matrix as a (4, 4) array in GL order; the transpose
+        of the matrix, so row vectors times top transform points"""
+        return self._stack[-1]
+
+    @property
+    def matrix(self):
+        """the current matrix as 16 column-major floats"""
+        return self._stack[-1].ravel()
+
+    def __len__(self):
+        return len(self._stack)
+
+    def push(self):
+        if len(self._stack) >= self.depth:
+            raise MatrixStackError('stack overflow')
+        self._stack.append(self._stack[-1].copy())
+
+    def pop(self):
+        if len(self._stack) == 1:
+            raise MatrixStackError('stack underflow')
+        self._stack.pop()
+        self.dirty = True
+
+    def __enter__(self):
+        self.push()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pop()
+
+    def load_identity(self):
+        self._stack[-1][...] = numpy.identity(4, numpy.float32)
+        self.dirty = True
+
+    def load(self, m):
+        """replace the current matrix with a column-major matrix"""
+        self._stack[-1][...] = as_matrix(m)
+        self.dirty = True
+
+    def mult(self, m):
+        """multiply the current matrix by a column-major matrix, like
+        glMultMatrixf"""
+        # In GL order the product M * m is as_matrix(m) . top
+        self._stack[-1] = numpy.dot(as_matrix(m), self._stack[-1])
+        self.dirty = True
+
+    def translate(self, x, y, z):
+        """like glTranslatef"""
+        top = self._stack[-1]
+        top[3] += x * top[0] + y * top[1] + z * top[2]
+        self.dirty = True
+
+    def scale(self, x, y, z):
+        """like glScalef"""
+        top = self._stack[-1]
+        top[0] *= x
+        top[1] *= y
+        top[2] *= z
+        self.dirty = True
+
+    def rotate(self, angle, x, y, z):
+        """like glRotatef, angle in degrees"""
+        if x == y == z == 0.0:
+            return
+        m3dRotationMatrix44(self._rotation, m3dDegToRad(angle), x, y, z)
+        self.mult(self._rotation)
+
+    def ortho(self, left, right, bottom, top, near, far):
+        """like glOrtho"""
+        m = numpy.identity(4, numpy.float32)
+        m[0, 0] = 2.0 / (right - left)
+        m[1, 1] = 2.0 / (top - bottom)
+        m[2, 2] = -2.0 / (far - near)
+        m[3, 0] = -(right + left) / float(right - left)
+        m[3, 1] = -(top + bottom) / float(top - bottom)
+        m[3, 2] = -(far + near) / float(far - near)
+        self.mult(m.ravel())
+
+    def perspective(self, fovy, aspect, near, far):
+        """like gluPerspective"""
+        f = 1.0 / math.tan(m3dDegToRad(fovy) / 2.0)
+        m = numpy.zeros((4, 4), numpy.float32)
+        m[0, 0] = f / aspect
+        m[1, 1] = f
+        m[2, 2] = (far + near) / float(near - far)
+        m[2, 3] = -1.0
+        m[3, 2] = 2.0 * far * near / (near - far)
+        self.mult(m.ravel())
+
+    def flush(self, force=False):
+        """load the current matrix into GL if it changed since the last
+        flush. Leaves GL in GL_MODELVIEW matrix mode, as the demos expect."""
+        if not (self.dirty or force):
+            return
+        if self.mode != GL_MODELVIEW:
+            glMatrixMode(self.mode)
+        glLoadMatrixf(self._stack[-1])
+        if self.mode != GL_MODELVIEW:
+            glMatrixMode(GL_MODELVIEW)
+        self.dirty = False
+
+
+if __name__ == '__main__':
+    from math3d import m3dTransformVector4
+
+    def transform(stack, p):
+        out = [0.0] * 4
+        m3dTransformVector4(out, p, stack.matrix)
+        return numpy.array(out)
+
+    print 'transformations compose like GL, last call applied first'
+    s = MatrixStack()
+    s.translate(1.0, 2.0, 3.0)
+    s.rotate(90.0, 0.0, 0.0, 1.0)
+    s.scale(2.0, 2.0, 2.0)
+    assert numpy.allclose(transform(s, (1.0, 0.0, 0.0, 1.0)), (1.0, 4.0, 3.0, 1.0))
+    # Rows of top transform like the matrix on columns
+    assert numpy.allclose(numpy.dot((1.0, 0.0, 0.0, 1.0), s.top), (1.0, 4.0, 3.0, 1.0))
+
+    print 'push and pop restore the matrix and mark it for flushing'
+    before = s.matrix.copy()
+    with s:
+        s.translate(5.0, 0.0, 0.0)
+        s.dirty = False
+    assert (s.matrix == before).all()
+    assert s.dirty
+    s.load_identity()
+    try:
+        s.pop()
+    except MatrixStackError:
+        pass
+    else:
+        raise AssertionError('pop of the last matrix')
+
+    print 'mult takes math3d matrices'
+    r = M3DMatrix44f()
+    m3dRotationMatrix44(r, m3dDegToRad(90.0), 0.0, 1.0, 0.0)
+    s.mult(r)
+    assert numpy.allclose(transform(s, (0.0, 0.0, 1.0, 0.0)), (1.0, 0.0, 0.0, 0.0))
+
+    print 'projections match the GL formulas'
+    p = MatrixStack(GL_PROJECTION, 2)
+    p.perspective(90.0, 1.0, 1.0, 3.0)
+    v = transform(p, (0.0, 0.0, -1.0, 1.0))
+    assert numpy.allclose(v[2] / v[3], -1.0)
+    v = transform(p, (0.0, 0.0, -3.0, 1.0))
+    assert numpy.allclose(v[2] / v[3], 1.0)
+    p.load_identity()
+    p.ortho(-100.0, 100.0, -50.0, 50.0, -200.0, 200.0)
+    assert numpy.allclose(transform(p, (100.0, -50.0, 200.0, 1.0)), (1.0, -1.0, -1.0, 1.0))
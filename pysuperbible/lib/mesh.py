@@ -0,0 +1,232 @@
+"""
+Indexed meshes in numpy vertex arrays.
+
+A Mesh holds one array per vertex attribute stream (positions, normals,
+texture coordinates, colors) plus an optional index array, and draws them
+with a single glDrawElements or glDrawArrays. Streams can be moved into
+static vertex buffer objects with upload(); any stream can be replaced for
+one draw, which is how per-frame data such as CPU-transformed positions or
+toon shading coordinates is fed in without touching the rest.
+
+Generators here build the same shapes as the gltools glBegin/glEnd
+functions, but produce whole arrays in a few vectorized steps.
+"""
+
+
+import ctypes
+
+import numpy
+from OpenGL.GL import *
+
+from math3d import M3D_PI, M3D_2PI
+
+
+class Mesh(object):
+    """Vertex streams and the primitive they make.
+
+    mode -> GL primitive, e.g. GL_TRIANGLES
+    positions -> (n, 3) float32
+    normals -> optional (n, 3) float32
+    texcoords -> optional (n,) or (n, k) float32
+    colors -> optional (n, 3) or (n, 4) float32
+    indices -> optional (m,) uint32 indices into the streams
+    """
+
+    STREAMS = ('positions', 'normals', 'texcoords', 'colors')
+
+    def __init__(self, mode, positions, normals=None, texcoords=None,
+                 colors=None, indices=None):
+        self.mode = mode
+        self.positions = _f32(positions)
+        self.normals = _f32(normals)
+        self.texcoords = _f32(texcoords)
+        self.colors = _f32(colors)
+        if indices is not None:
+            indices = numpy.ascontiguousarray(indices, numpy.uint32)
+        self.indices = indices
+        # Stream name -> VBO name, for streams that live on the GPU
+        self.buffers = {}
+        self.index_buffer = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def upload(self, streams=None, usage=GL_STATIC_DRAW):
+        """copy streams (default: all present) and the indices into vertex
+        buffer objects, so draws no longer send them from client memory"""
+        for name in streams or self.STREAMS:
+            data = getattr(self, name)
+            if data is None:
+                continue
+            vbo = self.buffers.get(name)
+            if vbo is None:
+                vbo = self.buffers[name] = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, usage)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        if self.indices is not None:
+            if self.index_buffer is None:
+                self.index_buffer = glGenBuffers(1)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indices.nbytes,
+                self.indices, GL_STATIC_DRAW)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+
+    def delete(self):
+        """free any vertex buffer objects"""
+        names = self.buffers.values()
+        if self.index_buffer is not None:
+            names.append(self.index_buffer)
+        if names:
+            glDeleteBuffers(len(names), names)
+        self.buffers = {}
+        self.index_buffer = None
+
+    def draw(self, index_range=None, **streams):
+        """draw the mesh
+
+        index_range -> optional (first, count) to draw only that run of the
+            indices
+        streams -> per-draw replacements, by stream name. A value is either
+            a numpy array, drawn from client memory, or a (vbo, offset,
+            size) tuple naming a region of a buffer object that holds size
+            float32 components per vertex. size may be left off when the
+            mesh has a stream of that name to take it from. None disables
+            the stream.
+        """
+        enabled = []
+        for name, state, pointer in (
+                ('positions', GL_VERTEX_ARRAY, _vertex_pointer),
+                ('normals', GL_NORMAL_ARRAY, _normal_pointer),
+                ('texcoords', GL_TEXTURE_COORD_ARRAY, _texcoord_pointer),
+                ('colors', GL_COLOR_ARRAY, _color_pointer)):
+            data = getattr(self, name)
+            source = streams.get(name, data)
+            if source is None:
+                continue
+            if isinstance(source, tuple):
+                vbo, offset = source[:2]
+                size = source[2] if len(source) > 2 else _size(data)
+                glBindBuffer(GL_ARRAY_BUFFER, vbo)
+                pointer(size, ctypes.c_void_p(offset))
+            elif source is data and name in self.buffers:
+                glBindBuffer(GL_ARRAY_BUFFER, self.buffers[name])
+                pointer(_size(data), ctypes.c_void_p(0))
+            else:
+                glBindBuffer(GL_ARRAY_BUFFER, 0)
+                pointer(_size(source), source)
+            glEnableClientState(state)
+            enabled.append(state)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        if self.indices is None:
+            glDrawArrays(self.mode, 0, len(self.positions))
+        else:
+            first, count = index_range or (0, len(self.indices))
+            if self.index_buffer is not None:
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+                glDrawElements(self.mode, count, GL_UNSIGNED_INT,
+                    ctypes.c_void_p(first * 4))
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+            else:
+                glDrawElements(self.mode, count, GL_UNSIGNED_INT,
+                    self.indices[first:first + count])
+        for state in enabled:
+            glDisableClientState(state)
+
+
+def _f32(a):
+    if a is None:
+        return None
+    return numpy.ascontiguousarray(a, numpy.float32)
+
+def _size(a):
+    return 1 if a.ndim == 1 else a.shape[1]
+
+def _vertex_pointer(size, ptr): glVertexPointer(size, GL_FLOAT, 0, ptr)
+def _normal_pointer(size, ptr): glNormalPointer(GL_FLOAT, 0, ptr)
+def _texcoord_pointer(size, ptr): glTexCoordPointer(size, GL_FLOAT, 0, ptr)
+def _color_pointer(size, ptr): glColorPointer(size, GL_FLOAT, 0, ptr)
+
+
+def grid_indices(rows, cols):
+    """return GL_TRIANGLES indices for a rows x cols grid of quads whose
+    vertices are numbered row by row, (cols + 1) to a row"""
+    r, c = numpy.mgrid[0:rows, 0:cols]
+    a = (r * (cols + 1) + c).ravel()
+    b = a + 1
+    d = a + cols + 1
+    e = d + 1
+    # Two triangles per quad, wound counter clockwise when rows advance
+    # anticlockwise about the columns: a, d, e and a, e, b
+    return numpy.column_stack((a, d, e, a, e, b)).ravel().astype(numpy.uint32)
+
+
+def torus_mesh(majorRadius, minorRadius, numMajor, numMinor):
+    """return a Mesh of the torus drawn by gltDrawTorus, in the xy plane"""
+    a = numpy.linspace(0.0, M3D_2PI, numMajor + 1)[:, numpy.newaxis]
+    b = numpy.linspace(0.0, M3D_2PI, numMinor + 1)[numpy.newaxis, :]
+    cos_a, sin_a = numpy.cos(a), numpy.sin(a)
+    cos_b, sin_b = numpy.cos(b), numpy.sin(b)
+    r = minorRadius * cos_b + majorRadius
+
+    n = (numMajor + 1) * (numMinor + 1)
+    positions = numpy.empty((n, 3), numpy.float32)
+    positions[:, 0] = (cos_a * r).ravel()
+    positions[:, 1] = (sin_a * r).ravel()
+    positions[:, 2] = numpy.tile(minorRadius * sin_b.ravel(), numMajor + 1)
+
+    # These are already unit length
+    normals = numpy.empty((n, 3), numpy.float32)
+    normals[:, 0] = (cos_a * cos_b).ravel()
+    normals[:, 1] = (sin_a * cos_b).ravel()
+    normals[:, 2] = numpy.tile(sin_b.ravel(), numMajor + 1)
+
+    s, t = numpy.meshgrid(numpy.linspace(0.0, 1.0, numMajor + 1),
+                          numpy.linspace(0.0, 1.0, numMinor + 1), indexing='ij')
+    texcoords = numpy.column_stack((s.ravel(), t.ravel()))
+
+    return Mesh(GL_TRIANGLES, positions, normals, texcoords,
+                indices=grid_indices(numMajor, numMinor))
+
+
+def sphere_mesh(fRadius, iSlices, iStacks):
+    """return a Mesh of the sphere drawn by gltDrawSphere"""
+    rho = numpy.linspace(0.0, M3D_PI, iStacks + 1)[:, numpy.newaxis]
+    theta = numpy.linspace(0.0, M3D_2PI, iSlices + 1)[numpy.newaxis, :]
+    theta[0, -1] = 0.0
+    shape = (iStacks + 1, iSlices + 1)
+    normals = numpy.empty(shape + (3,), numpy.float32)
+    normals[..., 0] = -numpy.sin(theta) * numpy.sin(rho)
+    normals[..., 1] = numpy.cos(theta) * numpy.sin(rho)
+    normals[..., 2] = numpy.broadcast_to(numpy.cos(rho), shape)
+    normals = normals.reshape(-1, 3)
+
+    s, t = numpy.meshgrid(numpy.linspace(1.0, 0.0, iStacks + 1),
+                          numpy.linspace(0.0, 1.0, iSlices + 1), indexing='ij')
+    texcoords = numpy.column_stack((t.ravel(), s.ravel()))
+
+    return Mesh(GL_TRIANGLES, normals * fRadius, normals, texcoords,
+                indices=grid_indices(iStacks, iSlices))
+
+
+if __name__ == '__main__':
+    print 'torus vertices sit on the torus surface with unit normals'
+    m = torus_mesh(0.35, 0.15, 40, 20)
+    assert len(m) == 41 * 21
+    assert len(m.indices) == 40 * 20 * 6
+    ring = numpy.hypot(m.positions[:, 0], m.positions[:, 1]) - 0.35
+    assert numpy.allclose(numpy.hypot(ring, m.positions[:, 2]), 0.15, atol=1e-6)
+    assert numpy.allclose(numpy.sqrt((m.normals ** 2).sum(1)), 1.0, atol=1e-6)
+
+    print 'torus triangles face outward'
+    tri = m.positions[m.indices.reshape(-1, 3)]
+    face = numpy.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    assert ((face * m.normals[m.indices.reshape(-1, 3)[:, 0]]).sum(1) >= -1e-9).all()
+
+    print 'sphere triangles face outward'
+    m = sphere_mesh(2.0, 12, 6)
+    assert numpy.allclose(numpy.sqrt((m.positions ** 2).sum(1)), 2.0, atol=1e-5)
+    tri = m.positions[m.indices.reshape(-1, 3)]
+    face = numpy.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    assert ((face * tri.mean(1)).sum(1) >= -1e-6).all()
@@ -0,0 +1,187 @@
+"""
+Motion blur from a ring of recent frames.
+
+The accumulation buffer way to blur motion is to draw the scene several
+times per frame at slightly different times and add the images up, which
+multiplies the geometry cost by the number of passes, and accumulation
+buffers are slow or emulated on many drivers. MotionBlur draws the scene
+once per frame into the next texture of a ring that holds the last N
+frames, then composites the ring onto the window with a full-screen quad:
+one pass through a fragment shader that takes a weighted sum of all N
+textures. Without shader support the sum is built with additive blending,
+one quad per frame in the ring.
+
+    blur = MotionBlur(width, height, frames=10)
+    ...
+    def on_draw(self):
+        blur.begin()
+        ...draw scene...
+        blur.end()
+"""
+
+
+import numpy
+from OpenGL.GL import *
+
+from rendertarget import RenderTarget
+
+
+def _composite_shader(n):
+    # Unrolled, since GLSL 1.10 does not promise dynamic sampler indexing
+    lines = ['#version 110',
+             'uniform sampler2D frames[%d];' % n,
+             'uniform float weights[%d];' % n,
+             'void main()',
+             '{',
+             '    vec2 st = gl_TexCoord[0].st;',
+             '    vec4 color = vec4(0.0);']
+    for i in range(n):
+        lines.append('    color += weights[%d] * texture2D(frames[%d], st);' % (i, i))
+    lines += ['    gl_FragColor = color;', '}']
+    return '\n'.join(lines)
+
+
+class MotionBlur(object):
+    """A ring of the last few frames, blended together.
+
+    width, height -> size of the frames, normally the window size
+    frames -> number of frames in the ring
+    weights -> weight of each frame, newest first; they are normalized to
+        sum to one over the frames drawn so far. Default is equal weights.
+    """
+
+    def __init__(self, width, height, frames=10, weights=None):
+        if weights is None:
+            weights = [1.0] * frames
+        self.weights = numpy.asarray(weights, numpy.float32)[:frames]
+        self.frames = frames
+        self.target = RenderTarget(width, height, textures=frames)
+        self._filled = 0
+        self._newest = frames - 1
+        self._program = None
+        self._use_shader = None
+
+    def resize(self, width, height):
+        """resize the frames; the ring starts over"""
+        self.target.resize(width, height)
+        self._filled = 0
+
+    def reset(self):
+        """forget past frames, e.g. after a camera cut"""
+        self._filled = 0
+
+    def begin(self):
+        """start drawing a frame into the ring"""
+        self.target.attach((self._newest + 1) % self.frames)
+        self.target.bind()
+
+    def end(self):
+        """finish the frame and composite the ring into the window"""
+        self.target.unbind()
+        self._newest = self.target.current
+        self._filled = min(self._filled + 1, self.frames)
+        self.composite()
+
+    def _ages(self):
+        """return the textures newest first, and their normalized weights"""
+        n = self._filled
+        textures = [self.target.textures[(self._newest - age) % self.frames]
+                    for age in range(n)]
+        weights = self.weights[:n] / self.weights[:n].sum()
+        return textures, weights
+
+    def composite(self):
+        """draw the weighted sum of the ring over the whole viewport"""
+        if not self._filled:
+            return
+        textures, weights = self._ages()
+
+        glPushAttrib(GL_ENABLE_BIT | GL_COLOR_BUFFER_BIT | GL_TEXTURE_BIT |
+                     GL_CURRENT_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_DEPTH_TEST)
+        glDisable(GL_CULL_FACE)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+
+        if self._use_shader is None:
+            self._use_shader = self._build_program()
+        if self._use_shader:
+            self._composite_shader(textures, weights)
+        else:
+            self._composite_blend(textures, weights)
+
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopAttrib()
+
+    def _build_program(self):
+        """compile the composite shader; False if it cannot be used here"""
+        if self.frames > glGetIntegerv(GL_MAX_TEXTURE_IMAGE_UNITS):
+            return False
+        try:
+            from OpenGL.GL import shaders
+            self._program = shaders.compileProgram(
+                shaders.compileShader(_composite_shader(self.frames), GL_FRAGMENT_SHADER))
+        except Exception:
+            return False
+        glUseProgram(self._program)
+        for i in range(self.frames):
+            glUniform1i(glGetUniformLocation(self._program, 'frames[%d]' % i), i)
+        self._weights_location = glGetUniformLocation(self._program, 'weights')
+        glUseProgram(0)
+        return True
+
+    def _composite_shader(self, textures, weights):
+        w = numpy.zeros(self.frames, numpy.float32)
+        w[:len(weights)] = weights
+        for i in range(self.frames):
+            glActiveTexture(GL_TEXTURE0 + i)
+            # Slots not filled yet have zero weight; any texture will do
+            glBindTexture(GL_TEXTURE_2D, textures[min(i, len(textures) - 1)])
+        glActiveTexture(GL_TEXTURE0)
+        glUseProgram(self._program)
+        glUniform1fv(self._weights_location, self.frames, w)
+        _fullscreen_quad()
+        glUseProgram(0)
+
+    def _composite_blend(self, textures, weights):
+        glEnable(GL_TEXTURE_2D)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+        glBlendFunc(GL_ONE, GL_ONE)
+        for i, (texture, weight) in enumerate(zip(textures, weights)):
+            # The first quad replaces what is there, the rest add to it
+            if i == 1:
+                glEnable(GL_BLEND)
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glColor4f(weight, weight, weight, weight)
+            _fullscreen_quad()
+
+    def delete(self):
+        """free the textures, framebuffer and shader"""
+        self.target.delete()
+        if self._program:
+            glDeleteProgram(self._program)
+            self._program = None
+
+
+def _fullscreen_quad():
+    glBegin(GL_QUADS)
+    glTexCoord2f(0.0, 0.0); glVertex2f(-1.0, -1.0)
+    glTexCoord2f(1.0, 0.0); glVertex2f(1.0, -1.0)
+    glTexCoord2f(1.0, 1.0); glVertex2f(1.0, 1.0)
+    glTexCoord2f(0.0, 1.0); glVertex2f(-1.0, 1.0)
+    glEnd()
+
+
+if __name__ == '__main__':
+    print 'composite shader sums every frame in the ring'
+    src = _composite_shader(3)
+    assert 'uniform sampler2D frames[3];' in src
+    assert src.count('texture2D') == 3
@@ -0,0 +1,250 @@
+"""
+Point-sprite particle system with vectorized simulation.
+
+Particle state lives in contiguous numpy arrays, one row per particle, with
+the live particles packed at the front. A frame's update is a handful of
+array operations no matter how many particles there are, and drawing is one
+glDrawArrays per point size class, or a single draw when each vertex
+carries its own point size (GL 2.0 vertex program point size).
+
+    stars = ParticleSystem(dims=2)
+    stars.emit(positions, sizes=7.0)
+    ...
+    stars.update(dt)
+    stars.draw()
+
+Texturing and GL_POINT_SPRITE state are left to the caller, so the existing
+star.tga sprite setup in the demos applies unchanged. Given a
+streambuffer.StreamBuffer, draw streams the arrays through it instead of
+drawing from client memory.
+"""
+
+
+import ctypes
+
+import numpy
+from OpenGL.GL import *
+
+
+# Per-vertex point size shader. Only the vertex stage is replaced; fragments
+# still go through the fixed function texture environment, so point sprite
+# texture coordinate replacement works as before.
+_SIZE_VERTEX_SHADER = """
+#version 110
+attribute float size;
+void main()
+{
+    gl_Position = ftransform();
+    gl_PointSize = size;
+    gl_FrontColor = gl_Color;
+    gl_TexCoord[0] = gl_MultiTexCoord0;
+}
+"""
+
+
+class ParticleSystem(object):
+    """A pool of point particles.
+
+    dims -> 2 or 3 coordinates per particle
+    capacity -> initial number of particle slots; grows as needed
+    stream -> optional StreamBuffer to draw from; its owner calls
+        end_frame after the frame's draws
+
+    Arrays, valid for the first count rows:
+    position -> (capacity, dims) float32
+    velocity -> (capacity, dims) float32, units per second
+    size -> (capacity,) float32 point size in pixels
+    life -> (capacity,) float32 seconds left to live; inf lives forever
+    """
+
+    def __init__(self, dims=3, capacity=1024, stream=None):
+        self.dims = dims
+        self.stream = stream
+        self.count = 0
+        self.position = numpy.zeros((capacity, dims), numpy.float32)
+        self.velocity = numpy.zeros((capacity, dims), numpy.float32)
+        self.size = numpy.ones(capacity, numpy.float32)
+        self.life = numpy.zeros(capacity, numpy.float32)
+        # Draw order by size class, rebuilt when particles come or go
+        self._order = None
+        self._classes = None
+        self._sorted = None
+        self._program = None
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, need):
+        capacity = len(self.size)
+        while capacity < need:
+            capacity *= 2
+        def grown(a):
+            b = numpy.zeros((capacity,) + a.shape[1:], a.dtype)
+            b[:self.count] = a[:self.count]
+            return b
+        self.position = grown(self.position)
+        self.velocity = grown(self.velocity)
+        self.size = grown(self.size)
+        self.life = grown(self.life)
+
+    def emit(self, positions, velocities=0.0, sizes=1.0, lives=numpy.inf):
+        """add particles
+
+        positions -> (n, dims) array-like of starting positions
+        velocities -> (n, dims) array-like, or anything that broadcasts to it
+        sizes -> (n,) point sizes, or one size for all
+        lives -> (n,) lifetimes in seconds, or one for all
+        """
+        positions = numpy.asarray(positions, numpy.float32).reshape(-1, self.dims)
+        n = len(positions)
+        start, end = self.count, self.count + n
+        if end > len(self.size):
+            self._grow(end)
+        self.position[start:end] = positions
+        self.velocity[start:end] = velocities
+        self.size[start:end] = sizes
+        self.life[start:end] = lives
+        self.count = end
+        self._order = None
+
+    def update(self, dt, acceleration=None):
+        """advance the simulation by dt seconds
+
+        acceleration -> optional (dims,) or (count, dims) acceleration
+        Particles whose life runs out are removed.
+        """
+        n = self.count
+        if not n:
+            return
+        pos = self.position[:n]
+        vel = self.velocity[:n]
+        if acceleration is not None:
+            vel += numpy.asarray(acceleration, numpy.float32) * dt
+        pos += vel * dt
+        life = self.life[:n]
+        life -= dt
+        alive = life > 0.0
+        if not alive.all():
+            k = int(alive.sum())
+            for a in (self.position, self.velocity, self.size, self.life):
+                a[:k] = a[:n][alive]
+            self.count = k
+            self._order = None
+
+    def wrap(self, lower, upper):
+        """wrap positions into the box lower..upper on every axis, so
+        particles leaving one side come back on the other"""
+        lower = numpy.asarray(lower, numpy.float32)
+        extent = numpy.asarray(upper, numpy.float32) - lower
+        pos = self.position[:self.count]
+        pos -= lower
+        numpy.mod(pos, extent, pos)
+        pos += lower
+
+    def _sort_by_size(self):
+        """group particles by point size for drawing"""
+        n = self.count
+        order = numpy.argsort(self.size[:n], kind='mergesort')
+        sizes = self.size[:n][order]
+        starts = numpy.flatnonzero(numpy.diff(sizes)) + 1
+        firsts = numpy.concatenate(([0], starts))
+        counts = numpy.diff(numpy.concatenate((firsts, [n])))
+        self._order = order
+        self._classes = [(float(sizes[f]), int(f), int(c))
+                         for f, c in zip(firsts, counts)]
+
+    def draw(self, per_vertex_size=False):
+        """draw every live particle as a point
+
+        per_vertex_size -> use a vertex shader that takes the point size
+            from each particle, making the whole system a single draw.
+            Otherwise there is one glPointSize and glDrawArrays per distinct
+            size.
+        """
+        n = self.count
+        if not n:
+            return
+        glEnableClientState(GL_VERTEX_ARRAY)
+        if per_vertex_size:
+            self._draw_per_vertex(n)
+        else:
+            if self._order is None:
+                self._sort_by_size()
+            if len(self._classes) == 1:
+                positions = self.position[:n]
+            else:
+                if self._sorted is None or len(self._sorted) < n:
+                    self._sorted = numpy.empty_like(self.position)
+                positions = self._sorted[:n]
+                numpy.take(self.position[:n], self._order, axis=0, out=positions)
+            self._pointer(positions, self._vertex_pointer)
+            for size, first, count in self._classes:
+                glPointSize(size)
+                glDrawArrays(GL_POINTS, first, count)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+    def _draw_per_vertex(self, n):
+        if self._program is None:
+            from OpenGL.GL import shaders
+            self._program = shaders.compileProgram(
+                shaders.compileShader(_SIZE_VERTEX_SHADER, GL_VERTEX_SHADER))
+            self._size_attrib = glGetAttribLocation(self._program, 'size')
+        glUseProgram(self._program)
+        glEnable(GL_VERTEX_PROGRAM_POINT_SIZE)
+        glEnableVertexAttribArray(self._size_attrib)
+        self._pointer(self.size[:n], self._size_pointer)
+        self._pointer(self.position[:n], self._vertex_pointer)
+        glDrawArrays(GL_POINTS, 0, n)
+        glDisableVertexAttribArray(self._size_attrib)
+        glDisable(GL_VERTEX_PROGRAM_POINT_SIZE)
+        glUseProgram(0)
+
+    def _pointer(self, data, pointer):
+        """point an array at data, through the stream if there is one"""
+        if self.stream is None:
+            pointer(data)
+            return
+        vbo, offset = self.stream.write(data)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        pointer(ctypes.c_void_p(offset))
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _vertex_pointer(self, ptr):
+        glVertexPointer(self.dims, GL_FLOAT, 0, ptr)
+
+    def _size_pointer(self, ptr):
+        glVertexAttribPointer(self._size_attrib, 1, GL_FLOAT, GL_FALSE, 0, ptr)
+
+
+if __name__ == '__main__':
+    import time
+
+    print 'particles move with their velocity and die when their life is up'
+    p = ParticleSystem(dims=2, capacity=2)
+    p.emit([[0, 0], [1, 1], [2, 2]], velocities=[1, 0], sizes=[3, 1, 3], lives=[1.0, 5.0, 5.0])
+    p.update(0.5)
+    assert len(p) == 3
+    assert p.position[0].tolist() == [0.5, 0.0]
+    p.update(0.75)
+    assert len(p) == 2
+    assert p.position[:2, 1].tolist() == [1.0, 2.0]
+
+    print 'size classes group particles by point size'
+    p.emit([[5, 5]], sizes=1)
+    p._sort_by_size()
+    assert [(s, c) for s, f, c in p._classes] == [(1.0, 2), (3.0, 1)]
+
+    print 'wrap brings particles back into the box'
+    p.position[0] = (-1.0, 11.0)
+    p.wrap((0, 0), (10, 10))
+    assert p.position[0].tolist() == [9.0, 1.0]
+
+    n = 100000
+    p = ParticleSystem(dims=2, capacity=n)
+    p.emit(numpy.random.rand(n, 2) * 800, numpy.random.rand(n, 2) - 0.5,
+           numpy.random.choice([7.0, 12.0, 20.0], n))
+    t = time.time()
+    for i in range(60):
+        p.update(1.0 / 60.0, (0.0, -1.0))
+        p.wrap((0, 0), (800, 600))
+    print '%d particles: %.2f ms per update' % (n, (time.time() - t) * 1000.0 / 60)
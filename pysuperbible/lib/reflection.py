@@ -0,0 +1,132 @@
+"""
+Planar reflections rendered to a texture.
+
+The stencil-free way to draw a mirror floor is to draw the world twice,
+once scaled by -1 in y. PlanarReflection instead draws the mirrored world
+into an offscreen texture at a fraction of the window resolution, and only
+every Nth frame if asked, then maps that texture onto the floor. Since the
+mirror is drawn from the same camera, a point on the floor finds its
+reflection at its own position on screen; the floor's texture coordinates
+are generated from eye space through the projection matrix, so nothing
+about the floor geometry has to change.
+
+    mirror = PlanarReflection(width, height, scale=0.5, interval=2)
+    ...
+    def on_draw(self):
+        mirror.update(self._draw_world)
+        mirror.begin_surface()
+        ...draw floor...
+        mirror.end_surface()
+        self._draw_world()
+"""
+
+
+from OpenGL.GL import *
+
+from rendertarget import RenderTarget
+
+
+class PlanarReflection(object):
+    """A mirror in the plane y = height.
+
+    width, height -> window size
+    scale -> fraction of the window resolution to render the mirror at
+    interval -> render the mirror every interval frames, reusing the last
+        image in between
+    strength -> how much of the reflection shows through the floor color,
+        0.0 to 1.0
+    y -> height of the mirror plane
+    """
+
+    def __init__(self, width, height, scale=0.5, interval=1, strength=0.5, y=0.0):
+        self.scale = scale
+        self.interval = interval
+        self.strength = strength
+        self.y = y
+        self.target = RenderTarget(int(width * scale), int(height * scale))
+        self._frame = 0
+        self._projection = None
+
+    def resize(self, width, height):
+        self.target.resize(int(width * self.scale), int(height * self.scale))
+        # The old image no longer lines up with the window
+        self._frame = 0
+
+    def update(self, draw):
+        """render the reflection if it is due this frame
+
+        draw -> function drawing the world in world coordinates, with the
+            current modelview as the camera. It is called with the world
+            mirrored in the plane and the front face flipped to GL_CW.
+        """
+        due = self._frame % self.interval == 0
+        self._frame += 1
+        if not due:
+            return
+        self._projection = glGetFloatv(GL_PROJECTION_MATRIX)
+        with self.target:
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            glPushMatrix()
+            # Only what is in front of the mirror is reflected, which after
+            # the flip lies below the plane
+            glClipPlane(GL_CLIP_PLANE0, (0.0, -1.0, 0.0, self.y))
+            glEnable(GL_CLIP_PLANE0)
+            glTranslatef(0.0, self.y, 0.0)
+            glScalef(1.0, -1.0, 1.0)
+            glTranslatef(0.0, -self.y, 0.0)
+            glFrontFace(GL_CW)
+            draw()
+            glFrontFace(GL_CCW)
+            glDisable(GL_CLIP_PLANE0)
+            glPopMatrix()
+
+    def begin_surface(self):
+        """set up texture unit 0 so the geometry drawn until end_surface
+        shows the reflection blended with its own color"""
+        glPushAttrib(GL_ENABLE_BIT | GL_TEXTURE_BIT)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, self.target.texture)
+
+        # color = reflection * strength + primary color * (1 - strength)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_COMBINE)
+        glTexEnvi(GL_TEXTURE_ENV, GL_COMBINE_RGB, GL_INTERPOLATE)
+        glTexEnvi(GL_TEXTURE_ENV, GL_SOURCE0_RGB, GL_TEXTURE)
+        glTexEnvi(GL_TEXTURE_ENV, GL_SOURCE1_RGB, GL_PRIMARY_COLOR)
+        glTexEnvi(GL_TEXTURE_ENV, GL_SOURCE2_RGB, GL_CONSTANT)
+        glTexEnvi(GL_TEXTURE_ENV, GL_OPERAND2_RGB, GL_SRC_ALPHA)
+        glTexEnvfv(GL_TEXTURE_ENV, GL_TEXTURE_ENV_COLOR, (0.0, 0.0, 0.0, self.strength))
+
+        # Eye space planes given under an identity modelview make the
+        # texture coordinates the eye space position of each vertex
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+        for coord, gen, plane in ((GL_S, GL_TEXTURE_GEN_S, (1.0, 0.0, 0.0, 0.0)),
+                                  (GL_T, GL_TEXTURE_GEN_T, (0.0, 1.0, 0.0, 0.0)),
+                                  (GL_R, GL_TEXTURE_GEN_R, (0.0, 0.0, 1.0, 0.0)),
+                                  (GL_Q, GL_TEXTURE_GEN_Q, (0.0, 0.0, 0.0, 1.0))):
+            glTexGeni(coord, GL_TEXTURE_GEN_MODE, GL_EYE_LINEAR)
+            glTexGenfv(coord, GL_EYE_PLANE, plane)
+            glEnable(gen)
+        glPopMatrix()
+
+        # ...and the texture matrix takes them to window coordinates, 0..1,
+        # through the projection the mirror was rendered with
+        glMatrixMode(GL_TEXTURE)
+        glPushMatrix()
+        glLoadIdentity()
+        glTranslatef(0.5, 0.5, 0.5)
+        glScalef(0.5, 0.5, 0.5)
+        if self._projection is not None:
+            glMultMatrixf(self._projection)
+        glMatrixMode(GL_MODELVIEW)
+
+    def end_surface(self):
+        """undo begin_surface"""
+        glMatrixMode(GL_TEXTURE)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopAttrib()
+
+    def delete(self):
+        self.target.delete()
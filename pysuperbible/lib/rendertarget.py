@@ -0,0 +1,121 @@
+"""
+Offscreen render targets.
+
+A RenderTarget is a framebuffer object that renders into color textures,
+with a depth renderbuffer of its own. It can hold several color textures
+and attach any one of them, so a ring of frames or a pair of ping-pong
+buffers shares one framebuffer and one depth buffer. Uses the
+EXT_framebuffer_object entry points, which every GL 2.x driver has.
+
+    target = RenderTarget(256, 256)
+    with target:
+        ...draw...
+    glBindTexture(GL_TEXTURE_2D, target.texture)
+"""
+
+
+from OpenGL.GL import *
+from OpenGL.GL.EXT.framebuffer_object import *
+
+
+class RenderTargetError(Exception):
+    def __init__(self, message):
+        self.value = message
+    def __str__(self):
+        return str(self.value)
+
+
+class RenderTarget(object):
+    """A framebuffer object rendering into textures.
+
+    width, height -> size in pixels
+    textures -> number of color textures that can be attached in turn
+    depth -> give the target a depth buffer
+    filter -> texture min and mag filter
+    """
+
+    def __init__(self, width, height, textures=1, depth=True, filter=GL_LINEAR):
+        self.width = self.height = 0
+        self.current = 0
+        self.fbo = glGenFramebuffersEXT(1)
+        self.textures = [glGenTextures(1) for i in range(textures)]
+        for texture in self.textures:
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, filter)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, filter)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        self.depth = glGenRenderbuffersEXT(1) if depth else None
+        self._viewport = None
+        self.resize(width, height)
+
+    @property
+    def texture(self):
+        """the attached color texture"""
+        return self.textures[self.current]
+
+    def resize(self, width, height):
+        """reallocate the textures and depth buffer; contents are lost"""
+        width, height = max(1, width), max(1, height)
+        if (width, height) == (self.width, self.height):
+            return
+        self.width, self.height = width, height
+        for texture in self.textures:
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0,
+                GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        glBindFramebufferEXT(GL_FRAMEBUFFER_EXT, self.fbo)
+        if self.depth is not None:
+            glBindRenderbufferEXT(GL_RENDERBUFFER_EXT, self.depth)
+            glRenderbufferStorageEXT(GL_RENDERBUFFER_EXT, GL_DEPTH_COMPONENT24,
+                width, height)
+            glBindRenderbufferEXT(GL_RENDERBUFFER_EXT, 0)
+            glFramebufferRenderbufferEXT(GL_FRAMEBUFFER_EXT, GL_DEPTH_ATTACHMENT_EXT,
+                GL_RENDERBUFFER_EXT, self.depth)
+        glFramebufferTexture2DEXT(GL_FRAMEBUFFER_EXT, GL_COLOR_ATTACHMENT0_EXT,
+            GL_TEXTURE_2D, self.texture, 0)
+        status = glCheckFramebufferStatusEXT(GL_FRAMEBUFFER_EXT)
+        glBindFramebufferEXT(GL_FRAMEBUFFER_EXT, 0)
+        if status != GL_FRAMEBUFFER_COMPLETE_EXT:
+            raise RenderTargetError('framebuffer incomplete: 0x%04x' % status)
+
+    def attach(self, i):
+        """render into texture i from now on"""
+        if i == self.current:
+            return
+        self.current = i
+        glBindFramebufferEXT(GL_FRAMEBUFFER_EXT, self.fbo)
+        glFramebufferTexture2DEXT(GL_FRAMEBUFFER_EXT, GL_COLOR_ATTACHMENT0_EXT,
+            GL_TEXTURE_2D, self.texture, 0)
+        glBindFramebufferEXT(GL_FRAMEBUFFER_EXT, 0)
+
+    def bind(self):
+        """direct rendering into the target, with a viewport covering it"""
+        self._viewport = glGetIntegerv(GL_VIEWPORT)
+        glBindFramebufferEXT(GL_FRAMEBUFFER_EXT, self.fbo)
+        glViewport(0, 0, self.width, self.height)
+
+    def unbind(self):
+        """go back to the window framebuffer and its viewport"""
+        glBindFramebufferEXT(GL_FRAMEBUFFER_EXT, 0)
+        if self._viewport is not None:
+            glViewport(*self._viewport)
+            self._viewport = None
+
+    def __enter__(self):
+        self.bind()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unbind()
+
+    def delete(self):
+        """free the framebuffer, textures and depth buffer"""
+        glDeleteFramebuffersEXT(1, [self.fbo])
+        glDeleteTextures(self.textures)
+        if self.depth is not None:
+            glDeleteRenderbuffersEXT(1, [self.depth])
+        self.textures = []
@@ -0,0 +1,323 @@
+"""
+A ring buffer for vertex data that changes every frame.
+
+Dynamic geometry (CPU transformed positions, toon texture coordinates,
+particles) is rewritten every frame while the GPU may still be drawing last
+frame's copy. Giving each mesh its own buffer object and respecifying it
+every frame works, but costs a buffer object per mesh and a reallocation
+per write. A StreamBuffer is one buffer object that any number of producers
+write into, one after another, wrapping around at the end:
+
+    stream = StreamBuffer()
+    ...
+    def on_draw(self):
+        vbo, offset = stream.write(positions)
+        mesh.draw(positions=(vbo, offset, 3))
+        ...
+        stream.end_frame()
+
+With GL 3.2 or ARB_sync, writes go through glMapBufferRange without
+synchronization, and end_frame drops a fence after the frame's draws; a
+write that comes around to a region still in use waits on that region's
+fence, which a ring of a few frames' data never has to. Without them the
+buffer is orphaned at each wrap instead, so the driver hands out fresh
+storage and frees the old when the GPU is done with it, and writes are
+glBufferSubData. Either way a frame that needs more than the whole ring
+grows it.
+
+What write returns is good until the data has been drawn, for the rest of
+the frame; a region is reused only after a later end_frame. A producer
+that owns a stream of its own can call end_frame at the start of each
+write, once its previous draw has been issued.
+"""
+
+
+import collections
+import ctypes
+
+import numpy
+from OpenGL.GL import *
+
+
+class StreamBufferError(Exception):
+    def __init__(self, message):
+        self.value = message
+    def __str__(self):
+        return str(self.value)
+
+
+# Every write starts on this boundary, which suits any vertex attribute
+ALIGN = 64
+
+# Nanoseconds per glClientWaitSync, between checks
+_WAIT = 1000000
+
+
+def _align(n):
+    return (n + ALIGN - 1) & ~(ALIGN - 1)
+
+
+class StreamBuffer(object):
+    """One buffer object that per-frame data is streamed through.
+
+    size -> bytes of storage to start with
+    target -> GL_ARRAY_BUFFER, or GL_ELEMENT_ARRAY_BUFFER for indices
+    mode -> 'sync' to map without synchronization and fence each frame,
+        'orphan' to write with glBufferSubData and orphan at each wrap;
+        by default 'sync' where glFenceSync and glMapBufferRange exist
+
+    vbo -> the buffer object; changes when the ring grows
+    stalls -> times a write had to wait for the GPU
+    wraps -> times writing came around to the start
+    """
+
+    def __init__(self, size=1 << 20, target=GL_ARRAY_BUFFER, mode=None):
+        if mode is None:
+            mode = 'sync' if bool(glFenceSync) and bool(glMapBufferRange) else 'orphan'
+        if mode not in ('sync', 'orphan'):
+            raise StreamBufferError('unknown mode %r' % (mode,))
+        self.mode = mode
+        self.target = target
+        self.vbo = None
+        self.size = 0
+        self.head = 0
+        self.stalls = 0
+        self.wraps = 0
+        # (fence, [(start, end)]) per finished frame, oldest first
+        self._pending = collections.deque()
+        # Regions written since the last end_frame
+        self._frame = []
+        # Buffers outgrown this frame, deleted once its draws are issued
+        self._retired = []
+        self._allocate(_align(size))
+
+    def _allocate(self, size):
+        self.vbo = glGenBuffers(1)
+        self.size = size
+        self.head = 0
+        glBindBuffer(self.target, self.vbo)
+        glBufferData(self.target, size, None, GL_STREAM_DRAW)
+        glBindBuffer(self.target, 0)
+
+    def _grow(self, need):
+        """move to a buffer big enough for this frame's data and need more
+        bytes; the old one lives until the end of the frame"""
+        used = sum(end - start for start, end in self._frame)
+        size = self.size
+        while size < 2 * (used + need):
+            size *= 2
+        self._retired.append(self.vbo)
+        self._drop_fences()
+        self._frame = []
+        self._allocate(size)
+
+    def write(self, data):
+        """copy an array into the ring; returns (vbo, byte offset) to draw
+        it from"""
+        data = numpy.ascontiguousarray(data)
+        n = data.nbytes
+        start = self._reserve(n)
+        glBindBuffer(self.target, self.vbo)
+        if self.mode == 'sync':
+            pointer = glMapBufferRange(self.target, start, n, GL_MAP_WRITE_BIT |
+                GL_MAP_INVALIDATE_RANGE_BIT | GL_MAP_UNSYNCHRONIZED_BIT)
+            ctypes.memmove(ctypes.cast(pointer, ctypes.c_void_p).value,
+                           data.ctypes.data, n)
+            glUnmapBuffer(self.target)
+        else:
+            glBufferSubData(self.target, start, n, data)
+        glBindBuffer(self.target, 0)
+        return self.vbo, start
+
+    def _reserve(self, n):
+        """return the offset of n free bytes, waiting, wrapping or growing
+        as needed"""
+        start = self.head
+        if start + n > self.size:
+            if n > self.size:
+                self._grow(n)
+                start = 0
+            else:
+                self.wraps += 1
+                start = 0
+                if self.mode == 'orphan':
+                    glBindBuffer(self.target, self.vbo)
+                    glBufferData(self.target, self.size, None, GL_STREAM_DRAW)
+                    glBindBuffer(self.target, 0)
+                    # The frame's earlier data went with the old storage
+                    self._frame = []
+        end = start + n
+        if self.mode == 'sync':
+            if _overlaps(self._frame, start, end):
+                # This frame alone fills the ring
+                self._grow(n)
+                start, end = 0, n
+            else:
+                self._wait(start, end)
+        if self._frame and self._frame[-1][1] == start:
+            self._frame[-1] = (self._frame[-1][0], end)
+        else:
+            self._frame.append((start, end))
+        self.head = _align(end)
+        return start
+
+    def _wait(self, start, end):
+        """wait until the GPU is done with earlier frames' data in the
+        range"""
+        last = None
+        for i, (fence, regions) in enumerate(self._pending):
+            if _overlaps(regions, start, end):
+                last = i
+        if last is None:
+            return
+        # Fences signal in order, so the newest one covers the older ones
+        for i in range(last + 1):
+            fence, regions = self._pending.popleft()
+            if i == last:
+                self._client_wait(fence)
+            glDeleteSync(fence)
+
+    def _client_wait(self, fence):
+        result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 0)
+        if result == GL_TIMEOUT_EXPIRED:
+            self.stalls += 1
+            while result == GL_TIMEOUT_EXPIRED:
+                result = glClientWaitSync(fence, 0, _WAIT)
+        if result == GL_WAIT_FAILED:
+            raise StreamBufferError('glClientWaitSync failed')
+
+    def end_frame(self):
+        """mark the data written so far as drawn once the GPU gets past the
+        commands issued so far; call after the frame's draws"""
+        if self._frame and self.mode == 'sync':
+            self._pending.append(
+                (glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0), self._frame))
+        self._frame = []
+        if self._retired:
+            glDeleteBuffers(len(self._retired), self._retired)
+            self._retired = []
+
+    def _drop_fences(self):
+        while self._pending:
+            glDeleteSync(self._pending.popleft()[0])
+
+    def delete(self):
+        """free the buffer objects and fences"""
+        self._drop_fences()
+        self._frame = []
+        names = self._retired + ([self.vbo] if self.vbo is not None else [])
+        if names:
+            glDeleteBuffers(len(names), names)
+        self._retired = []
+        self.vbo = None
+
+
+def _overlaps(regions, start, end):
+    for s, e in regions:
+        if s < end and start < e:
+            return True
+    return False
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Stand-ins for GL, with buffer storage in host memory
+    log = []
+    storage = {}
+    fences = {}
+    names = iter(range(1, 100))
+    bound = {}
+    def glGenBuffers(n):
+        return next(names)
+    def glBindBuffer(target, vbo):
+        bound[target] = vbo
+    def glBufferData(target, size, data, usage):
+        log.append(('glBufferData', bound[target], size))
+        storage[bound[target]] = ctypes.create_string_buffer(size)
+    def glBufferSubData(target, offset, size, data):
+        ctypes.memmove(ctypes.addressof(storage[bound[target]]) + offset,
+                       data.ctypes.data, size)
+    def glMapBufferRange(target, offset, size, access):
+        return ctypes.addressof(storage[bound[target]]) + offset
+    def glUnmapBuffer(target):
+        return True
+    # The GPU runs two frames behind: a fence signals once two newer ones
+    # have been made, or after waiting
+    made = [0]
+    def glFenceSync(condition, flags):
+        made[0] += 1
+        fences[made[0]] = False
+        return made[0]
+    def glClientWaitSync(fence, flags, timeout):
+        log.append(('wait', fence))
+        if not fences[fence] and fence > made[0] - 2:
+            fences[fence] = True
+            return GL_TIMEOUT_EXPIRED
+        return GL_CONDITION_SATISFIED
+    def glDeleteSync(fence):
+        del fences[fence]
+    def glDeleteBuffers(n, vbos):
+        log.append(('glDeleteBuffers', list(vbos)))
+    module = sys.modules[__name__]
+    for f in (glGenBuffers, glBindBuffer, glBufferData, glBufferSubData,
+              glMapBufferRange, glUnmapBuffer, glFenceSync, glClientWaitSync,
+              glDeleteSync, glDeleteBuffers):
+        setattr(module, f.__name__, f)
+
+    def read(vbo, offset, like):
+        return numpy.frombuffer(storage[vbo], like.dtype, like.size, offset)
+
+    print 'producers share the ring, each write aligned'
+    stream = StreamBuffer(1024, mode='sync')
+    a = numpy.arange(30, dtype=numpy.float32)      # 120 bytes
+    b = numpy.arange(10, dtype=numpy.uint32)
+    vbo, offset_a = stream.write(a)
+    vbo, offset_b = stream.write(b)
+    assert (offset_a, offset_b) == (0, 128)
+    assert (read(vbo, offset_a, a) == a).all() and (read(vbo, offset_b, b) == b).all()
+    stream.end_frame()
+
+    print 'coming around waits only on the frames still in the way'
+    for frame in range(4):
+        stream.write(a)
+        stream.write(a)
+        stream.end_frame()
+    assert stream.wraps == 1 and stream.stalls == 0
+    waits = [entry for entry in log if entry[0] == 'wait']
+    assert waits == [('wait', 1), ('wait', 2)], waits
+    assert len(stream._pending) == 3
+
+    print 'a frame bigger than the ring grows it'
+    del log[:]
+    for i in range(10):
+        vbo, offset = stream.write(a)
+    # The frame caught up with the two frames the GPU is still drawing
+    assert stream.stalls == 2
+    assert stream.size == 4096 and vbo == 2
+    assert (read(vbo, offset, a) == a).all()
+    stream.end_frame()
+    assert ('glDeleteBuffers', [1]) in log
+
+    print 'a write bigger than the ring goes at the start of the new one'
+    for mode in ('sync', 'orphan'):
+        stream = StreamBuffer(128, mode=mode)
+        stream.write(b)
+        c = numpy.arange(300, dtype=numpy.float32)
+        vbo, offset = stream.write(c)
+        assert offset == 0 and stream.size >= 2 * c.nbytes
+        assert (read(vbo, offset, c) == c).all()
+        stream.end_frame()
+        stream.delete()
+
+    print 'without fences the ring is orphaned at each wrap'
+    del log[:]
+    made_before = made[0]
+    stream = StreamBuffer(128, mode='orphan')
+    for frame in range(3):
+        vbo, offset = stream.write(a)
+        stream.end_frame()
+    assert [entry[0] for entry in log] == ['glBufferData'] * 3
+    assert stream.wraps == 2 and offset == 0 and made[0] == made_before
+    assert (read(vbo, offset, a) == a).all()
+    stream.delete()
@@ -0,0 +1,321 @@
+"""
+Paged heightmap terrain with distance-based level of detail.
+
+A terrain file holds a heightmap cut into square chunks, each stored as one
+contiguous tile of 16-bit samples (edge samples are repeated in both
+neighbors), so that reading a chunk touches only its own pages of the
+mmapped file. Only chunks within view of the camera are resident:
+
+    terrain = Terrain('valley.wkhm', view_distance=400.0)
+    ...
+    terrain.update(frameCamera)     # once per frame
+    terrain.draw()
+
+update() picks a level of detail for every chunk in range from its
+distance to the camera, hands the chunks that need a new mesh to a worker
+thread, uploads a bounded number of finished meshes, and frees chunks that
+have gone out of range. Level k of a chunk uses every 2**k-th sample. Where
+a chunk meets a coarser neighbor, its edge samples are pulled onto the
+neighbor's coarser edge line, so there are no cracks between levels.
+
+Memory and frame cost depend on view_distance, not on the size of the
+terrain: the file is paged in by the OS as chunks are read, and the number
+of resident chunks is bounded by the view range.
+"""
+
+
+import mmap
+import Queue
+import struct
+import threading
+
+import numpy
+from OpenGL.GL import *
+
+from ground import grid_normals
+from mesh import Mesh, grid_indices
+
+
+_MAGIC = 'WKHM'
+_VERSION = 1
+# magic, version, chunks_x, chunks_z, chunk_cells, spacing, base, scale
+_HEADER = struct.Struct('<4sIIIIfff')
+
+
+class TerrainError(Exception):
+    def __init__(self, message):
+        self.value = message
+    def __str__(self):
+        return str(self.value)
+
+
+def write_heightmap(filename, heights, chunk_cells, spacing=1.0):
+    """write a terrain file
+
+    heights -> (rows, cols) heights, rows along z, where rows - 1 and
+        cols - 1 are multiples of chunk_cells
+    chunk_cells -> cells along a side of a chunk; a power of two
+    spacing -> distance between samples
+    """
+    heights = numpy.asarray(heights, numpy.float64)
+    rows, cols = heights.shape
+    if (rows - 1) % chunk_cells or (cols - 1) % chunk_cells:
+        raise TerrainError('heightmap is not a whole number of chunks')
+    chunks_z, chunks_x = (rows - 1) // chunk_cells, (cols - 1) // chunk_cells
+    base = heights.min()
+    scale = max(heights.max() - base, 1e-6) / 65535.0
+    samples = numpy.round((heights - base) / scale).astype('<u2')
+
+    f = open(filename, 'wb')
+    try:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, chunks_x, chunks_z, chunk_cells,
+                             spacing, base, scale))
+        n = chunk_cells
+        for j in range(chunks_z):
+            for i in range(chunks_x):
+                f.write(samples[j*n:j*n + n + 1, i*n:i*n + n + 1].tostring())
+    finally:
+        f.close()
+
+
+class HeightmapFile(object):
+    """A terrain file, mapped read-only.
+
+    chunks_x, chunks_z -> number of chunks along x and z
+    chunk_cells -> cells along a side of a chunk
+    spacing -> distance between samples
+    """
+
+    def __init__(self, filename):
+        f = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if len(self._map) < _HEADER.size:
+            raise TerrainError('%s: not a terrain file' % filename)
+        (magic, version, self.chunks_x, self.chunks_z, self.chunk_cells,
+         self.spacing, self.base, self.scale) = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC or version != _VERSION:
+            raise TerrainError('%s: not a terrain file' % filename)
+        side = self.chunk_cells + 1
+        self._tiles = numpy.frombuffer(self._map, '<u2',
+            self.chunks_x * self.chunks_z * side * side,
+            _HEADER.size).reshape(self.chunks_z, self.chunks_x, side, side)
+
+    @property
+    def chunk_size(self):
+        """world size of a chunk"""
+        return self.chunk_cells * self.spacing
+
+    def chunk(self, i, j):
+        """return the (chunk_cells + 1, chunk_cells + 1) heights of chunk
+        i along x and j along z, rows along z"""
+        return self._tiles[j, i] * numpy.float32(self.scale) + numpy.float32(self.base)
+
+    def close(self):
+        self._tiles = None
+        self._map.close()
+
+
+def stitch_edges(heights, ratios):
+    """pull the edge samples of a chunk onto coarser neighbors' edges
+
+    heights -> (m + 1, m + 1) samples of the chunk at its own level,
+        modified in place
+    ratios -> (west, east, north, south) neighbor stride over this
+        chunk's stride, 1 where the neighbor is no coarser. West and east
+        are columns 0 and m; north and south are rows 0 and m.
+    """
+    m = heights.shape[0] - 1
+    idx = numpy.arange(m + 1)
+    for edge, k in zip((heights[:, 0], heights[:, m], heights[0, :], heights[m, :]),
+                       ratios):
+        if k <= 1:
+            continue
+        lo = idx // k * k
+        hi = numpy.minimum(lo + k, m)
+        t = ((idx - lo) / float(k)).astype(numpy.float32)
+        edge[:] = edge[lo] * (1.0 - t) + edge[hi] * t
+
+
+def build_chunk(heights, spacing, stride, ratios, x0, z0):
+    """return (positions, normals, indices) arrays for a chunk mesh
+
+    heights -> full resolution (n + 1, n + 1) chunk samples
+    stride -> sample stride for this level
+    ratios -> neighbor stride ratios, as for stitch_edges
+    x0, z0 -> world position of the chunk's first sample
+    """
+    # Normals come from the full resolution samples, so shading does not
+    # swim much as levels change
+    normals = grid_normals(heights, spacing)[::stride, ::stride]
+    h = heights[::stride, ::stride].copy()
+    stitch_edges(h, ratios)
+    m = h.shape[0] - 1
+    coords = numpy.arange(m + 1) * (stride * spacing)
+    x, z = numpy.meshgrid(x0 + coords, z0 + coords)
+    positions = numpy.column_stack((x.ravel(), h.ravel(), z.ravel()))
+    return (positions.astype(numpy.float32), normals.reshape(-1, 3),
+            grid_indices(m, m))
+
+
+class Terrain(object):
+    """The resident part of a paged terrain.
+
+    filename -> terrain file written by write_heightmap
+    view_distance -> chunks further than this from the camera are not drawn
+        and are freed
+    levels -> levels of detail; level k uses every 2**k-th sample
+    lod_distance -> distance covered by each level; defaults to two chunks
+    origin -> world (x, y, z) of the first sample
+    uploads_per_frame -> most finished chunk meshes uploaded per update
+    """
+
+    def __init__(self, filename, view_distance=500.0, levels=4,
+                 lod_distance=None, origin=(0.0, 0.0, 0.0), uploads_per_frame=4):
+        self.heightmap = HeightmapFile(filename)
+        self.view_distance = view_distance
+        self.levels = max(1, min(levels, self.heightmap.chunk_cells.bit_length()))
+        self.lod_distance = lod_distance or 2.0 * self.heightmap.chunk_size
+        self.origin = numpy.asarray(origin, numpy.float32)
+        self.uploads_per_frame = uploads_per_frame
+        # (i, j) -> (key, Mesh) for chunks with a mesh on the GPU
+        self.resident = {}
+        # (i, j) -> key wanted this frame
+        self._wanted = {}
+        self._pending = set()
+        self._requests = Queue.Queue()
+        self._results = Queue.Queue()
+        self._thread = threading.Thread(target=self._build_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _chunk_levels(self, x, z):
+        """return {(i, j): level} for every chunk within view of (x, z)"""
+        hm = self.heightmap
+        size = hm.chunk_size
+        x -= self.origin[0]
+        z -= self.origin[2]
+        reach = int(self.view_distance // size) + 1
+        ci, cj = int(x // size), int(z // size)
+        i = numpy.arange(max(0, ci - reach), min(hm.chunks_x, ci + reach + 1))
+        j = numpy.arange(max(0, cj - reach), min(hm.chunks_z, cj + reach + 1))
+        if not len(i) or not len(j):
+            return {}
+        I, J = numpy.meshgrid(i, j)
+        # Distance from the camera to the nearest point of each chunk
+        dx = numpy.maximum(0.0, numpy.abs(x - (I + 0.5) * size) - 0.5 * size)
+        dz = numpy.maximum(0.0, numpy.abs(z - (J + 0.5) * size) - 0.5 * size)
+        d = numpy.sqrt(dx * dx + dz * dz)
+        near = d <= self.view_distance
+        level = numpy.minimum(self.levels - 1, (d / self.lod_distance).astype(int))
+        return dict(zip(zip(I[near].tolist(), J[near].tolist()), level[near].tolist()))
+
+    def update(self, camera):
+        """follow camera, a GLFrame: choose levels, queue chunk builds,
+        upload finished chunks and free those out of range"""
+        levels = self._chunk_levels(camera.GetOriginX(), camera.GetOriginZ())
+
+        wanted = {}
+        for (i, j), level in levels.items():
+            # Stitch to each neighbor that is drawn coarser
+            ratios = tuple(1 << max(0, levels.get(n, level) - level)
+                           for n in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)))
+            key = (level, ratios)
+            wanted[i, j] = key
+            current = self.resident.get((i, j))
+            if (current is None or current[0] != key) and (i, j, key) not in self._pending:
+                self._pending.add((i, j, key))
+                self._requests.put((i, j, key))
+        self._wanted = wanted
+
+        for ij in [ij for ij in self.resident if ij not in wanted]:
+            self.resident.pop(ij)[1].delete()
+
+        for n in range(self.uploads_per_frame):
+            try:
+                i, j, key, arrays = self._results.get_nowait()
+            except Queue.Empty:
+                break
+            self._pending.discard((i, j, key))
+            if arrays is None or wanted.get((i, j)) != key:
+                continue    # no longer wanted at this level
+            mesh = Mesh(GL_TRIANGLES, arrays[0], arrays[1], indices=arrays[2])
+            mesh.upload()
+            old = self.resident.get((i, j))
+            if old is not None:
+                old[1].delete()
+            self.resident[i, j] = (key, mesh)
+
+    def draw(self):
+        """draw every resident chunk"""
+        for key, mesh in self.resident.values():
+            mesh.draw()
+
+    def close(self):
+        """stop the builder thread and free every chunk"""
+        self._requests.put(None)
+        self._thread.join()
+        for key, mesh in self.resident.values():
+            mesh.delete()
+        self.resident = {}
+        self.heightmap.close()
+
+    # Builder thread
+    def _build_loop(self):
+        hm = self.heightmap
+        while True:
+            job = self._requests.get()
+            if job is None:
+                break
+            i, j, key = job
+            if self._wanted.get((i, j)) != key:
+                # Superseded while queued
+                self._results.put((i, j, key, None))
+                continue
+            level, ratios = key
+            x0 = self.origin[0] + i * hm.chunk_size
+            z0 = self.origin[2] + j * hm.chunk_size
+            heights = hm.chunk(i, j) + self.origin[1]
+            arrays = build_chunk(heights, hm.spacing, 1 << level, ratios, x0, z0)
+            self._results.put((i, j, key, arrays))
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    n = 16
+    rows, cols = 2 * n + 1, 3 * n + 1
+    z, x = numpy.mgrid[0:rows, 0:cols]
+    heights = numpy.sin(x * 0.3) * 4.0 + numpy.cos(z * 0.2) * 2.0
+    path = os.path.join(tempfile.mkdtemp(), 'test.wkhm')
+    write_heightmap(path, heights, n, spacing=2.0)
+
+    print 'chunks read back from the mapped file'
+    hm = HeightmapFile(path)
+    assert (hm.chunks_x, hm.chunks_z, hm.chunk_cells) == (3, 2, n)
+    assert hm.chunk_size == 32.0
+    assert numpy.allclose(hm.chunk(2, 1), heights[n:2*n + 1, 2*n:3*n + 1], atol=1e-3)
+
+    print 'a fine chunk stitched to a coarse neighbor shares its edge'
+    fine = build_chunk(hm.chunk(0, 0), hm.spacing, 1, (1, 2, 1, 1), 0.0, 0.0)[0]
+    coarse = build_chunk(hm.chunk(1, 0), hm.spacing, 2, (1, 1, 1, 1), 32.0, 0.0)[0]
+    fine_edge = fine.reshape(n + 1, n + 1, 3)[:, n]
+    coarse_edge = coarse.reshape(n // 2 + 1, n // 2 + 1, 3)[:, 0]
+    assert numpy.allclose(fine_edge[::2], coarse_edge)
+    assert numpy.allclose(fine_edge[1::2, 1], 0.5 * (coarse_edge[:-1, 1] + coarse_edge[1:, 1]))
+
+    print 'levels grow with distance and stop at the view distance'
+    t = Terrain(path, view_distance=60.0, levels=3, lod_distance=20.0)
+    levels = t._chunk_levels(16.0, 16.0)
+    assert levels[0, 0] == 0 and levels[1, 0] == 0 and levels[2, 0] == 2
+    levels = t._chunk_levels(-50.0, 16.0)
+    assert levels == {(0, 0): 2, (0, 1): 2}
+    t._requests.put(None)
+    t._thread.join()
+    hm.close()
+    t.heightmap.close()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
@@ -0,0 +1,262 @@
+"""
+On-disk cache of GL-ready mipmapped textures.
+
+The first time a texture is requested its source image is decoded, every
+mip level is built on the CPU with a 2x2 box filter, and all levels are
+packed into one cache file named by the SHA-1 of the source file. Later runs
+memory-map that file and hand each level straight to glTexImage2D, skipping
+both the image decode and the mipmap generation.
+
+Cache file layout (little endian):
+    header: magic 'WKTC', version, components, GL format, GL internal
+        format, number of levels
+    one (width, height, offset, nbytes) record per level
+    pixel data for each level at its offset, rows tightly packed
+"""
+
+
+import hashlib
+import mmap
+import os
+import struct
+
+import numpy
+from OpenGL.GL import *
+
+import tga
+
+
+# Where cache files are kept. Set this before loading textures to move it.
+cache_dir = os.path.join(os.path.expanduser('~'), '.worldkit', 'texcache')
+
+_MAGIC = 'WKTC'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIIIII')
+_LEVEL = struct.Struct('<IIII')
+_ALIGN = 16
+
+
+def file_hash(filename):
+    """return the hex SHA-1 digest of the contents of filename"""
+    h = hashlib.sha1()
+    f = open(filename, 'rb')
+    try:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            h.update(block)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def sources_hash(filenames, *extra):
+    """return a hex SHA-1 digest covering the contents of every file in
+    filenames and the repr of each of extra"""
+    h = hashlib.sha1()
+    for filename in filenames:
+        h.update(file_hash(filename))
+    for value in extra:
+        h.update(repr(value))
+    return h.hexdigest()
+
+
+def cache_path(filename):
+    """return the path of the cache file for the source image filename"""
+    return os.path.join(cache_dir, file_hash(filename) + '.wktc')
+
+
+def downsample(pixels):
+    """return the next mip level of pixels using a 2x2 box filter
+
+    pixels -> (height, width, components) uint8 numpy array
+    Odd rows or columns at the edge are dropped; a dimension that is already
+    1 is kept as is.
+    """
+    h, w = pixels.shape[:2]
+    nh, nw = max(1, h // 2), max(1, w // 2)
+    a = pixels.astype(numpy.uint16)
+    if h > 1:
+        a = a[0:2*nh:2] + a[1:2*nh:2]
+    else:
+        a = a * 2
+    if w > 1:
+        a = a[:, 0:2*nw:2] + a[:, 1:2*nw:2]
+    else:
+        a = a * 2
+    return ((a + 2) // 4).astype(numpy.uint8)
+
+
+def build_mip_chain(pixels):
+    """return a list of mip levels, from pixels down to 1x1
+
+    pixels -> (height, width, components) uint8 numpy array
+    """
+    levels = [pixels]
+    while pixels.shape[0] > 1 or pixels.shape[1] > 1:
+        pixels = downsample(pixels)
+        levels.append(pixels)
+    return levels
+
+
+def write_cache(path, levels, format, internal_format):
+    """pack levels into a cache file at path
+
+    levels -> list of (height, width, components) uint8 numpy arrays
+    format -> GL external format of the pixels
+    internal_format -> GL internal format to create the texture with
+    """
+    components = levels[0].shape[2]
+    offset = _HEADER.size + _LEVEL.size * len(levels)
+    records = []
+    for level in levels:
+        offset = (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+        h, w = level.shape[:2]
+        records.append((w, h, offset, level.nbytes))
+        offset += level.nbytes
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Write to a temporary name and rename, so a crashed or concurrent run
+    # never leaves a half-written cache file under the real name.
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, components, format,
+            internal_format, len(levels)))
+        for record in records:
+            f.write(_LEVEL.pack(*record))
+        for record, level in zip(records, levels):
+            f.seek(record[2])
+            f.write(numpy.ascontiguousarray(level).tostring())
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+class CachedTexture(object):
+    """A memory-mapped cache file.
+
+    components, format, internal_format -> as for tga.TGAImage
+    levels -> list of (width, height, data) per mip level, where data is a
+        read-only numpy view of the map
+    """
+
+    def __init__(self, path):
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        mm = self._map
+        (magic, version, self.components, self.format, self.internal_format,
+            nlevels) = _HEADER.unpack(mm[:_HEADER.size])
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise IOError('%s: not a version %d texture cache file' % (path, _VERSION))
+        self.levels = []
+        for i in range(nlevels):
+            start = _HEADER.size + i * _LEVEL.size
+            w, h, offset, nbytes = _LEVEL.unpack(mm[start:start + _LEVEL.size])
+            data = numpy.frombuffer(mm, numpy.uint8, nbytes, offset)
+            self.levels.append((w, h, data))
+
+    @property
+    def width(self):
+        return self.levels[0][0]
+
+    @property
+    def height(self):
+        return self.levels[0][1]
+
+    def tex_image_2d(self, target=GL_TEXTURE_2D):
+        """upload every mip level to the currently bound texture object"""
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for i, (w, h, data) in enumerate(self.levels):
+            glTexImage2D(target, i, self.internal_format, w, h, 0,
+                self.format, GL_UNSIGNED_BYTE, data)
+        glTexParameteri(target, GL_TEXTURE_MAX_LEVEL, len(self.levels) - 1)
+
+    def close(self):
+        """drop the levels and the memory map, which is unmapped once no
+        view of the level data is left; see tga.TGAImage.close"""
+        self.levels = []
+        self._map = None
+
+
+def open_cached(filename):
+    """return a CachedTexture for the image filename, building the cache
+    file first if there is none for the current contents of filename"""
+    path = cache_path(filename)
+    if not os.path.exists(path):
+        image = tga.load(filename)
+        try:
+            levels = build_mip_chain(image.as_array())
+            write_cache(path, levels, image.format, image.internal_format)
+        finally:
+            image.close()
+    return CachedTexture(path)
+
+
+def load_mipmapped_texture(filename, texture=None):
+    """load filename with all of its mip levels into a texture object
+
+    filename -> source .tga image
+    texture -> existing texture name to fill; by default a new one is made
+    Returns the texture name, left bound to GL_TEXTURE_2D with a trilinear
+    minification filter.
+    """
+    if texture is None:
+        texture = glGenTextures(1)
+    cached = open_cached(filename)
+    try:
+        glBindTexture(GL_TEXTURE_2D, texture)
+        cached.tex_image_2d(GL_TEXTURE_2D)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    finally:
+        cached.close()
+    return texture
+
+
+if __name__ == '__main__':
+    import glob
+    import shutil
+    import tempfile
+    import time
+
+    print 'downsample averages 2x2 blocks'
+    a = numpy.array([[[0], [4]], [[8], [12]]], numpy.uint8)
+    assert downsample(a).tolist() == [[[6]]]
+
+    print 'mip chain of a 4x2 image goes 4x2, 2x1, 1x1'
+    chain = build_mip_chain(numpy.zeros((2, 4, 3), numpy.uint8))
+    assert [c.shape[:2] for c in chain] == [(2, 4), (1, 2), (1, 1)]
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        files = sorted(glob.glob(os.path.join(here, '..', 'chapt*', '*', '*.tga')))
+        print 'Cold vs warm load of %d demo assets' % (len(files),)
+        for label in ('cold', 'warm'):
+            t = time.time()
+            for name in files:
+                cached = open_cached(name)
+                for w, h, data in cached.levels:
+                    data.sum()
+                cached.close()
+            print '  %s %8.2f ms/texture' % (label, (time.time() - t) * 1000.0 / len(files))
+
+        print 'Cached level 0 matches the source image'
+        image = tga.load(files[0])
+        cached = open_cached(files[0])
+        assert (cached.levels[0][2] == image.data).all()
+        assert len(cached.levels) == len(build_mip_chain(image.as_array()))
+        data = cached.levels[-1][2]
+        cached.close()
+        assert (data == build_mip_chain(image.as_array())[-1].ravel()).all()
+        image.close()
+    finally:
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,212 @@
+"""
+Tile-parallel execution of the imaging kernels across processes.
+
+An image is split into horizontal bands sized to fit in a core's cache, and
+the bands are processed by a pool of worker processes. Pixels never go
+through pickle: the source and destination live in shared memory that the
+workers map when the pool starts, and a job is just the kernel name, the
+image shapes and a band of rows. Each worker reads whatever source rows its
+kernel needs and writes only its own band of the destination, so no locking
+is required.
+
+The kernels are those of the imaging module (flip, zoom, isolate_channel,
+luminance and invert), with the same arguments.
+
+    engine = TileEngine()
+    gray = engine.luminance(pixels, imaging.BGR_ORDER)
+    engine.close()
+"""
+
+
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy
+
+import imaging
+
+
+# Aim for bands of about this many bytes, half of a typical per-core L2
+# cache, so a band of source and a band of destination stay cached together.
+TILE_BYTES = 128 * 1024
+
+
+# Band kernels. Each one gets the whole source and destination arrays and
+# fills dst[y0:y1].
+def _band_flip(src, dst, y0, y1):
+    h = src.shape[0]
+    dst[y0:y1] = src[h - y1:h - y0][::-1, ::-1]
+
+def _band_zoom(src, dst, y0, y1):
+    h, w = src.shape[:2]
+    height, width = dst.shape[:2]
+    rows = numpy.arange(y0, y1) * h // height
+    cols = numpy.arange(width) * w // width
+    dst[y0:y1] = src[rows[:, numpy.newaxis], cols]
+
+def _band_isolate_channel(src, dst, y0, y1, channel):
+    imaging.isolate_channel(src[y0:y1], channel, dst[y0:y1])
+
+def _band_luminance(src, dst, y0, y1, order):
+    imaging.luminance(src[y0:y1], order, dst[y0:y1])
+
+def _band_invert(src, dst, y0, y1):
+    imaging.invert(src[y0:y1], dst[y0:y1])
+
+_KERNELS = {
+    'flip': _band_flip,
+    'zoom': _band_zoom,
+    'isolate_channel': _band_isolate_channel,
+    'luminance': _band_luminance,
+    'invert': _band_invert,
+}
+
+
+# Worker process state, set up once by the pool initializer.
+_shared_src = None
+_shared_dst = None
+
+def _init_worker(src, dst):
+    global _shared_src, _shared_dst
+    _shared_src = src
+    _shared_dst = dst
+
+def _view(raw, shape):
+    count = int(numpy.prod(shape))
+    return numpy.frombuffer(raw, numpy.uint8, count).reshape(shape)
+
+def _run_band(job):
+    name, src_shape, dst_shape, y0, y1, args = job
+    src = _view(_shared_src, src_shape)
+    dst = _view(_shared_dst, dst_shape)
+    _KERNELS[name](src, dst, y0, y1, *args)
+
+
+class TileEngine(object):
+    """A process pool with shared source and destination image buffers.
+
+    processes -> number of worker processes; defaults to the CPU count
+    capacity -> initial size in bytes of each shared buffer. The buffers,
+        and with them the pool, are rebuilt when a larger image comes along.
+    tile_bytes -> target size of a band of destination rows
+    """
+
+    def __init__(self, processes=None, capacity=4 << 20, tile_bytes=TILE_BYTES):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.tile_bytes = tile_bytes
+        self.capacity = 0
+        self._pool = None
+        self._src = self._dst = None
+        self._reserve(capacity)
+
+    def _reserve(self, nbytes):
+        """make the shared buffers at least nbytes big, with a pool running"""
+        if nbytes > self.capacity:
+            # Workers only see buffers that exist when they start, so a
+            # bigger buffer means a new pool.
+            self.close()
+            self.capacity = nbytes
+            self._src = RawArray('B', nbytes)
+            self._dst = RawArray('B', nbytes)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes, _init_worker,
+                (self._src, self._dst))
+
+    def close(self):
+        """stop the worker processes; the next run starts them again"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, name, pixels, dst_shape, *args, **kw):
+        """apply kernel name to pixels and return the result
+
+        name -> one of flip, zoom, isolate_channel, luminance or invert
+        pixels -> (height, width, components) uint8 array
+        dst_shape -> shape of the result
+        args -> extra kernel arguments
+        out -> keyword; array of dst_shape to receive the result. By default
+            a new array is returned.
+        """
+        out = kw.pop('out', None)
+        pixels = numpy.asarray(pixels, numpy.uint8)
+        self._reserve(max(pixels.nbytes, int(numpy.prod(dst_shape))))
+        src = _view(self._src, pixels.shape)
+        dst = _view(self._dst, dst_shape)
+        src[...] = pixels
+
+        height = dst_shape[0]
+        row_bytes = max(1, dst.nbytes // max(1, height))
+        rows = max(1, self.tile_bytes // row_bytes)
+        jobs = [(name, pixels.shape, dst_shape, y0, min(height, y0 + rows), args)
+                for y0 in range(0, height, rows)]
+        if len(jobs) == 1:
+            # Not worth a trip through the pool
+            _KERNELS[name](src, dst, 0, height, *args)
+        else:
+            self._pool.map(_run_band, jobs, chunksize=max(1, len(jobs) // (4 * self.processes)))
+
+        if out is None:
+            return dst.copy()
+        out[...] = dst
+        return out
+
+    # The imaging kernels
+    def flip(self, pixels, out=None):
+        return self.run('flip', pixels, pixels.shape, out=out)
+
+    def zoom(self, pixels, width, height, out=None):
+        shape = (height, width) + pixels.shape[2:]
+        return self.run('zoom', pixels, shape, out=out)
+
+    def isolate_channel(self, pixels, channel, out=None):
+        return self.run('isolate_channel', pixels, pixels.shape, channel, out=out)
+
+    def luminance(self, pixels, order=imaging.BGR_ORDER, out=None):
+        return self.run('luminance', pixels, pixels.shape[:2], order, out=out)
+
+    def invert(self, pixels, out=None):
+        return self.run('invert', pixels, pixels.shape, out=out)
+
+
+if __name__ == '__main__':
+    import time
+
+    numpy.random.seed(1)
+    px = numpy.random.randint(0, 256, (1031, 517, 3)).astype(numpy.uint8)
+
+    print 'Tiled kernels match the single-process imaging kernels'
+    engine = TileEngine(processes=3, tile_bytes=16 * 1024)
+    assert (engine.flip(px) == imaging.flip(px)).all()
+    assert (engine.zoom(px, 800, 600) == imaging.zoom(px, 800, 600)).all()
+    assert (engine.isolate_channel(px, 2) == imaging.isolate_channel(px, 2)).all()
+    assert (engine.luminance(px) == imaging.luminance(px)).all()
+    assert (engine.invert(px) == imaging.invert(px)).all()
+    engine.close()
+
+    print 'Running after close starts a new pool'
+    assert (engine.invert(px) == imaging.invert(px)).all()
+    engine.close()
+
+    big = numpy.random.randint(0, 256, (4096, 4096, 3)).astype(numpy.uint8)
+    print 'Throughput on a %dx%d image' % big.shape[1::-1]
+    t = time.time()
+    for i in range(3):
+        imaging.zoom(big, 4096, 4096)
+    print '  %-12s %8.1f ms' % ('in process', (time.time() - t) * 1000.0 / 3)
+    counts = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    for n in counts:
+        engine = TileEngine(processes=n, capacity=big.nbytes)
+        engine.zoom(big, 4096, 4096)    # warm up the workers
+        t = time.time()
+        for i in range(3):
+            engine.zoom(big, 4096, 4096)
+        print '  %-12s %8.1f ms' % ('%d processes' % n, (time.time() - t) * 1000.0 / 3)
+        engine.close()
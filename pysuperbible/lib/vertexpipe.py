@@ -0,0 +1,271 @@
+"""
+Software vertex processing in vectorized batches.
+
+The Transform demo shows what the fixed function pipeline does to each
+vertex by doing it on the CPU: multiply by the modelview matrix, then hand
+the result to GL with an identity modelview. Done one vertex at a time with
+m3dTransformVector3 that costs several Python calls per vertex. A
+VertexPipeline does the same work for a whole Mesh with a few matrix
+products, a batch of rows at a time so the temporaries stay in cache, and
+can also light the vertices, fog them (see the fog module) and generate
+texture coordinates from them. The results are streamed to the GPU through
+a streambuffer.StreamBuffer, a private one or one shared by every pipeline
+in a demo.
+
+    pipe = VertexPipeline(mesh.torus_mesh(0.35, 0.15, 40, 20))
+    ...
+    pipe.process(transformationMatrix)
+    pipe.draw()
+"""
+
+
+import numpy
+from OpenGL.GL import *
+
+from streambuffer import StreamBuffer
+
+
+# Rows per batch. 4096 rows of float32 xyz is 48K, so a batch of input and
+# output fits in L2 together.
+BATCH = 4096
+
+
+def as_matrix(m):
+    """return a column-major 4x4 matrix (M3DMatrix44f, list or array) as a
+    (4, 4) float32 array laid out in the same order, i.e. the transpose of
+    the matrix. Row vectors times this array transform like M times column
+    vectors."""
+    return numpy.asarray(m[:], numpy.float32).reshape(4, 4)
+
+
+class DirectionalLight(object):
+    """A directional light for per-vertex diffuse lighting.
+
+    direction -> eye space direction towards the light
+    ambient -> RGBA added to every vertex
+    diffuse -> RGBA scaled by the cosine of the angle to the light
+    """
+
+    def __init__(self, direction, ambient=(0.2, 0.2, 0.2, 1.0),
+                 diffuse=(0.8, 0.8, 0.8, 1.0)):
+        d = numpy.asarray(direction, numpy.float32)
+        self.direction = d / numpy.sqrt(numpy.dot(d, d))
+        self.ambient = numpy.asarray(ambient, numpy.float32)
+        self.diffuse = numpy.asarray(diffuse, numpy.float32)
+
+
+class VertexPipeline(object):
+    """Transforms, lights and texgens the vertices of a Mesh on the CPU.
+
+    mesh -> a mesh.Mesh; positions are read from it, and it is drawn with
+        the processed streams in place of its own
+    batch -> rows processed per step
+    stream -> optional StreamBuffer to upload into, shared with other
+        dynamic meshes; its owner calls end_frame after the frame's draws.
+        By default the pipeline keeps one of its own.
+
+    Outputs, valid after process():
+    positions -> (n, 3) float32 eye space positions
+    colors -> (n, 4) float32 lit and/or fogged colors, if a light or fog
+        was given, else None so the mesh draws with its own
+    texcoords -> (n, k) float32 generated coordinates, if planes were
+        given, else None
+    """
+
+    def __init__(self, mesh, batch=BATCH, stream=None):
+        self.mesh = mesh
+        self.batch = batch
+        self.stream = stream
+        self._own_stream = stream is None
+        n = len(mesh)
+        self.positions = numpy.empty((n, 3), numpy.float32)
+        self.colors = None
+        self.texcoords = None
+        self._normals = None
+        self._dots = None
+        self._layout = None
+
+    def process(self, model, view=None, light=None, texgen=None, fog=None,
+                color=(1.0, 1.0, 1.0, 1.0)):
+        """run every vertex of the mesh through the pipeline
+
+        model -> column-major 4x4 model matrix
+        view -> optional column-major 4x4 view (camera) matrix, applied
+            after model
+        light -> optional DirectionalLight; needs mesh normals
+        texgen -> optional sequence of eye space planes (a, b, c, d), one
+            per generated coordinate, as for GL_EYE_LINEAR
+        fog -> optional fog.Fog to blend the colors with by eye depth; the
+            colors are the lit ones, or the mesh colors without a light
+        color -> RGBA fogged without a light when the mesh has no colors
+        """
+        mv = as_matrix(model)
+        if view is not None:
+            mv = numpy.dot(mv, as_matrix(view))
+        rotate = mv[:3, :3]
+        translate = mv[3, :3]
+
+        n = len(self.positions)
+        if light is not None or fog is not None:
+            if self.colors is None:
+                self.colors = numpy.empty((n, 4), numpy.float32)
+                self._normals = numpy.empty((min(n, self.batch), 3), numpy.float32)
+                self._dots = numpy.empty(min(n, self.batch), numpy.float32)
+        else:
+            # Leave the colors of an earlier call out of the upload
+            self.colors = self._normals = self._dots = None
+        if light is not None:
+            # Normals go through the inverse transpose of the upper 3x3
+            normal_matrix = numpy.linalg.inv(rotate).T.astype(numpy.float32)
+        if texgen is not None:
+            planes = numpy.asarray(texgen, numpy.float32).reshape(-1, 4)
+            if self.texcoords is None or self.texcoords.shape[1] != len(planes):
+                self.texcoords = numpy.empty((n, len(planes)), numpy.float32)
+            plane_matrix = numpy.ascontiguousarray(planes[:, :3].T)
+        else:
+            self.texcoords = None
+
+        src = self.mesh.positions
+        normals = self.mesh.normals
+        for start in range(0, n, self.batch):
+            end = min(n, start + self.batch)
+            out = self.positions[start:end]
+            numpy.dot(src[start:end], rotate, out)
+            out += translate
+            if light is not None:
+                self._light(normals[start:end], normal_matrix, light, start, end)
+            if fog is not None:
+                colors = self.colors[start:end]
+                if light is None:
+                    base = self.mesh.colors
+                    if base is None:
+                        colors[...] = color
+                    else:
+                        colors[:, 3] = 1.0
+                        colors[:, :base.shape[1]] = base[start:end]
+                # The eye looks down -z
+                depth = self._dots[:end - start]
+                numpy.negative(out[:, 2], depth)
+                fog.apply(colors, depth, depth)
+            if texgen is not None:
+                tc = self.texcoords[start:end]
+                numpy.dot(out, plane_matrix, tc)
+                tc += planes[:, 3]
+
+    def _light(self, normals, normal_matrix, light, start, end):
+        k = end - start
+        eye = self._normals[:k]
+        numpy.dot(normals, normal_matrix, eye)
+        # Scaled model matrices make the normals non-unit; renormalize like
+        # GL_NORMALIZE does.
+        length = self._dots[:k]
+        numpy.einsum('ij,ij->i', eye, eye, out=length)
+        numpy.sqrt(length, length)
+        numpy.maximum(length, 1e-12, length)
+        ndotl = numpy.dot(eye, light.direction)
+        ndotl /= length
+        numpy.maximum(ndotl, 0.0, ndotl)
+        colors = self.colors[start:end]
+        numpy.multiply(ndotl[:, numpy.newaxis], light.diffuse, colors)
+        colors += light.ambient
+
+    def upload(self):
+        """stream the processed arrays to the GPU"""
+        streams = [(name, a) for name, a in (('positions', self.positions),
+                   ('colors', self.colors), ('texcoords', self.texcoords))
+                   if a is not None]
+        if self._own_stream:
+            if self.stream is None:
+                # Room for a few frames in flight
+                self.stream = StreamBuffer(4 * sum(a.nbytes for name, a in streams))
+            # The last upload has been drawn by now
+            self.stream.end_frame()
+        # Object space normals mean nothing next to eye space positions;
+        # lighting, if any, is already in the colors.
+        layout = {'normals': None}
+        for name, a in streams:
+            vbo, offset = self.stream.write(a)
+            layout[name] = (vbo, offset, a.shape[1])
+        self._layout = layout
+
+    def draw(self, upload=True):
+        """draw the mesh from the processed streams. The modelview matrix
+        should be the identity, since the positions are already in eye
+        space.
+
+        upload -> send the arrays from the last process() first
+        """
+        if upload or self._layout is None:
+            self.upload()
+        self.mesh.draw(**self._layout)
+
+    def delete(self):
+        """free the stream, if the pipeline owns it"""
+        if self._own_stream and self.stream is not None:
+            self.stream.delete()
+            self.stream = None
+        self._layout = None
+
+
+if __name__ == '__main__':
+    import time
+
+    from math3d import M3DMatrix44f, M3DVector3f, m3dRotationMatrix44, \
+        m3dTransformVector3, m3dDegToRad
+    import mesh
+
+    print 'positions match m3dTransformVector3'
+    m = M3DMatrix44f()
+    m3dRotationMatrix44(m, m3dDegToRad(30.0), 0.0, 1.0, 0.0)
+    m[12], m[13], m[14] = 0.5, 0.0, -2.5
+    torus = mesh.torus_mesh(0.35, 0.15, 40, 20)
+    pipe = VertexPipeline(torus, batch=100)
+    pipe.process(m)
+    out = M3DVector3f()
+    for i in (0, 99, 100, len(torus) - 1):
+        m3dTransformVector3(out, M3DVector3f(*torus.positions[i].tolist()), m)
+        assert numpy.allclose(pipe.positions[i], out[:], atol=1e-5)
+
+    print 'view is applied after model'
+    view = numpy.identity(4, numpy.float32)
+    view[3, 2] = -1.0
+    m[14] = -1.5
+    pipe.process(m, view)
+    assert numpy.allclose(pipe.positions[len(torus) - 1], out[:], atol=1e-5)
+
+    print 'lighting and texgen follow the eye space vertices'
+    light = DirectionalLight((0.0, 0.0, 1.0), (0.1, 0.1, 0.1, 1.0), (1.0, 1.0, 1.0, 1.0))
+    pipe.process(m, view, light, [(1.0, 0.0, 0.0, 0.5), (0.0, 0.0, 1.0, 0.0)])
+    facing = torus.normals.dot(as_matrix(m)[:3, :3])[:, 2]
+    assert numpy.allclose(pipe.colors[:, 0], 0.1 + numpy.maximum(facing, 0.0), atol=1e-5)
+    assert numpy.allclose(pipe.texcoords[:, 0], pipe.positions[:, 0] + 0.5)
+    assert numpy.allclose(pipe.texcoords[:, 1], pipe.positions[:, 2])
+
+    print 'fog blends the lit colors by eye depth'
+    import fog
+    lit = pipe.colors.copy()
+    pipe.process(m, view, light, fog=fog.Fog(GL_LINEAR, 2.0, 3.0, color=(0.0, 0.0, 0.0)))
+    f = numpy.clip((3.0 + pipe.positions[:, 2]), 0.0, 1.0)
+    assert numpy.allclose(pipe.colors[:, :3], lit[:, :3] * f[:, numpy.newaxis], atol=1e-5)
+
+    print 'without a light or mesh colors, fog blends the base color'
+    assert pipe.mesh.colors is None
+    unlit = VertexPipeline(pipe.mesh)
+    unlit.process(m, view, fog=fog.Fog(GL_LINEAR, 2.0, 3.0, color=(0.0, 0.0, 0.0)))
+    assert numpy.allclose(unlit.colors[:, :3], f[:, numpy.newaxis], atol=1e-5)
+    unlit.process(m, view, fog=fog.Fog(GL_LINEAR, 2.0, 3.0), color=(0.5, 0.0, 1.0, 1.0))
+    assert numpy.allclose(unlit.colors[:, 0], 0.5 * f, atol=1e-5)
+    assert numpy.allclose(unlit.colors[:, 3], 1.0)
+
+    print 'a later call without light, fog or texgen drops their outputs'
+    pipe.process(m, view, light, [(1.0, 0.0, 0.0, 0.5)])
+    pipe.process(m, view)
+    assert pipe.colors is None and pipe.texcoords is None
+
+    n = 320
+    big = mesh.torus_mesh(0.35, 0.15, n, n)
+    pipe = VertexPipeline(big)
+    t = time.time()
+    for i in range(20):
+        pipe.process(m, view, light)
+    print '%d vertices: %.2f ms per transform and light' % (len(big), (time.time() - t) * 1000.0 / 20)
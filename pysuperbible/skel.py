@@ -18,6 +18,8 @@ from gltools import *
 from math3d import *
 from glframe import GLFrame
 from simple_menu import SimpleMenu
+from allocprof import AllocationProfiler
+from gltrace import GLRecorder
 
 
 def gl_vec(typ, *args):
@@ -65,9 +67,27 @@ class Window(pyglet.window.Window):
     # GL display lists stored by name
     dlists = {}
 
+    # Set to True to count the objects each frame allocates, and time
+    # garbage collections; a summary is printed when the window closes.
+    profile_allocations = False
+    allocations = None
+
+    # Set to a number of frames to record their GL calls to trace_file, for
+    # replay with lib/gltrace.py.
+    trace_frames = 0
+    trace_file = 'frames.gltrace'
+    tracer = None
+
     def __init__(self, w, h, title='Pyglet App'):
         super(Window, self).__init__(w, h, title)
 
+        if self.profile_allocations:
+            self.allocations = AllocationProfiler()
+            self.allocations.start()
+        if self.trace_frames:
+            self.tracer = GLRecorder(self.trace_file, self.trace_frames)
+            self.tracer.start()
+
         ## Init code here.
 
         pyglet.clock.schedule_interval(self._update, self.time_step)
@@ -103,6 +123,11 @@ class Window(pyglet.window.Window):
         if self.menu is not None:
             self._draw_menu()
 
+        if self.allocations is not None:
+            self.allocations.end_frame()
+        if self.tracer is not None and self.tracer.end_frame():
+            self.tracer = None
+
     def _draw_menu(self):
         """render the menu"""
         # Switch to orthographic view (Pyglet default), draw the menu, then
@@ -183,6 +208,11 @@ class Window(pyglet.window.Window):
         """event handler; on-exit code"""
         # Clean up our stuff then call Pyglet's handler.
         pyglet.clock.unschedule(self._update)
+        if self.allocations is not None:
+            self.allocations.stop()
+            self.allocations.report()
+        if self.tracer is not None:
+            self.tracer.stop()
         super(Window, self).on_close()
 
 